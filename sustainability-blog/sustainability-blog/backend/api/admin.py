@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import Snapshot, WebhookDelivery
 
-# Register your models here.
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'attempts', 'created_at', 'next_attempt_at', 'processed_at')
+    list_filter = ('status',)
+    readonly_fields = ('created_at', 'processed_at', 'locked_at')
+    ordering = ('-created_at',)
+
+
+@admin.register(Snapshot)
+class SnapshotAdmin(admin.ModelAdmin):
+    list_display = ('url', 'stale_at', 'rendered_at', 'attempts', 'failed_at')
+    search_fields = ('url',)
+    readonly_fields = ('tags', 'etag', 'generation', 'locked_at', 'rendered_at', 'attempts',
+                       'next_attempt_at', 'failed_at', 'last_error')
+    ordering = ('url',)
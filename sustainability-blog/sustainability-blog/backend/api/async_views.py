@@ -0,0 +1,181 @@
+"""
+Async read path for the public post and taxonomy endpoints.
+
+Under ASGI (``core.asgi``, with ``API_ASYNC_READS`` on) the list and
+detail routes of the post, category and tag viewsets are served by
+``async_read()`` views. They answer anonymous JSON ``GET`` requests with
+async cache lookups and async ORM queries, so a request waiting on the
+cache or the database does not hold a worker; the response body, headers
+and cache entries are the same as the viewset's. Everything else (writes,
+authenticated or browsable-API requests, search, sparse fields, cursor
+pagination, errors) is handed to the DRF viewset unchanged.
+
+The async path reuses the viewsets' own pieces (querysets, filters, cache
+tags, validators, serializers and ``api.projection``); only the steps
+that wait are awaited. Validators run the viewset's aggregate through
+``sync_to_async()``, which is what Django's async ORM methods do too.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.paginator import InvalidPage
+from django.http import HttpResponse
+from django.urls import URLPattern
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from .cache import aresponse_key, cache_entry, cached_response_hit, get_cache, get_timeout
+from .projection import ProjectedListMixin, get_projection
+
+# Router URL names served by async_read(), and the query parameters each
+# handles itself; any other parameter sends the request to the viewset
+ASYNC_ROUTES = {
+    'post-list': {'page', 'category', 'tag', 'is_featured', 'ordering'},
+    'post-detail': set(),
+    'category-list': {'page', 'ordering'},
+    'category-detail': set(),
+    'tag-list': {'page', 'ordering'},
+    'tag-detail': set(),
+}
+
+
+class AsyncRead:
+    """One anonymous GET through a viewset's list or retrieve action."""
+    renderer = JSONRenderer()
+
+    def __init__(self, view_func, request, args, kwargs):
+        # What the view function DRF's as_view() returns sets up per request
+        self.view = view = view_func.cls(**view_func.initkwargs)
+        view.action_map = view_func.actions
+        view.args, view.kwargs, view.format_kwarg = args, kwargs, None
+        view.headers = view.default_response_headers
+        view.request = view.initialize_request(request, *args, **kwargs)
+        # Set here instead of negotiated: accepts_json() already checked
+        view.request.accepted_renderer = self.renderer
+        view.request.accepted_media_type = self.renderer.media_type
+        # No credentials were sent (see is_anonymous())
+        view.request.user = AnonymousUser()
+        view.request._auth = None
+        self.request = view.request
+
+    async def response(self):
+        """The response, or None when the viewset has to answer instead."""
+        view = self.view
+        cacheable = view.is_cacheable(self.request)
+        if cacheable:
+            cache = get_cache()
+            key = await aresponse_key(self.request, view.get_cache_tags())
+            cached = await cache.aget(key)
+            if cached is not None:
+                return cached_response_hit(self.request, cached)
+
+        validators = None
+        if 'HTTP_IF_NONE_MATCH' in self.request.META or 'HTTP_IF_MODIFIED_SINCE' in self.request.META:
+            validators = await sync_to_async(view.get_validators)()
+            if validators is not None:
+                not_modified = get_conditional_response(
+                    self.request,
+                    etag=validators.etag,
+                    last_modified=validators.last_modified_timestamp(),
+                )
+                if not_modified is not None:
+                    return validators.apply(not_modified)
+
+        data = await (self.list() if view.action == 'list' else self.retrieve())
+        if data is None:
+            return None
+        response = HttpResponse(
+            self.renderer.render(data, self.renderer.media_type, view.get_renderer_context()),
+            content_type=self.renderer.media_type,
+        )
+        patch_vary_headers(response, ['Accept'])
+        validators = validators or await sync_to_async(view.get_validators)()
+        if validators is not None:
+            validators.apply(response)
+        if cacheable:
+            await cache.aset(key, cache_entry(response), timeout=get_timeout())
+            response['X-Cache'] = 'MISS'
+        return response
+
+    async def list(self):
+        view = self.view
+        queryset = view.filter_queryset(view.get_queryset())
+        projection = None
+        if isinstance(view, ProjectedListMixin):
+            projection = get_projection(view.get_serializer_class())
+            queryset = projection.values(queryset)
+
+        paginator = view.paginator
+        page_size = paginator.get_page_size(self.request)
+        pages = paginator.django_paginator_class(queryset, page_size)
+        pages.count = await queryset.acount()
+        try:
+            paginator.page = pages.page(paginator.get_page_number(self.request, pages))
+        except InvalidPage:
+            return None  # the viewset words the 404
+        paginator.request = self.request
+
+        rows = [row async for row in paginator.page.object_list]
+        if projection is not None:
+            data = await projection.arender(rows, view.get_serializer())
+        else:
+            data = view.get_serializer(rows, many=True).data
+        return paginator.get_paginated_response(data).data
+
+    async def retrieve(self):
+        view = self.view
+        queryset = view.filter_queryset(view.get_queryset())
+        lookup = {view.lookup_field: view.kwargs[view.lookup_field]}
+        try:
+            instance = await queryset.aget(**lookup)
+        except ObjectDoesNotExist:
+            return None
+        return view.get_serializer(instance).data
+
+
+def is_anonymous(request):
+    """No credentials any of the API's authentication classes could read."""
+    return ('HTTP_AUTHORIZATION' not in request.META
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES)
+
+
+def accepts_json(request):
+    # Browsers get the browsable API from the viewset
+    accept = request.META.get('HTTP_ACCEPT', '*/*')
+    return 'text/html' not in accept and 'format' not in request.GET
+
+
+def async_read(view, params):
+    """
+    Async view for the ``get`` action of the DRF viewset view `view`,
+    taking the query parameters in `params`; other requests go to `view`.
+    """
+    fallback = sync_to_async(view)
+
+    async def read(request, *args, **kwargs):
+        # A format suffix (posts.json) picks the renderer: left to the viewset
+        if (request.method == 'GET' and 'format' not in kwargs and is_anonymous(request)
+                and accepts_json(request) and params.issuperset(request.GET)):
+            response = await AsyncRead(view, request, args, kwargs).response()
+            if response is not None:
+                return response
+        return await fallback(request, *args, **kwargs)
+
+    # The viewset checks CSRF itself, for session-authenticated writes
+    read.csrf_exempt = True
+    read.cls, read.actions = view.cls, view.actions
+    return read
+
+
+def async_read_patterns(patterns):
+    """`patterns` (a DRF router's urls) with the ASYNC_ROUTES served by async_read()."""
+    result = []
+    for pattern in patterns:
+        if isinstance(pattern, URLPattern) and pattern.name in ASYNC_ROUTES:
+            pattern = URLPattern(
+                pattern.pattern, async_read(pattern.callback, ASYNC_ROUTES[pattern.name]),
+                pattern.default_args, pattern.name,
+            )
+        result.append(pattern)
+    return result
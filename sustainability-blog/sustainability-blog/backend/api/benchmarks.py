@@ -0,0 +1,303 @@
+"""
+Endpoint benchmarks for the public API and the content webhook.
+
+Requests go through the full Django stack in-process with the test
+client, against whatever database is configured, so the numbers cover
+routing, middleware, views, serialization and SQL but not the network or
+an application server. Each scenario records latency percentiles,
+serial throughput and the number of SQL queries per request.
+
+Results can be saved as a baseline (JSON) and later runs compared to it:
+a scenario regresses when it runs more queries than the baseline, or its
+p50 or p95 latency grows by more than a relative threshold (and a small
+absolute margin, so sub-millisecond noise does not count).
+
+run_wsgi() and run_asgi() measure throughput under concurrent clients
+instead, calling Django's WSGI and ASGI handlers directly (see the
+benchmark_concurrency command).
+"""
+import asyncio
+import hashlib
+import hmac
+import itertools
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connection
+from django.test import RequestFactory
+
+from blog.models import Category, Tag, Post
+
+BASELINE_VERSION = 1
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MIN_DELTA_MS = 1.0
+# Actions per request in the webhook-batch scenario
+WEBHOOK_BATCH_SIZE = 20
+
+
+class Scenario:
+    """
+    A named request. `requests` yields (method, path, kwargs) tuples for
+    the test client; scenarios that need settings changed name them in
+    `settings`.
+    """
+
+    def __init__(self, name, requests, status=200, settings=None):
+        self.name = name
+        self.requests = requests
+        self.status = status
+        self.settings = settings or {}
+
+
+def sign(body):
+    secret = getattr(settings, 'WEBHOOK_SECRET', '').encode()
+    return 'sha1=' + hmac.new(secret, body, hashlib.sha1).hexdigest()
+
+
+def webhook_requests(actions):
+    def requests():
+        for number in itertools.count():
+            payload = [
+                {'action': 'create_post', 'content': {
+                    'title': f'Benchmark delivery {number}-{i}',
+                    'content': 'Delivered by the benchmark. ' * 40,
+                    'category': 'Benchmark', 'tags': ['benchmark', f'benchmark-{i % 5}'],
+                }}
+                for i in range(actions)
+            ]
+            body = json.dumps(payload[0] if actions == 1 else {'actions': payload}).encode()
+            yield 'post', '/api/webhooks/content/', {
+                'data': body, 'content_type': 'application/json',
+                'HTTP_X_HUB_SIGNATURE': sign(body),
+            }
+    return requests
+
+
+def get(*paths):
+    def requests():
+        for path in itertools.cycle(paths):
+            yield 'get', path, {}
+    return requests
+
+
+def build_scenarios():
+    """The standard scenarios, parameterized from the current database."""
+    published = Post.objects.filter(status='published')
+    total = published.count()
+    if not total:
+        return []
+    # The busiest category and tag, so filtered lists have full pages
+    category = Category.objects.order_by('-published_post_count', 'id').first()
+    tag = Tag.objects.order_by('-published_post_count', 'id').first()
+    slugs = list(published.order_by('-created_at').values_list('slug', flat=True)[:50])
+    search = tag.name.split()[0] if tag else 'the'
+    middle_page = max(1, total // settings.REST_FRAMEWORK['PAGE_SIZE'] // 2)
+
+    scenarios = [
+        Scenario('post-list', get('/api/posts/')),
+        Scenario('post-list-deep-page', get(f'/api/posts/?page={middle_page}')),
+        Scenario('post-list-cursor', get('/api/posts/?pagination=cursor')),
+        Scenario('post-list-category', get(f'/api/posts/?category={category.slug}')),
+        Scenario('post-list-ordering', get('/api/posts/?ordering=-published_at')),
+        Scenario('post-list-title', get('/api/posts/?ordering=title')),
+        Scenario('post-list-sparse', get('/api/posts/?fields=title,slug,published_at')),
+        Scenario('post-search', get(f'/api/posts/?search={search}')),
+        Scenario('post-detail', get(*(f'/api/posts/{slug}/' for slug in slugs))),
+        Scenario('post-related', get(*(f'/api/posts/{slug}/related/' for slug in slugs))),
+        Scenario('category-list', get('/api/categories/')),
+        Scenario('tag-list', get('/api/tags/')),
+        Scenario('webhook-enqueue', webhook_requests(1), status=202),
+        Scenario('webhook-batch', webhook_requests(WEBHOOK_BATCH_SIZE),
+                 settings={'WEBHOOK_QUEUE_ENABLED': False}),
+    ]
+    if tag is not None:
+        scenarios.insert(4, Scenario('post-list-tag', get(f'/api/posts/?tag={tag.slug}')))
+    return scenarios
+
+
+def percentile(sorted_values, fraction):
+    """Linear-interpolated percentile of an already sorted list."""
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(timings, queries):
+    """Latency percentiles in ms, serial requests/s and queries per request."""
+    ordered = sorted(timings)
+    return {
+        'p50': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean': round(statistics.fmean(ordered) * 1000, 3),
+        'rps': round(len(ordered) / sum(ordered), 1) if sum(ordered) else 0.0,
+        'queries': queries,
+    }
+
+
+def run_scenario(client, scenario, requests, warmup):
+    """Time `requests` requests after `warmup` untimed ones; return summarize()."""
+    source = scenario.requests()
+
+    def send():
+        method, path, kwargs = next(source)
+        response = getattr(client, method)(path, **kwargs)
+        if response.status_code != scenario.status:
+            raise AssertionError(
+                f'{scenario.name}: {method.upper()} {path} returned '
+                f'{response.status_code}, expected {scenario.status}'
+            )
+
+    def count_query(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    for _ in range(warmup):
+        send()
+    # Counted with an execute wrapper rather than connection.queries, which
+    # depends on DEBUG and stops growing once its log is full
+    queries = []
+    with connection.execute_wrapper(count_query):
+        send()
+    timings = []
+    for _ in range(max(1, requests)):
+        started = time.perf_counter()
+        send()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings, len(queries))
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD, min_delta_ms=DEFAULT_MIN_DELTA_MS):
+    """
+    Return a list of regression messages for `results` against the
+    `baseline` results. Scenarios missing from either side are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(f'{name}: {result["queries"]} queries per request, '
+                               f'baseline {base["queries"]}')
+        for key in ('p50', 'p95'):
+            limit = max(base[key] * (1 + threshold), base[key] + min_delta_ms)
+            if result[key] > limit:
+                regressions.append(f'{name}: {key} {result[key]:.2f}ms, baseline '
+                                   f'{base[key]:.2f}ms (limit {limit:.2f}ms)')
+    return regressions
+
+
+def concurrency_summary(timings, elapsed, errors):
+    """Latency percentiles in ms, requests/s over the wall time and error count."""
+    ordered = sorted(timings)
+    return {
+        'p50': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99': round(percentile(ordered, 0.99) * 1000, 3),
+        'rps': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        'errors': errors,
+    }
+
+
+def run_wsgi(paths, clients, requests, workers):
+    """
+    `clients` threads send `requests` GETs in all, cycling through `paths`,
+    to a WSGI handler that serves `workers` requests at a time, like as many
+    gunicorn sync workers. Latency includes the wait for a free worker.
+    """
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    free_workers = threading.Semaphore(workers)
+    source = itertools.islice(itertools.cycle(paths), requests)
+    lock = threading.Lock()
+    timings, errors = [], [0]
+
+    def client():
+        while True:
+            with lock:
+                path = next(source, None)
+            if path is None:
+                return
+            environ = factory.get(path, secure=True).environ
+            started = time.perf_counter()
+            with free_workers:
+                status = []
+                response = handler(environ, lambda line, headers: status.append(line))
+                b''.join(response)
+                response.close()  # request_finished: closes or keeps the connection
+            elapsed = time.perf_counter() - started
+            with lock:
+                timings.append(elapsed)
+                errors[0] += not status[0].startswith('200')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for future in [pool.submit(client) for _ in range(clients)]:
+            future.result()
+    return concurrency_summary(timings, time.perf_counter() - started, errors[0])
+
+
+def asgi_scope(path):
+    path, _, query = path.partition('?')
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'https', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')],
+        'server': ('testserver', 443), 'client': ('127.0.0.1', 50000),
+    }
+
+
+async def asgi_get(application, path):
+    """Send one GET through `application`; returns the status code."""
+    done = asyncio.Event()
+    status = []
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body' and not message.get('more_body'):
+            done.set()
+
+    await application(asgi_scope(path), receive, send)
+    return status[0]
+
+
+def run_asgi(paths, clients, requests):
+    """`clients` coroutines send `requests` GETs in all to one ASGI handler."""
+    application = ASGIHandler()
+    source = itertools.islice(itertools.cycle(paths), requests)
+    timings, errors = [], [0]
+
+    async def client():
+        for path in source:
+            started = time.perf_counter()
+            status = await asgi_get(application, path)
+            timings.append(time.perf_counter() - started)
+            errors[0] += status != 200
+
+    async def main():
+        await asyncio.gather(*(client() for _ in range(clients)))
+
+    started = time.perf_counter()
+    asyncio.run(main())
+    return concurrency_summary(timings, time.perf_counter() - started, errors[0])
@@ -0,0 +1,188 @@
+"""
+Response cache for anonymous reads of the public API.
+
+Cached entries are the rendered JSON bytes of a list or retrieve response.
+Every entry depends on a few *tags* (e.g. ``posts:category:zero-waste`` or
+``post:solar-power-1a2b3c4d``) and its cache key embeds the current version
+of each tag. Invalidation never deletes entries: it gives the affected tags
+a new version, so only the keys built from those tags stop matching and the
+old entries age out on their own.
+
+Tags used by the viewsets:
+
+    posts:all               every post list and detail entry
+    posts:list              unfiltered (and searched) post lists
+    posts:category:<slug>   post lists filtered by that category
+    posts:tag:<slug>        post lists filtered by that tag
+    post:<slug>             a post detail entry
+    categories / tags       taxonomy lists
+    category:<slug> / tag:<slug>   taxonomy detail entries
+
+The write-side hooks live in ``api.signals``. Code that changes posts with
+``QuerySet.update()`` or ``bulk_create()`` reaches them through
+``blog.bulk.notify_bulk_change()``. Once new versions are stored,
+``tags_invalidated`` is sent with the tags, for other copies of the
+responses (``api.snapshots``) to follow.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+KEY_PREFIX = 'apicache'
+
+# Response headers stored with the cached body
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+# Sent after invalidate() gave `tags` new versions
+tags_invalidated = Signal()
+
+
+def get_cache():
+    return caches[getattr(settings, 'API_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'API_CACHE_TIMEOUT', 300)
+
+
+def tag_key(tag):
+    return f'{KEY_PREFIX}:tag:{tag}'
+
+
+def get_tag_versions(tags):
+    cache = get_cache()
+    keys = [tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        # Never fall back to a fixed default: an evicted tag must not bring
+        # back entries cached under an older version
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def aget_tag_versions(tags):
+    """get_tag_versions() through the cache's async API."""
+    cache = get_cache()
+    keys = [tag_key(tag) for tag in tags]
+    versions = await cache.aget_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        await cache.aset_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def build_response_key(request, tags, versions):
+    query = sorted(request.query_params.lists())
+    raw = repr((request.path, query, tags, versions))
+    return f'{KEY_PREFIX}:resp:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+
+def response_key(request, tags):
+    tags = sorted(set(tags))
+    return build_response_key(request, tags, get_tag_versions(tags))
+
+
+async def aresponse_key(request, tags):
+    tags = sorted(set(tags))
+    return build_response_key(request, tags, await aget_tag_versions(tags))
+
+
+def cached_response_hit(request, cached):
+    """The response for a cache entry: the stored body, or 304 if it matches."""
+    content, headers = cached
+    response = get_conditional_response(
+        request,
+        etag=headers.get('ETag'),
+        last_modified=parse_http_date_safe(headers.get('Last-Modified', '')),
+    ) or HttpResponse(content, content_type=request.accepted_media_type)
+    for name, value in headers.items():
+        response[name] = value
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def cache_entry(response):
+    """What cached_response_hit() needs of a rendered 200 response."""
+    return response.content, {name: response[name] for name in CACHED_HEADERS if name in response}
+
+
+def invalidate(tags):
+    """Give `tags` new versions once the current transaction commits."""
+    tags = set(tags)
+    if not tags:
+        return
+
+    def bump():
+        now = time.time_ns()
+        get_cache().set_many({tag_key(tag): now for tag in tags}, timeout=None)
+        tags_invalidated.send(sender=None, tags=tags)
+
+    transaction.on_commit(bump)
+
+
+def post_tags(slugs=(), category_slugs=(), tag_slugs=()):
+    """Tags to invalidate when posts with these slugs/taxonomy change."""
+    tags = {'posts:list'}
+    tags.update(f'post:{slug}' for slug in slugs if slug)
+    tags.update(f'posts:category:{slug}' for slug in category_slugs if slug)
+    tags.update(f'posts:tag:{slug}' for slug in tag_slugs if slug)
+    return tags
+
+
+class CachedReadMixin:
+    """
+    Serve anonymous JSON ``list``/``retrieve`` responses from the API cache.
+
+    Viewsets implement ``get_cache_tags()`` to name the tags their response
+    depends on. Responses carry ``X-Cache: HIT`` or ``MISS``. Validators set
+    by an inner ConditionalGetMixin are cached with the body, so a matching
+    conditional request on a hit is answered with 304 and no queries.
+    Setting ``API_CACHE_TIMEOUT`` to 0 turns the cache off.
+    """
+
+    def get_cache_tags(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def is_cacheable(self, request):
+        return (
+            get_timeout() != 0
+            and request.method == 'GET'
+            and not request.user.is_authenticated
+            and request.accepted_renderer.format == 'json'
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = response_key(request, self.get_cache_tags())
+        cached = cache.get(key)
+        if cached is not None:
+            return cached_response_hit(request, cached)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.accepted_renderer = request.accepted_renderer
+            response.accepted_media_type = request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            response.render()
+            cache.set(key, cache_entry(response), timeout=get_timeout())
+        response['X-Cache'] = 'MISS'
+        return response
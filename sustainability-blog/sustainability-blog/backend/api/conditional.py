@@ -0,0 +1,80 @@
+"""
+HTTP validators (ETag / Last-Modified) and 304 handling for read endpoints.
+
+Validators come from a single aggregate query over ``updated_at`` columns
+(plus the row count for collections), so a matching ``If-None-Match`` or
+``If-Modified-Since`` is answered without loading or serializing any rows.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class Validators:
+    """ETag and optional Last-Modified for one response."""
+
+    def __init__(self, request, parts, last_modified=None):
+        raw = repr((request.get_full_path(), request.accepted_renderer.format, parts))
+        self.etag = quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+        self.last_modified = last_modified
+
+    def last_modified_timestamp(self):
+        if self.last_modified is None:
+            return None
+        return int(self.last_modified.timestamp())
+
+    def apply(self, response):
+        response['ETag'] = f'W/{self.etag}'
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified_timestamp())
+        return response
+
+
+def latest(*timestamps):
+    timestamps = [ts for ts in timestamps if ts is not None]
+    return max(timestamps) if timestamps else None
+
+
+class ConditionalGetMixin:
+    """
+    Emit validators on ``list``/``retrieve`` and answer matching conditional
+    requests with 304.
+
+    Viewsets implement ``get_validators()`` returning a ``Validators`` or
+    None (no validators, e.g. the object does not exist). Collections should
+    not set ``last_modified``: deleting the newest row moves the maximum
+    timestamp backwards, which ``If-Modified-Since`` cannot detect.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if request.method != 'GET':
+            return handler(request, *args, **kwargs)
+
+        validators = None
+        if 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META:
+            validators = self.get_validators()
+            if validators is not None:
+                not_modified = get_conditional_response(
+                    request,
+                    etag=validators.etag,
+                    last_modified=validators.last_modified_timestamp(),
+                )
+                if not_modified is not None:
+                    return validators.apply(not_modified)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            validators = validators or self.get_validators()
+            if validators is not None:
+                validators.apply(response)
+        return response
@@ -0,0 +1,52 @@
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAdminUser
+from rest_framework.views import APIView
+from blog.export import gzip_chunks, ndjson_chunks, next_watermark
+
+TRUE_VALUES = ('1', 'true', 'yes')
+
+
+class ContentExportView(APIView):
+    """
+    Stream the NDJSON content export (see ``blog.export``) to staff users.
+
+    ``?since=<ISO 8601>`` limits it to rows changed after that time; the
+    ``X-Export-Watermark`` header is the value to pass next time.
+    ``?gzip=1`` sends it gzip-compressed.
+    """
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def perform_content_negotiation(self, request, force=False):
+        # The body is NDJSON whatever the Accept header says; renderers are
+        # only used for error responses
+        return super().perform_content_negotiation(request, force=True)
+
+    def get_since(self, request):
+        value = request.query_params.get('since')
+        if not value:
+            return None
+        since = parse_datetime(value)
+        if since is None:
+            raise ValidationError({'since': 'Expected an ISO 8601 date and time.'})
+        return timezone.make_aware(since) if timezone.is_naive(since) else since
+
+    def get(self, request):
+        since = self.get_since(request)
+        watermark = next_watermark()
+        chunks = ndjson_chunks(since, watermark=watermark)
+        filename = f'export-{timezone.now():%Y%m%dT%H%M%SZ}.ndjson'
+        content_type = 'application/x-ndjson'
+        if request.query_params.get('gzip', '').lower() in TRUE_VALUES:
+            chunks = gzip_chunks(chunks)
+            filename += '.gz'
+            content_type = 'application/gzip'
+
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['X-Export-Watermark'] = watermark.isoformat()
+        return response
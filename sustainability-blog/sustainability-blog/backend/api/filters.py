@@ -0,0 +1,25 @@
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.settings import api_settings
+from blog.search import search_posts, parse_terms
+
+
+class PostSearchFilter(BaseFilterBackend):
+    """
+    Ranked full-text search over the post search index (see blog.search).
+
+    Must run after OrderingFilter: unless the client asked for an explicit
+    ordering, matches are returned best-first.
+    """
+    search_param = api_settings.SEARCH_PARAM
+
+    def get_search_text(self, request):
+        return request.query_params.get(self.search_param, '')
+
+    def filter_queryset(self, request, queryset, view):
+        text = self.get_search_text(request)
+        if not parse_terms(text):
+            return queryset
+        queryset = search_posts(queryset, text)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('-search_rank', '-created_at', '-id')
+        return queryset
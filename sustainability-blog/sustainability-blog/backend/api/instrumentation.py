@@ -0,0 +1,359 @@
+"""
+Per-request timings: SQL query count and time, view time and render time.
+
+RequestTimingMiddleware wraps every database connection with an execute
+wrapper for the duration of a request and reports the numbers as
+
+* a ``Server-Timing`` header (``db``, ``view``, ``render``, ``total``),
+  shown by browser dev tools (``REQUEST_TIMING_HEADER``);
+* one JSON log line per request on the ``api.timing`` logger, at INFO,
+  or at WARNING when slower than ``REQUEST_TIMING_SLOW_MS``;
+* per-route latency histograms (``REQUEST_TIMING_HISTOGRAMS``), which
+  staff can read and reset at ``/api/metrics/requests/``;
+* a slow-query log: every query slower than ``SLOW_QUERY_MS`` is logged
+  on the ``api.slow_queries`` logger (a rotating file by default) with
+  its SQL, parameters, route and the project code that ran it. A sample
+  of them (``SLOW_QUERY_EXPLAIN_SAMPLE``) also gets the database's
+  EXPLAIN output, with ANALYZE when ``SLOW_QUERY_EXPLAIN_ANALYZE`` is on
+  and the backend supports it.
+
+``view`` runs from URL resolution until the view returns, so it includes
+the SQL the view ran and DRF serialization; ``render`` is the response
+rendering (JSON encoding) that follows. Streaming responses are timed
+until their headers are ready. Histograms live in process memory, so
+each worker process keeps its own.
+
+The middleware also runs natively under ASGI. There the execute wrappers
+are installed from the request's thread-sensitive executor thread, the
+one Django runs that request's database work in, since connections belong
+to the thread that uses them.
+
+The cost is two ``perf_counter()`` calls per query and a few dict updates
+per request, small enough to leave on under load. EXPLAIN runs on the
+request's own connection after the slow query returns, so it adds to
+that request's time only; ANALYZE runs the query a second time, which is
+why it is off by default.
+"""
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger('api.timing')
+slow_query_logger = logging.getLogger('api.slow_queries')
+
+# Upper bounds, in milliseconds, of the histogram buckets; the last bucket
+# counts everything slower
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Longer SQL (e.g. big IN lists) is cut short in the slow-query log
+MAX_LOGGED_SQL = 10000
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def stack_site():
+    """
+    'file:line in function' of the innermost project frame that led to the
+    current query. Frames past Django's cursor are execute wrappers (this
+    module's or others'), not the code that ran the query.
+    """
+    root = str(settings.BASE_DIR)
+    backends = os.path.join('django', 'db', 'backends', '')
+    site = None
+    for frame in traceback.extract_stack():
+        if backends in frame.filename:
+            break
+        if (frame.filename.startswith(root) and frame.filename != __file__
+                and 'site-packages' not in frame.filename):
+            site = f'{os.path.relpath(frame.filename, root)}:{frame.lineno} in {frame.name}'
+    return site
+
+
+def explain(connection, sql, params, analyze=False):
+    """
+    The database's plan for a SELECT, as a list of rows, or None when it
+    cannot be explained. Runs on the raw cursor, bypassing execute
+    wrappers, so the EXPLAIN is neither timed nor counted. Inside a
+    transaction it runs under a savepoint: a failed statement would
+    otherwise abort the caller's transaction on PostgreSQL.
+    """
+    if not connection.features.supports_explaining_query_execution:
+        return None
+    if not sql.lstrip()[:6].upper() == 'SELECT':
+        return None
+    try:
+        prefix = connection.ops.explain_query_prefix(analyze=True) if analyze else None
+    except ValueError:  # this backend has no ANALYZE option
+        prefix = None
+    prefix = prefix or connection.ops.explain_query_prefix()
+    savepoint = None
+    if not connection.get_autocommit() and connection.features.uses_savepoints:
+        savepoint = 'explain_plan'
+    with connection.cursor() as cursor:
+        raw = cursor.cursor
+        if savepoint:
+            raw.execute(connection.ops.savepoint_create_sql(savepoint))
+        try:
+            raw.execute(f'{prefix} {sql}', params)
+            plan = [list(row) for row in raw.fetchall()]
+        except Exception as e:
+            if savepoint:
+                raw.execute(connection.ops.savepoint_rollback_sql(savepoint))
+            return [f'EXPLAIN failed: {e}']
+        if savepoint:
+            raw.execute(connection.ops.savepoint_commit_sql(savepoint))
+        return plan
+
+
+class RequestTimer:
+    """Execute wrapper and stopwatch for one request; times are in seconds."""
+    __slots__ = ('request', 'slow', 'started', 'queries', 'db', 'view_started', 'view',
+                 'render_started', 'render', 'total')
+
+    def __init__(self, request=None):
+        self.request = request
+        slow_ms = get_setting('SLOW_QUERY_MS', 0)
+        self.slow = slow_ms / 1000 if slow_ms > 0 else None
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.view_started = self.render_started = None
+        self.view = self.render = self.total = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = execute(sql, params, many, context)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db += elapsed
+            if self.slow is not None and elapsed >= self.slow:
+                self.slow_query(context['connection'], sql, params, many, elapsed, failed)
+
+    def slow_query(self, connection, sql, params, many, elapsed, failed):
+        plan = None
+        sample = get_setting('SLOW_QUERY_EXPLAIN_SAMPLE', 0)
+        if not (failed or many) and sample > 0 and random.random() < sample:
+            plan = explain(connection, sql, params, get_setting('SLOW_QUERY_EXPLAIN_ANALYZE', False))
+        slow_query_logger.warning(json.dumps({
+            'ms': round(elapsed * 1000, 2),
+            'route': route_name(self.request) if self.request is not None else None,
+            'path': self.request.path if self.request is not None else None,
+            'site': stack_site(),
+            'database': connection.alias,
+            'sql': sql[:MAX_LOGGED_SQL],
+            # executemany() parameter lists can be huge; their size is enough
+            'params': f'<{len(params)} parameter sets>' if many else params,
+            'failed': failed,
+            'plan': plan,
+        }, default=str))
+
+    def view_returned(self):
+        now = time.perf_counter()
+        if self.view_started is not None:
+            self.view = now - self.view_started
+        self.render_started = now
+
+    def rendered(self, response):
+        self.render = time.perf_counter() - self.render_started
+
+    def finish(self):
+        now = time.perf_counter()
+        self.total = now - self.started
+        if self.view is None and self.view_started is not None:
+            # Not a template response: the view's time runs up to here
+            self.view = now - self.view_started
+
+    def metrics(self):
+        """[(name, milliseconds)] of the phases that ran."""
+        phases = [('db', self.db), ('view', self.view), ('render', self.render),
+                  ('total', self.total)]
+        return [(name, value * 1000) for name, value in phases if value is not None]
+
+
+class RouteHistograms:
+    """Thread-safe latency histograms and totals keyed by route."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+            self.since = time.time()
+
+    def record(self, route, status, total_ms, db_ms, queries):
+        bucket = bisect.bisect_left(self.buckets, total_ms)
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = {
+                    'count': 0, 'errors': 0, 'total_ms': 0.0, 'db_ms': 0.0,
+                    'queries': 0, 'max_ms': 0.0, 'buckets': [0] * (len(self.buckets) + 1),
+                }
+            stats['count'] += 1
+            stats['errors'] += status >= 500
+            stats['total_ms'] += total_ms
+            stats['db_ms'] += db_ms
+            stats['queries'] += queries
+            stats['max_ms'] = max(stats['max_ms'], total_ms)
+            stats['buckets'][bucket] += 1
+
+    def estimate(self, stats, fraction):
+        """Upper bound of the bucket holding the `fraction` quantile."""
+        rank = fraction * stats['count']
+        seen = 0
+        for bound, count in zip(self.buckets, stats['buckets']):
+            seen += count
+            if seen >= rank:
+                return round(min(bound, stats['max_ms']), 3)
+        return round(stats['max_ms'], 3)
+
+    def snapshot(self):
+        with self.lock:
+            routes = {route: dict(stats, buckets=list(stats['buckets']))
+                      for route, stats in self.routes.items()}
+            since = self.since
+        result = {}
+        for route, stats in sorted(routes.items()):
+            count = stats['count']
+            result[route] = {
+                'count': count,
+                'errors': stats['errors'],
+                'mean_ms': round(stats['total_ms'] / count, 3),
+                'db_mean_ms': round(stats['db_ms'] / count, 3),
+                'queries_mean': round(stats['queries'] / count, 2),
+                'max_ms': round(stats['max_ms'], 3),
+                'p50_ms': self.estimate(stats, 0.50),
+                'p95_ms': self.estimate(stats, 0.95),
+                'p99_ms': self.estimate(stats, 0.99),
+                'buckets': dict(zip([*map(str, self.buckets), '+Inf'], stats['buckets'])),
+            }
+        return {'pid': os.getpid(), 'since': since, 'routes': result}
+
+
+histograms = RouteHistograms()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return f'{request.method} <unresolved>'
+    return f'{request.method} {match.view_name or match.route}'
+
+
+class RequestTimingMiddleware:
+    """Time every request; see the module docstring. Best placed first in MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # A coroutine hook keeps Django from running it in a thread
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = request.request_timer = RequestTimer(request)
+        with ExitStack() as stack:
+            self.wrap_connections(stack, timer)
+            response = self.get_response(request)
+        timer.finish()
+        self.report(request, response, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = request.request_timer = RequestTimer(request)
+        stack = ExitStack()
+        await sync_to_async(self.wrap_connections)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        timer.finish()
+        self.report(request, response, timer)
+        return response
+
+    def wrap_connections(self, stack, timer):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.request_timer.view_started = time.perf_counter()
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        request.request_timer.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        request.request_timer.view_returned()
+        response.add_post_render_callback(request.request_timer.rendered)
+        return response
+
+    def report(self, request, response, timer):
+        metrics = timer.metrics()
+        if get_setting('REQUEST_TIMING_HEADER', True):
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={value:.1f}' + (f';desc="{timer.queries} queries"' if name == 'db' else '')
+                for name, value in metrics
+            )
+
+        route = route_name(request)
+        total_ms = timer.total * 1000
+        if get_setting('REQUEST_TIMING_HISTOGRAMS', True):
+            histograms.record(route, response.status_code, total_ms, timer.db * 1000, timer.queries)
+
+        level = logging.INFO
+        if total_ms > get_setting('REQUEST_TIMING_SLOW_MS', 500):
+            level = logging.WARNING
+        if logger.isEnabledFor(level):
+            logger.log(level, json.dumps({
+                'method': request.method,
+                'path': request.path,
+                'route': route,
+                'status': response.status_code,
+                'queries': timer.queries,
+                **{f'{name}_ms': round(value, 2) for name, value in metrics},
+            }))
+
+
+class RequestMetricsView(APIView):
+    """
+    Staff-only dump of this process's per-route request histograms.
+    ``DELETE`` starts them over.
+    """
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'enabled': get_setting('REQUEST_TIMING_HISTOGRAMS', True),
+            **histograms.snapshot(),
+        })
+
+    def delete(self, request):
+        histograms.reset()
+        return Response(status=204)
@@ -0,0 +1,128 @@
+import json
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+from blog.importer import Importer
+from blog.models import Post
+from blog.synthetic import synthetic_records
+from api.benchmarks import (
+    BASELINE_VERSION, DEFAULT_MIN_DELTA_MS, DEFAULT_THRESHOLD, build_scenarios, compare, run_scenario,
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API endpoints: latency percentiles, throughput and queries per request'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed requests per scenario before timing')
+        parser.add_argument('--only',
+                            help='Comma-separated scenario names to run (default: all)')
+        parser.add_argument('--posts', type=int, default=0,
+                            help='Seed this many synthetic posts for the run (rolled back after)')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for --posts')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the API response cache on (default: measure uncached)')
+        parser.add_argument('--baseline',
+                            default=os.path.join(settings.BASE_DIR, 'benchmarks', 'api-baseline.json'),
+                            help='Baseline file for --save and --check')
+        parser.add_argument('--save', action='store_true',
+                            help='Store the results as the new baseline')
+        parser.add_argument('--check', action='store_true',
+                            help='Fail if a scenario regressed against the baseline')
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='Allowed relative p50/p95 slowdown for --check')
+        parser.add_argument('--min-delta-ms', type=float, default=DEFAULT_MIN_DELTA_MS,
+                            help='Slowdowns below this many ms never count as regressions')
+
+    def handle(self, *args, **options):
+        overrides = {
+            'DEBUG': False,  # DEBUG records every query, which skews timings
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        if not options['cache']:
+            overrides['API_CACHE_TIMEOUT'] = 0
+
+        # Seeded posts and webhook writes are rolled back when the run finishes
+        with transaction.atomic(), override_settings(**overrides):
+            if options['posts'] > 0:
+                self.seed(options['posts'], options['seed'])
+            results = self.run(options)
+            meta = {
+                'version': BASELINE_VERSION,
+                'vendor': connection.vendor,
+                'published_posts': Post.objects.filter(status='published').count(),
+                'requests': options['requests'],
+                'cache': options['cache'],
+                'created': timezone.now().isoformat(),
+            }
+            transaction.set_rollback(True)
+
+        if options['check']:
+            self.check_baseline(options, meta, results)
+        if options['save']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['baseline'])), exist_ok=True)
+            with open(options['baseline'], 'w') as f:
+                json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+                f.write('\n')
+            self.stdout.write(f'Baseline saved to {options["baseline"]}')
+
+    def seed(self, posts, seed):
+        self.stdout.write(f'Seeding {posts} temporary post(s)...')
+        importer = Importer(create_authors=True)
+        for number, record in enumerate(synthetic_records(posts, seed=seed), 1):
+            importer.add(number, record)
+        importer.flush()
+
+    def run(self, options):
+        scenarios = build_scenarios()
+        if not scenarios:
+            raise CommandError('No published posts; pass --posts or run seed_db --posts first')
+        if options['only']:
+            names = {name.strip() for name in options['only'].split(',')}
+            unknown = names - {scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f'Unknown scenario(s): {", ".join(sorted(unknown))}')
+            scenarios = [scenario for scenario in scenarios if scenario.name in names]
+
+        client = Client()
+        results = {}
+        self.stdout.write(
+            f'{"scenario":<22} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8}'
+        )
+        for scenario in scenarios:
+            with override_settings(**scenario.settings):
+                try:
+                    result = run_scenario(client, scenario, options['requests'], options['warmup'])
+                except AssertionError as e:
+                    raise CommandError(str(e))
+            results[scenario.name] = result
+            self.stdout.write(
+                f'{scenario.name:<22} {result["p50"]:>8.2f} {result["p95"]:>8.2f} '
+                f'{result["p99"]:>8.2f} {result["rps"]:>8.1f} {result["queries"]:>8}'
+            )
+        return results
+
+    def check_baseline(self, options, meta, results):
+        try:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f'No baseline at {options["baseline"]}; run with --save first')
+        for key in ('vendor', 'published_posts', 'cache'):
+            if baseline['meta'].get(key) != meta[key]:
+                self.stderr.write(self.style.WARNING(
+                    f'Baseline {key} was {baseline["meta"].get(key)!r}, now {meta[key]!r}; '
+                    'timings may not be comparable'
+                ))
+        regressions = compare(results, baseline['results'],
+                              options['threshold'], options['min_delta_ms'])
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
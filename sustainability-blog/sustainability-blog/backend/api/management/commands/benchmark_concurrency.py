@@ -0,0 +1,102 @@
+import logging
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from blog.models import Category, Post
+from api.benchmarks import run_asgi, run_wsgi
+
+
+def default_paths():
+    published = Post.objects.filter(status='published')
+    slugs = list(published.order_by('-created_at').values_list('slug', flat=True)[:20])
+    if not slugs:
+        return []
+    category = Category.objects.order_by('-published_post_count', 'id').first()
+    return [
+        '/api/posts/',
+        *(f'/api/posts/{slug}/' for slug in slugs[:5]),
+        f'/api/posts/?category={category.slug}',
+        '/api/categories/',
+        '/api/tags/',
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Compare API throughput under concurrent clients between the WSGI '
+            'setup (sync views, a fixed number of workers) and the ASGI async read path')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16,
+                            help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=400,
+                            help='Requests per server, spread over the clients')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Requests the WSGI server handles at once (sync workers)')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to request (repeatable; default: a mix of list and detail reads)')
+        parser.add_argument('--only', choices=['wsgi', 'asgi'],
+                            help='Run one server only')
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the API response cache on (default: measure uncached)')
+        parser.add_argument('--db-latency-ms', type=float, default=0,
+                            help='Add this much latency to every query, like a database '
+                                 'across the network')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or default_paths()
+        if not paths:
+            raise CommandError('No published posts; run seed_db --posts first')
+        overrides = {
+            'DEBUG': False,  # DEBUG records every query, which skews timings
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+        }
+        if not options['cache']:
+            overrides['API_CACHE_TIMEOUT'] = 0
+
+        latency = options['db_latency_ms'] / 1000
+
+        def add_latency(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def wrap_connection(sender, connection, **kwargs):
+            connection.execute_wrappers.append(add_latency)
+
+        servers = {
+            'wsgi': ('core.urls', lambda: run_wsgi(
+                paths, options['clients'], options['requests'], options['workers'])),
+            'asgi': ('core.async_urls', lambda: run_asgi(
+                paths, options['clients'], options['requests'])),
+        }
+        if options['only']:
+            servers = {options['only']: servers[options['only']]}
+
+        self.stdout.write(
+            f'{len(paths)} path(s), {options["clients"]} clients, {options["requests"]} '
+            f'requests per server, {options["workers"]} WSGI workers'
+        )
+        self.stdout.write(
+            f'{"server":<8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7}'
+        )
+        # Each client thread opens its own connections; start from none so
+        # every one of them gets the latency wrapper
+        connections.close_all()
+        if latency:
+            connection_created.connect(wrap_connection)
+        # One request log line per request would drown the table
+        timing_logger = logging.getLogger('api.timing')
+        timing_logger.disabled = True
+        try:
+            for name, (urlconf, run) in servers.items():
+                with override_settings(ROOT_URLCONF=urlconf, **overrides):
+                    result = run()
+                self.stdout.write(
+                    f'{name:<8} {result["rps"]:>8.1f} {result["p50"]:>8.2f} '
+                    f'{result["p95"]:>8.2f} {result["p99"]:>8.2f} {result["errors"]:>7}'
+                )
+        finally:
+            timing_logger.disabled = False
+            connection_created.disconnect(wrap_connection)
@@ -0,0 +1,88 @@
+import statistics
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from blog.bulk import set_post_tags
+from blog.models import Category, Tag, Post
+from api.projection import ListProjection
+from api.serializers import PostListSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare PostListSerializer with the values() projection across page sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50,100,250,500',
+                            help='Comma-separated page sizes')
+        parser.add_argument('--repeat', type=int, default=7,
+                            help='Timed runs per page size; the median is reported')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['sizes'].split(',')})
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        self.repeat = max(1, options['repeat'])
+
+        # Synthetic posts, if needed, are rolled back when the run finishes
+        with transaction.atomic():
+            missing = sizes[-1] - self.queryset().count()
+            if missing > 0:
+                self.stdout.write(f'Creating {missing} temporary post(s)...')
+                self.create_posts(missing)
+            self.run(sizes)
+            transaction.set_rollback(True)
+
+    def queryset(self):
+        # The shape PostViewSet lists with
+        return Post.objects.filter(status='published').select_related(
+            'author', 'category'
+        ).prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id'))
+        ).order_by('-created_at')
+
+    def create_posts(self, count):
+        author, _ = User.objects.get_or_create(username='benchmark')
+        category, _ = Category.objects.get_or_create(
+            slug='benchmark', defaults={'name': 'Benchmark'}
+        )
+        tags = [Tag.objects.get_or_create(slug=f'benchmark-{i}', defaults={'name': f'benchmark {i}'})[0]
+                for i in range(5)]
+        posts = Post.objects.bulk_create([
+            Post(title=f'Benchmark post {i}', slug=f'benchmark-post-{i}', content='...' * 200,
+                 excerpt='An excerpt of typical length for a list card.', author=author,
+                 category=category, status='published', published_at=timezone.now())
+            for i in range(count)
+        ])
+        set_post_tags({post.id: [tag.id for tag in tags[:1 + post.id % 5]] for post in posts},
+                      replace=False)
+
+    def measure(self, render):
+        timings = []
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000
+
+    def run(self, sizes):
+        projection = ListProjection(PostListSerializer)
+        renderer = JSONRenderer()
+        # Both timings include the page query and JSON rendering
+        self.stdout.write(f'{"size":>6} {"serializer ms":>14} {"projection ms":>14} {"speedup":>8}')
+        for size in sizes:
+            page = self.queryset()[:size]
+            serializer_ms = self.measure(
+                lambda: renderer.render(PostListSerializer(list(page), many=True).data)
+            )
+            projection_ms = self.measure(
+                lambda: renderer.render(projection.render(projection.values(page)))
+            )
+            self.stdout.write(
+                f'{size:>6} {serializer_ms:>14.2f} {projection_ms:>14.2f} '
+                f'{serializer_ms / projection_ms:>7.1f}x'
+            )
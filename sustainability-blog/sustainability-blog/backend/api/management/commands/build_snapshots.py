@@ -0,0 +1,100 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from api.models import Snapshot
+from api.snapshots import (
+    brotli, build, build_in_worker, claim_batch, mark_all_stale, retry_failed, sync, write_manifest,
+)
+
+class Command(BaseCommand):
+    help = 'Render the stale static JSON snapshots of the public API (see api.snapshots)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Worker processes rendering snapshots; 0 renders in this process')
+        parser.add_argument('--all', action='store_true',
+                            help='Render every snapshot, stale or not')
+        parser.add_argument('--watch', action='store_true',
+                            help='Keep running, rendering snapshots as writes make them stale')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when nothing is stale (--watch)')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Render the snapshots that were given up after failing again')
+
+    def handle(self, *args, **options):
+        if not settings.SNAPSHOTS_ENABLED:
+            self.stderr.write(self.style.WARNING(
+                'SNAPSHOTS_ENABLED is off: writes will not mark snapshots stale'
+            ))
+        if brotli is None:
+            self.stderr.write(self.style.WARNING('brotli is not installed; writing .gz copies only'))
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        if options['retry_failed']:
+            self.stdout.write(f'Requeued {retry_failed()} failed snapshot(s)')
+        if options['all']:
+            mark_all_stale()
+        processes = max(0, options['processes'])
+        pool = None
+        if processes:
+            # Forked workers must not share this process's connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+        try:
+            self.run(pool, processes, options)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def run(self, pool, processes, options):
+        totals = {'written': 0, 'unchanged': 0, 'removed': 0, 'failed': 0}
+        started = time.monotonic()
+        synced = False
+        while not self.stopping:
+            # New posts and categories show up as stale lists
+            if not synced and (Snapshot.objects.filter(stale_at__isnull=False).exists()
+                               or not Snapshot.objects.exists()):
+                added, removed = sync()
+                synced = True
+                if added or removed:
+                    self.stdout.write(f'{added} snapshot(s) added, {removed} removed')
+            claimed = claim_batch(max(1, processes) * 8)
+            # Failed snapshots are not due until their backoff has passed,
+            # so a run without --watch ends once only those are left
+            if not claimed:
+                if synced or not options['watch']:
+                    write_manifest()
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Snapshots: {totals['written']} written, {totals['unchanged']} unchanged, "
+                        f"{totals['removed']} removed, {totals['failed']} failed "
+                        f"in {time.monotonic() - started:.2f}s"
+                    ))
+                    retrying = Snapshot.objects.filter(failed_at=None).exclude(next_attempt_at=None).count()
+                    given_up = Snapshot.objects.exclude(failed_at=None).count()
+                    if retrying or given_up:
+                        self.stderr.write(self.style.WARNING(
+                            f'{retrying} failed snapshot(s) waiting to be retried, {given_up} given up'
+                        ))
+                if not options['watch']:
+                    break
+                close_old_connections()
+                time.sleep(options['poll_interval'])
+                totals = dict.fromkeys(totals, 0)
+                started = time.monotonic()
+                synced = False
+                continue
+            results = pool.map(build_in_worker, claimed) if pool else map(build, claimed)
+            for url, outcome in results:
+                totals[outcome] += 1
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'  {url}: {outcome}')
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,52 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from api.models import WebhookDelivery
+from api.webhook_queue import claim_batch, process_in_thread, requeue_dead
+
+class Command(BaseCommand):
+    help = 'Process queued content webhook deliveries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help='Number of deliveries processed in parallel; deliveries '
+                                 'touching the same post still run one after another')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the due deliveries and exit')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Move dead-lettered deliveries back to the queue first')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            self.stdout.write(f'Requeued {requeue_dead()} dead deliveries')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        concurrency = max(1, options['concurrency'])
+        # 'processing': lost to another worker after the lease ran out
+        totals = {'done': 0, 'pending': 0, 'dead': 0, 'processing': 0}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while not self.stopping:
+                claimed = claim_batch(concurrency * 4)
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                for delivery in pool.map(process_in_thread, claimed):
+                    totals[delivery.status] += 1
+                    style = self.style.SUCCESS if delivery.status == 'done' else self.style.WARNING
+                    self.stdout.write(style(f'{delivery}: attempt {delivery.attempts}'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed deliveries: {totals['done']} done, {totals['pending']} retrying, "
+            f"{totals['dead']} dead; {WebhookDelivery.objects.filter(status='pending').count()} pending"
+        ))
+
+    def stop(self, signum, frame):
+        self.stopping = True
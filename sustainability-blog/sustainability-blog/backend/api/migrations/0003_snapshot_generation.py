@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshot',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,3 +1,61 @@
 from django.db import models
 
-# Create your models here.
+class WebhookDelivery(models.Model):
+    """A raw content webhook delivery waiting for (or done with) processing."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('dead', 'Dead'),
+    ]
+
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    result = models.TextField(blank=True)
+    # Posts the delivery updates or deletes; it is not claimed while an
+    # earlier unfinished delivery touches one of them
+    post_ids = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'webhook deliveries'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='api_delivery_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Delivery {self.pk} ({self.status})"
+
+
+class Snapshot(models.Model):
+    """A pre-rendered API response written under SNAPSHOT_ROOT (see api.snapshots)."""
+    url = models.CharField(max_length=500, unique=True)
+    # API cache tags the response depends on
+    tags = models.JSONField(default=list)
+    etag = models.CharField(max_length=100, blank=True)
+    # Set when a write made the snapshot out of date; None when current
+    stale_at = models.DateTimeField(blank=True, null=True)
+    # Bumped by every write that affects the snapshot, stale or not; a build
+    # only marks it current if no write came in while it rendered
+    generation = models.PositiveIntegerField(default=0)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    rendered_at = models.DateTimeField(blank=True, null=True)
+    # Failed renders since the last success; retried with backoff until
+    # SNAPSHOT_MAX_ATTEMPTS, then given up (failed_at) until the next write
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    failed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stale_at'], name='api_snapshot_stale_idx'),
+        ]
+
+    def __str__(self):
+        return self.url
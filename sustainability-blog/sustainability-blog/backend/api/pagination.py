@@ -0,0 +1,169 @@
+import base64
+import json
+from datetime import datetime
+
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """
+    Planner row estimate for `queryset`, or None when the database has none.
+
+    Cheap on PostgreSQL (no rows are read), but can be off by a wide margin
+    for selective filters; use it for "about N results" style UI only.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a descending timestamp with an ``id`` tiebreak.
+
+    Each page is a ``WHERE (field, id) < (value, id) ... LIMIT n`` query, so
+    deep pages cost the same as the first one and no COUNT(*) is run unless
+    the client asks for ``?count=exact`` (or ``?count=estimate``).
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    orderings = ('-created_at', '-published_at')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = api_settings.PAGE_SIZE
+        self.field = self.get_ordering_field(queryset)
+        self.count = self.get_count(queryset, request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor['reverse']
+
+        if cursor is not None:
+            queryset = queryset.filter(self.position_filter(cursor['value'], cursor['id'], reverse))
+        if reverse:
+            order = [F(self.field).asc(nulls_first=True), 'id']
+        else:
+            order = [F(self.field).desc(nulls_last=True), '-id']
+
+        rows = list(queryset.order_by(*order)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_ordering_field(self, queryset):
+        ordering = queryset.query.order_by[0] if queryset.query.order_by else None
+        if ordering not in self.orderings:
+            raise ValidationError({
+                api_settings.ORDERING_PARAM: 'Cursor pagination supports ordering by '
+                + ' or '.join(self.orderings) + ' only.'
+            })
+        return ordering.lstrip('-')
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def position_filter(self, value, pk, reverse):
+        field = self.field
+        if not reverse:
+            if value is None:
+                return Q(**{f'{field}__isnull': True, 'id__lt': pk})
+            return (Q(**{f'{field}__lt': value})
+                    | Q(**{field: value, 'id__lt': pk})
+                    | Q(**{f'{field}__isnull': True}))
+        if value is None:
+            return Q(**{f'{field}__isnull': False}) | Q(**{f'{field}__isnull': True, 'id__gt': pk})
+        return Q(**{f'{field}__gt': value}) | Q(**{field: value, 'id__gt': pk})
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = datetime.fromisoformat(data['v']) if data['v'] is not None else None
+            return {'value': value, 'id': int(data['id']), 'reverse': bool(data.get('r'))}
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        # Rows are model instances or values() dicts (see api.projection)
+        if isinstance(row, dict):
+            value, pk = row[self.field], row['id']
+        else:
+            value, pk = getattr(row, self.field), row.id
+        data = {'v': value.isoformat() if value is not None else None, 'id': pk}
+        if reverse:
+            data['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(data).encode()).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer', 'nullable': True},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class PostPagination(PageNumberPagination):
+    """
+    Page-number pagination, switching to KeysetPagination when the client
+    sends ``?pagination=cursor`` or follows a ``?cursor=`` link.
+    """
+    mode_query_param = 'pagination'
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                or KeysetPagination.cursor_query_param in request.query_params):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,299 @@
+"""
+values()-based fast path for list endpoints.
+
+A ModelSerializer list builds a model instance per row (plus one per
+select_related or prefetched relation) and runs every DRF field's
+get_attribute() and to_representation(). On list pages that dominates the
+request's CPU time. ListProjection reads the columns the serializer needs
+with one values() query, fetches many-to-many children with one more query
+grouped in a single pass, and assembles the same nested dicts directly.
+Only fields whose output differs from the database value (datetimes,
+floats) call their DRF field's to_representation(), so the rendered JSON is
+byte-identical to the serializer's. Relations rendered as primary keys
+(see ``api.sparse``) read the foreign key or through-table column.
+
+The plan is compiled from the serializer's own fields. A field type it
+cannot reproduce raises ImproperlyConfigured on first use rather than
+silently diverging from the serializer.
+"""
+import copy
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.response import Response
+
+# to_representation() returns the database value unchanged for these...
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField, serializers.CharField, serializers.ChoiceField,
+    serializers.IntegerField, serializers.JSONField,
+)
+# ...and has to run for these
+CONVERTED_FIELDS = (serializers.DateTimeField, serializers.FloatField)
+
+VALUE, NESTED, MANY, METHOD = range(4)
+
+
+class Row:
+    """Attribute access to a values() row, for SerializerMethodField methods."""
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __getattr__(self, name):
+        try:
+            return self.row[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def readable_fields(serializer):
+    return [(key, field) for key, field in serializer.fields.items() if not field.write_only]
+
+
+def render_values(plan, row, converters):
+    data = {}
+    for key, column, field in plan:
+        value = row[column]
+        data[key] = value if field is None or value is None else converters[field](value)
+    return data
+
+
+class ListProjection:
+    """Renders `serializer_class(many=True)` output from values() rows."""
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        self.serializer_class = serializer_class
+        self.model = serializer.Meta.model
+        self.pk_column = self.model._meta.pk.attname
+        # Ordered set: keeps the generated SQL stable between processes
+        self.columns = {self.pk_column: None}
+        self.converted_fields = []
+        self.plan = []
+        for key, field in readable_fields(serializer):
+            if isinstance(field, serializers.ListSerializer):
+                plan = self.compile_values(field.child, f'{self.target_name(key, field)}__')
+                self.plan.append((key, MANY, self.compile_many(key, field, plan)))
+            elif isinstance(field, serializers.ManyRelatedField):
+                self.primary_keys_only(key, field.child_relation)
+                self.plan.append((key, MANY, self.compile_many(key, field, None)))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                self.primary_keys_only(key, field)
+                column = self.model._meta.get_field(field.source).attname
+                self.columns[column] = None
+                self.plan.append((key, VALUE, (column, None)))
+            elif isinstance(field, serializers.BaseSerializer):
+                self.plan.append((key, NESTED, self.compile_nested(field)))
+            elif isinstance(field, serializers.SerializerMethodField):
+                self.plan.append((key, METHOD, field.method_name))
+            else:
+                column = field.source.replace('.', '__')
+                self.columns[column] = None
+                self.plan.append((key, VALUE, (column, self.converted_field(key, field))))
+
+    def converted_field(self, key, field):
+        """Return `field` if its values need to_representation(), else None."""
+        if isinstance(field, CONVERTED_FIELDS):
+            self.converted_fields.append(field)
+            return field
+        if isinstance(field, PASSTHROUGH_FIELDS):
+            return None
+        raise ImproperlyConfigured(
+            f'{self.serializer_class.__name__}.{key}: cannot project '
+            f'{type(field).__name__} fields'
+        )
+
+    def compile_values(self, serializer, prefix):
+        plan = []
+        for key, field in readable_fields(serializer):
+            if isinstance(field, (serializers.BaseSerializer, serializers.SerializerMethodField)):
+                raise ImproperlyConfigured(
+                    f'{self.serializer_class.__name__}: cannot project nested field '
+                    f'{type(serializer).__name__}.{key}'
+                )
+            column = prefix + field.source.replace('.', '__')
+            plan.append((key, column, self.converted_field(key, field)))
+        return plan
+
+    def compile_nested(self, field):
+        relation = self.model._meta.get_field(field.source)
+        plan = self.compile_values(field, f'{field.source}__')
+        # The foreign key column identifies repeats and unset relations
+        self.columns[relation.attname] = None
+        self.columns.update((column, None) for _, column, _ in plan)
+        return plan, relation.attname
+
+    def primary_keys_only(self, key, field):
+        if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.pk_field is not None:
+            raise ImproperlyConfigured(
+                f'{self.serializer_class.__name__}.{key}: cannot project '
+                f'{type(field).__name__} fields'
+            )
+
+    def m2m_relation(self, key, field):
+        relation = self.model._meta.get_field(field.source)
+        if not relation.many_to_many or relation.auto_created:
+            raise ImproperlyConfigured(
+                f'{self.serializer_class.__name__}.{key}: only forward many-to-many '
+                'relations can be projected'
+            )
+        return relation
+
+    def target_name(self, key, field):
+        return self.m2m_relation(key, field).m2m_reverse_field_name()
+
+    def compile_many(self, key, field, plan):
+        """`plan` renders each child; None lists the children's primary keys."""
+        relation = self.m2m_relation(key, field)
+        source, target = relation.m2m_field_name(), relation.m2m_reverse_field_name()
+        return relation.remote_field.through, source, target, plan
+
+    def values(self, queryset):
+        """
+        Return `queryset` as the values() rows that render() expects. The
+        ordering columns are selected too, for keyset pagination cursors.
+        """
+        ordering = [
+            name.lstrip('-') for name in queryset.query.order_by
+            if isinstance(name, str) and name != '?'
+        ]
+        columns = dict.fromkeys([*self.columns, *ordering])
+        return queryset.prefetch_related(None).values(*columns)
+
+    def bind_converters(self):
+        """
+        {field: to_representation} for this render. DateTimeField looks up
+        the active timezone on every call, which costs more than the rest of
+        the conversion; copies pinned to the current one behave identically.
+        """
+        current = timezone.get_current_timezone() if settings.USE_TZ else None
+        converters = {}
+        for field in self.converted_fields:
+            bound = field
+            if isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone'):
+                bound = copy.copy(field)
+                bound.timezone = current
+            converters[field] = bound.to_representation
+        return converters
+
+    def many_queryset(self, spec, parent_ids):
+        through, source, target, plan = spec
+        source_id, target_id = f'{source}_id', f'{target}_id'
+        return (
+            through.objects.filter(**{f'{source_id}__in': parent_ids})
+            .order_by(target_id)
+            .values(source_id, target_id, *(column for _, column, _ in plan or ()))
+        )
+
+    def fetch_many(self, spec, parent_ids, converters):
+        """{parent_id: [child, ...]} for every parent, children in pk order."""
+        return self.group_many(spec, parent_ids, self.many_queryset(spec, parent_ids), converters)
+
+    async def afetch_many(self, spec, parent_ids, converters):
+        """fetch_many() with an async query."""
+        rows = [row async for row in self.many_queryset(spec, parent_ids)]
+        return self.group_many(spec, parent_ids, rows, converters)
+
+    def group_many(self, spec, parent_ids, rows, converters):
+        through, source, target, plan = spec
+        source_id, target_id = f'{source}_id', f'{target}_id'
+        children = {parent_id: [] for parent_id in parent_ids}
+        rendered = {}
+        if plan is None:
+            for row in rows:
+                children[row[source_id]].append(row[target_id])
+            return children
+        for row in rows:
+            child = rendered.get(row[target_id])
+            if child is None:
+                child = rendered[row[target_id]] = render_values(plan, row, converters)
+            children[row[source_id]].append(child)
+        return children
+
+    def render(self, rows, serializer=None):
+        """
+        Serialize values() rows. `serializer` is an instance of the
+        serializer class, needed only for SerializerMethodField methods.
+
+        A related object that appears on several rows is rendered once and
+        the same dict is shared between them; treat the result as read-only.
+        """
+        rows = list(rows)
+        converters = self.bind_converters()
+        parent_ids = [row[self.pk_column] for row in rows]
+        many = {
+            key: self.fetch_many(spec, parent_ids, converters) if parent_ids else {}
+            for key, kind, spec in self.plan if kind == MANY
+        }
+        return self.assemble(rows, many, converters, serializer)
+
+    async def arender(self, rows, serializer=None):
+        """render() for rows already fetched, querying children asynchronously."""
+        converters = self.bind_converters()
+        parent_ids = [row[self.pk_column] for row in rows]
+        many = {}
+        for key, kind, spec in self.plan:
+            if kind == MANY:
+                many[key] = await self.afetch_many(spec, parent_ids, converters) if parent_ids else {}
+        return self.assemble(rows, many, converters, serializer)
+
+    def assemble(self, rows, many, converters, serializer):
+        methods = {
+            key: getattr(serializer, spec)
+            for key, kind, spec in self.plan if kind == METHOD
+        }
+        nested = {key: {} for key, kind, spec in self.plan if kind == NESTED}
+        results = []
+        for row in rows:
+            data = {}
+            for key, kind, spec in self.plan:
+                if kind == VALUE:
+                    column, field = spec
+                    value = row[column]
+                    data[key] = value if field is None or value is None else converters[field](value)
+                elif kind == NESTED:
+                    plan, fk_column = spec
+                    related_id = row[fk_column]
+                    if related_id is None:
+                        data[key] = None
+                    else:
+                        rendered = nested[key].get(related_id)
+                        if rendered is None:
+                            rendered = nested[key][related_id] = render_values(plan, row, converters)
+                        data[key] = rendered
+                elif kind == MANY:
+                    data[key] = many[key][row[self.pk_column]]
+                else:
+                    data[key] = methods[key](Row(row))
+            results.append(data)
+        return results
+
+
+# Bounded: api.sparse generates serializer classes per ?fields=/?expand=
+# combination and makes a new one once its own cache dropped the old
+@lru_cache(maxsize=512)
+def get_projection(serializer_class):
+    return ListProjection(serializer_class)
+
+
+class ProjectedListMixin:
+    """
+    Serve ``list`` through ListProjection instead of the serializer.
+
+    Paginators and ``paginate_queryset()`` overrides see values() dicts
+    rather than model instances. Prefetches must order many-to-many
+    children by primary key so the serializer renders the same JSON (see
+    ``fetch_many()``).
+    """
+
+    def list(self, request, *args, **kwargs):
+        projection = get_projection(self.get_serializer_class())
+        queryset = projection.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(projection.render(page, self.get_serializer()))
+        return Response(projection.render(queryset, self.get_serializer()))
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from blog.models import Category, Tag, Post
+from blog.models import Category, ImageAsset, Tag, Post
 from django.contrib.auth.models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -17,17 +17,50 @@ class TagSerializer(serializers.ModelSerializer):
         model = Tag
         fields = ['id', 'name', 'slug', 'created_at']
 
+# The taxonomy endpoints add the maintained counters; posts embed the plain
+# serializers, so their cached entries do not depend on counts
+class CategoryCountSerializer(CategorySerializer):
+    class Meta(CategorySerializer.Meta):
+        fields = CategorySerializer.Meta.fields + ['published_post_count']
+
+class TagCountSerializer(TagSerializer):
+    class Meta(TagSerializer.Meta):
+        fields = TagSerializer.Meta.fields + ['published_post_count']
+
+# Resized variants of image_url (blog.images): `sources` are <source>
+# elements for a <picture>, best format first, `src` the <img> fallback.
+# null until process_images has generated them.
+class ImageAssetSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ImageAsset
+        fields = ['src', 'width', 'height', 'placeholder', 'sources']
+
+# content_html, toc, summary, word_count and reading_time are rendered from
+# content and excerpt when a post is written (blog.rendering); content and
+# excerpt stay the editable source.
 class PostListSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
+    image = ImageAssetSerializer(read_only=True)
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'slug', 'excerpt', 'image_url', 
+        fields = ['id', 'title', 'slug', 'excerpt', 'summary', 'word_count', 'reading_time',
+                 'image_url', 'image',
                  'author', 'category', 'tags', 'is_featured', 'status', 
                  'created_at', 'published_at']
 
+class PostSearchResultSerializer(PostListSerializer):
+    search_rank = serializers.FloatField(read_only=True)
+    search_snippet = serializers.SerializerMethodField()
+
+    class Meta(PostListSerializer.Meta):
+        fields = PostListSerializer.Meta.fields + ['search_rank', 'search_snippet']
+
+    def get_search_snippet(self, obj):
+        return self.context.get('search_snippets', {}).get(obj.id, '')
+
 class PostDetailSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     category = CategorySerializer(read_only=True)
@@ -38,14 +71,16 @@ class PostDetailSerializer(serializers.ModelSerializer):
         write_only=True,
         required=False
     )
+    image = ImageAssetSerializer(read_only=True)
     url = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'slug', 'content', 'excerpt', 'image_url',
+        fields = ['id', 'title', 'slug', 'content', 'content_html', 'toc', 'excerpt', 'summary',
+                 'word_count', 'reading_time', 'image_url', 'image',
                  'author', 'category', 'category_id', 'tags', 'tag_ids', 
                  'is_featured', 'status', 'created_at', 'updated_at', 'published_at',
-                 'url']
+                 'publish_at', 'url']
 
     def get_url(self, obj):
         request = self.context.get('request')
@@ -0,0 +1,159 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from blog.counters import taxonomy_counts_changed
+from blog.images import post_images_changed
+from blog.related import related_posts_changed
+from blog.models import Category, Tag, Post
+from blog.signals import posts_bulk_changed, posts_rendered
+from .cache import invalidate, post_tags, tags_invalidated
+from .snapshots import mark_stale
+
+# Beyond this many posts one bulk change bumps posts:all, which every post
+# list and detail entry depends on, instead of a tag per post and taxonomy
+BULK_INVALIDATE_ALL = 200
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_location(sender, instance, raw=False, **kwargs):
+    # Lists/details the post appeared in before this save must be evicted too
+    instance._cache_previous = None
+    if instance.pk and not raw:
+        instance._cache_previous = (
+            Post.objects.filter(pk=instance.pk)
+            .values_list('slug', 'category__slug')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def invalidate_saved_post(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    slugs, category_slugs = [instance.slug], [instance.category.slug]
+    previous = getattr(instance, '_cache_previous', None)
+    if previous:
+        slugs.append(previous[0])
+        category_slugs.append(previous[1])
+    tag_slugs = instance.tags.values_list('slug', flat=True)
+    invalidate(post_tags(slugs, category_slugs, tag_slugs))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleted_post(sender, instance, **kwargs):
+    instance._cache_tag_slugs = list(instance.tags.values_list('slug', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def invalidate_deleted_post(sender, instance, **kwargs):
+    category_slug = Category.objects.filter(pk=instance.category_id).values_list('slug', flat=True).first()
+    invalidate(post_tags(
+        [instance.slug], [category_slug], getattr(instance, '_cache_tag_slugs', [])
+    ))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_retagged_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action == 'pre_clear':
+            tag_slugs = instance.tags.values_list('slug', flat=True)
+        elif action in ('post_add', 'post_remove'):
+            tag_slugs = Tag.objects.filter(pk__in=pk_set).values_list('slug', flat=True)
+        else:
+            return
+        invalidate(post_tags([instance.slug], [], tag_slugs))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        # tag.post_set changes: the tag's list plus every affected post
+        slugs = Post.objects.filter(pk__in=pk_set or []).values_list('slug', flat=True)
+        tags = post_tags(slugs, [], [instance.slug])
+        if action == 'post_clear':
+            tags.add('posts:all')
+        invalidate(tags)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    tags = {'categories', f'category:{instance.slug}'}
+    if not created:
+        # Posts embed their category, so any list or detail may be stale
+        tags.add('posts:all')
+    invalidate(tags)
+
+
+@receiver(pre_delete, sender=Tag)
+def touch_posts_of_deleted_tag(sender, instance, **kwargs):
+    # The delete drops the tag links without m2m_changed; the posts' ETags
+    # must still change. A deleted category deletes its posts instead.
+    Post.objects.filter(tags=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    tags = {'tags', f'tag:{instance.slug}'}
+    if not created:
+        tags.add('posts:all')
+    invalidate(tags)
+
+
+@receiver(posts_bulk_changed)
+def invalidate_bulk_changed_posts(sender, post_ids, stale_category_ids, stale_tag_ids,
+                                  taxonomy_created, **kwargs):
+    taxonomy = {'categories', 'tags'} if taxonomy_created else set()
+    if len(post_ids) > BULK_INVALIDATE_ALL:
+        invalidate({'posts:all'} | taxonomy)
+        return
+    posts = Post.objects.filter(pk__in=post_ids)
+    category_ids = set(stale_category_ids) | set(posts.values_list('category_id', flat=True))
+    tag_ids = set(stale_tag_ids) | set(
+        Post.tags.through.objects.filter(post_id__in=post_ids).values_list('tag_id', flat=True)
+    )
+    tags = post_tags(
+        posts.values_list('slug', flat=True),
+        Category.objects.filter(pk__in=category_ids).values_list('slug', flat=True),
+        Tag.objects.filter(pk__in=tag_ids).values_list('slug', flat=True),
+    )
+    invalidate(tags | taxonomy)
+
+
+@receiver(taxonomy_counts_changed)
+def invalidate_counted_taxonomy(sender, ids, **kwargs):
+    # Only the taxonomy endpoints show counts; posts embed neither
+    prefix = 'category' if sender is Category else 'tag'
+    slugs = sender.objects.filter(pk__in=ids).values_list('slug', flat=True)
+    invalidate({'categories' if sender is Category else 'tags'} | {f'{prefix}:{slug}' for slug in slugs})
+
+
+@receiver(post_images_changed)
+@receiver(posts_rendered)
+def invalidate_reworked_posts(sender, post_ids, **kwargs):
+    # Only fields derived from the posts changed: not their category or tags
+    if len(post_ids) > BULK_INVALIDATE_ALL:
+        invalidate({'posts:all'})
+        return
+    posts = Post.objects.filter(pk__in=post_ids)
+    invalidate(post_tags(
+        posts.values_list('slug', flat=True),
+        posts.values_list('category__slug', flat=True),
+        Tag.objects.filter(post__in=post_ids).values_list('slug', flat=True).distinct(),
+    ))
+
+
+@receiver(related_posts_changed)
+def invalidate_related_posts(sender, post_ids, **kwargs):
+    if len(post_ids) > BULK_INVALIDATE_ALL:
+        invalidate({'posts:all'})
+        return
+    slugs = Post.objects.filter(pk__in=post_ids).values_list('slug', flat=True)
+    invalidate({f'related:{slug}' for slug in slugs})
+
+
+@receiver(tags_invalidated)
+def mark_stale_snapshots(sender, tags, **kwargs):
+    # Runs after commit (see invalidate()); build_snapshots renders them again
+    mark_stale(tags)
@@ -0,0 +1,301 @@
+"""
+Static JSON snapshots of the busiest public API reads.
+
+The first pages of ``/api/posts/``, the featured posts, the first page(s)
+of each category, the latest post details and the taxonomy lists are
+rendered through their viewsets and written under ``SNAPSHOT_ROOT``, each
+with a gzip (``.gz``) and, when the ``brotli`` package is installed, a
+brotli (``.br``) copy, so nginx (``gzip_static``/``brotli_static``) or
+WhiteNoise can serve them without reaching Django. ``manifest.json`` lists
+every snapshot with its file and ETag.
+
+A snapshot's file is named after its canonical URL: the path plus
+``index.json``, or ``index.<query>.json`` with the query parameters in
+alphabetical order, e.g. ``/api/posts/?category=solar&page=2`` is
+``api/posts/index.category=solar&page=2.json``.
+
+Each Snapshot row stores the API cache tags (``api.cache``) its response
+depends on. When a write invalidates cache tags, mark_stale() flags the
+snapshots that depend on them; ``manage.py build_snapshots`` renders the
+stale ones, in parallel worker processes, and adds or removes snapshots
+as posts and categories come and go. Rows are claimed with a conditional
+UPDATE like ``api.webhook_queue``, so several builders can run at once.
+A snapshot whose render fails is retried with exponential backoff and
+given up after ``SNAPSHOT_MAX_ATTEMPTS``, until the next write to it (or
+``build_snapshots --retry-failed``).
+"""
+import gzip
+import json
+import logging
+import os
+import tempfile
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.test import RequestFactory
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.request import Request
+
+from blog.models import Category, Post
+from .models import Snapshot
+
+try:
+    import brotli
+except ImportError:  # optional: only the .gz copies are written without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def get_root():
+    return get_setting('SNAPSHOT_ROOT', os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def canonical_url(path, **params):
+    query = urlencode(sorted((name, value) for name, value in params.items() if value))
+    return f'{path}?{query}' if query else path
+
+
+def snapshot_file(url):
+    """Path of `url`'s snapshot, relative to SNAPSHOT_ROOT."""
+    path, _, query = url.partition('?')
+    return os.path.join(*path.strip('/').split('/'), f'index.{query}.json' if query else 'index.json')
+
+
+def page_urls(path, count, pages, **params):
+    """The first `pages` pages of a list of `count` items (page 1 has no page parameter)."""
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    last = min(pages, -(-count // page_size))
+    return [canonical_url(path, page=str(page) if page > 1 else None, **params)
+            for page in range(1, last + 1)]
+
+
+def snapshot_urls():
+    """Every URL that should currently have a snapshot."""
+    published = Post.objects.filter(status='published')
+    urls = ['/api/categories/', '/api/tags/']
+    urls += page_urls('/api/posts/', published.count(), get_setting('SNAPSHOT_LIST_PAGES', 3))
+    featured = published.filter(is_featured=True)
+    urls += page_urls('/api/posts/', featured.count(), 1, is_featured='true')
+    category_pages = get_setting('SNAPSHOT_CATEGORY_PAGES', 1)
+    for slug, count in (Category.objects.filter(published_post_count__gt=0)
+                        .order_by('slug').values_list('slug', 'published_post_count')):
+        urls += page_urls('/api/posts/', count, category_pages, category=slug)
+    # The latest posts, and those on the featured page
+    recent = published.order_by('-created_at')
+    slugs = {
+        *recent[:get_setting('SNAPSHOT_POST_DETAILS', 50)].values_list('slug', flat=True),
+        *recent.filter(is_featured=True)[:settings.REST_FRAMEWORK['PAGE_SIZE']].values_list('slug', flat=True),
+    }
+    urls += [f'/api/posts/{slug}/' for slug in sorted(slugs)]
+    return urls
+
+
+def build_request(url):
+    host = get_setting('SNAPSHOT_HOST', 'localhost')
+    request = RequestFactory().get(url, secure=True, headers={'host': host, 'accept': 'application/json'})
+    match = resolve(request.path_info)
+    return request, match
+
+
+def snapshot_tags(url):
+    """The API cache tags the response for `url` depends on."""
+    request, match = build_request(url)
+    view = match.func.cls(**match.func.initkwargs)
+    view.action = match.func.actions['get']
+    view.args, view.kwargs = match.args, match.kwargs
+    view.request = Request(request)
+    return sorted(set(view.get_cache_tags()))
+
+
+def render(url):
+    """(status code, body, ETag) of an anonymous JSON GET of `url`."""
+    request, match = build_request(url)
+    view = match.func
+    if iscoroutinefunction(view):  # core.async_urls
+        view = async_to_sync(view)
+    response = view(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response.status_code, response.content, response.get('ETag', '')
+
+
+def write_file(path, content):
+    """Replace `path` atomically, so a server never reads a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def compressed_copies(content):
+    # mtime=0 keeps the .gz identical for identical content
+    copies = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        copies['.br'] = brotli.compress(content)
+    return copies
+
+
+def write_snapshot(url, content):
+    """Write `url`'s files unless they already hold `content`; True if written."""
+    path = os.path.join(get_root(), snapshot_file(url))
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    for suffix, data in compressed_copies(content).items():
+        write_file(path + suffix, data)
+    write_file(path, content)
+    return True
+
+
+def remove_snapshot(url):
+    path = os.path.join(get_root(), snapshot_file(url))
+    for suffix in ('', '.gz', '.br'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def mark_stale(tags):
+    """Flag the snapshots depending on any of the cache `tags`; returns the count."""
+    if not get_setting('SNAPSHOTS_ENABLED', False):
+        return 0
+    tags = set(tags)
+    # Stale and claimed rows too: one being rendered may miss this write
+    ids = [pk for pk, depends_on in Snapshot.objects.values_list('pk', 'tags')
+           if tags.intersection(depends_on)]
+    return Snapshot.objects.filter(pk__in=ids).update(**stale_values())
+
+
+def mark_all_stale():
+    return Snapshot.objects.update(**stale_values())
+
+
+def stale_values():
+    # stale_at keeps the first write's time, so the oldest are built first.
+    # A write gives a snapshot that was given up one more try.
+    return {
+        'stale_at': Coalesce(F('stale_at'), Value(timezone.now())),
+        'generation': F('generation') + 1,
+        'failed_at': None,
+    }
+
+
+def retry_failed():
+    """Queue the snapshots that were given up again; returns the count."""
+    return Snapshot.objects.exclude(failed_at=None).update(
+        failed_at=None, attempts=0, next_attempt_at=None,
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number `attempts` (1-based), capped."""
+    base = get_setting('SNAPSHOT_RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 60 * 60))
+
+
+def sync():
+    """Add rows for new snapshot URLs and drop those no longer wanted; returns (added, removed)."""
+    wanted = snapshot_urls()
+    wanted_set = set(wanted)
+    existing = dict(Snapshot.objects.values_list('url', 'pk'))
+    removed = [url for url in existing if url not in wanted_set]
+    for url in removed:
+        remove_snapshot(url)
+    Snapshot.objects.filter(url__in=removed).delete()
+    now = timezone.now()
+    added = [Snapshot(url=url, tags=snapshot_tags(url), stale_at=now)
+             for url in wanted if url not in existing]
+    Snapshot.objects.bulk_create(added, ignore_conflicts=True)
+    return len(added), len(removed)
+
+
+def due_snapshots():
+    now = timezone.now()
+    lease = timedelta(seconds=get_setting('SNAPSHOT_LEASE_SECONDS', 300))
+    return Snapshot.objects.filter(stale_at__isnull=False, failed_at=None).filter(
+        Q(next_attempt_at=None) | Q(next_attempt_at__lte=now)
+    ).filter(
+        Q(locked_at=None) | Q(locked_at__lt=now - lease)
+    )
+
+
+def claim_batch(limit):
+    """Lock up to `limit` stale snapshots for this builder; returns their ids."""
+    ids = list(due_snapshots().order_by('stale_at', 'id').values_list('id', flat=True)[:limit])
+    return [pk for pk in ids if due_snapshots().filter(pk=pk).update(locked_at=timezone.now()) == 1]
+
+
+def build(snapshot_id):
+    """Render and write one claimed snapshot; returns (url, outcome)."""
+    snapshot = Snapshot.objects.get(pk=snapshot_id)
+    try:
+        status, content, etag = render(snapshot.url)
+    except Exception as e:
+        attempts = snapshot.attempts + 1
+        logger.exception('Snapshot of %s failed (attempt %s)', snapshot.url, attempts)
+        # Retried later, not straight away: claim_batch() would pick it up again
+        given_up = attempts >= get_setting('SNAPSHOT_MAX_ATTEMPTS', 5)
+        now = timezone.now()
+        Snapshot.objects.filter(pk=snapshot.pk).update(
+            locked_at=None, attempts=attempts, last_error=f'{type(e).__name__}: {e}',
+            next_attempt_at=None if given_up else now + backoff(attempts),
+            failed_at=now if given_up else None,
+        )
+        return snapshot.url, 'failed'
+    if status != 200:
+        # Gone since the last sync(); the next one adds it back if needed
+        remove_snapshot(snapshot.url)
+        snapshot.delete()
+        return snapshot.url, 'removed'
+    written = write_snapshot(snapshot.url, content)
+    # A write since the row was read bumped its generation and may be
+    # missing from `content`: leave it stale for the next pass
+    Snapshot.objects.filter(pk=snapshot.pk, generation=snapshot.generation).update(
+        stale_at=None, etag=etag, rendered_at=timezone.now(),
+    )
+    Snapshot.objects.filter(pk=snapshot.pk).update(
+        locked_at=None, attempts=0, next_attempt_at=None, last_error='',
+    )
+    return snapshot.url, 'written' if written else 'unchanged'
+
+
+def build_in_worker(snapshot_id):
+    # Worker processes are long-lived; drop broken or expired connections
+    try:
+        return build(snapshot_id)
+    finally:
+        close_old_connections()
+
+
+def write_manifest():
+    manifest = {
+        url: {'file': snapshot_file(url), 'etag': etag,
+              'rendered_at': rendered_at.isoformat() if rendered_at else None}
+        for url, etag, rendered_at in Snapshot.objects.exclude(rendered_at=None)
+        .order_by('url').values_list('url', 'etag', 'rendered_at')
+    }
+    write_file(os.path.join(get_root(), MANIFEST),
+               json.dumps(manifest, indent=2, sort_keys=True).encode())
@@ -0,0 +1,138 @@
+"""
+Sparse fieldsets (``?fields=``) and nested expansion (``?expand=``) for
+read endpoints.
+
+``?fields=title,slug,published_at`` limits each object to those fields.
+Relations named in ``fields`` are collapsed to their primary key (a list of
+them for many-to-many) unless they are also named in ``?expand=``, or
+sub-fields are picked with a dot: ``?fields=title,category.name``. Without
+``?fields=`` the full representation is returned and ``?expand=`` has no
+effect.
+
+Trimmed serializers are generated subclasses of the viewset's serializer,
+so the list projection (``api.projection``) selects only the columns they
+need. Viewsets name costly model fields in ``deferrable_fields`` so other
+reads can ``defer()`` them when they are not requested.
+"""
+from functools import lru_cache
+
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+EXPAND_PARAM = 'expand'
+
+
+def split_names(value):
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+def parse_fields(value):
+    """'title,category.name' -> (('category', ('name',)), ('title', ()))"""
+    fields = {}
+    for name in split_names(value):
+        parent, _, child = name.partition('.')
+        if '.' in child:
+            raise ValidationError({FIELDS_PARAM: f'Fields nest one level deep: {name}'})
+        subfields = fields.setdefault(parent, set())
+        if child:
+            subfields.add(child)
+    return tuple(sorted((name, tuple(sorted(subfields))) for name, subfields in fields.items()))
+
+
+def readable_fields(serializer):
+    return {key: field for key, field in serializer.fields.items() if not field.write_only}
+
+
+def trimmed(serializer_class, names, declared=None):
+    """Subclass of `serializer_class` rendering only `names`, with `declared` overrides."""
+    meta = type('Meta', (serializer_class.Meta,), {'fields': names})
+    return type(serializer_class.__name__, (serializer_class,), {'Meta': meta, **(declared or {})})
+
+
+@lru_cache(maxsize=256)
+def sparse_serializer_class(serializer_class, fields, expand):
+    """
+    Serializer class rendering `fields` (as returned by parse_fields()),
+    with the relations in `expand` nested and the others as primary keys.
+    """
+    available = readable_fields(serializer_class())
+    requested = dict(fields)
+    unknown = sorted(set(requested) - set(available))
+    if unknown:
+        raise ValidationError({FIELDS_PARAM: f'Unknown field(s): {", ".join(unknown)}'})
+    not_relations = sorted(
+        name for name in expand
+        if not isinstance(available.get(name), serializers.BaseSerializer)
+    )
+    if not_relations:
+        raise ValidationError({EXPAND_PARAM: f'Cannot expand: {", ".join(not_relations)}'})
+
+    names = [name for name in available if name in requested]
+    declared = {}
+    for name in names:
+        field, subfields = available[name], requested[name]
+        if not isinstance(field, serializers.BaseSerializer):
+            if subfields:
+                raise ValidationError({FIELDS_PARAM: f'{name} has no sub-fields'})
+            continue
+        many = isinstance(field, serializers.ListSerializer)
+        nested = field.child if many else field
+        options = {'many': many, 'read_only': True}
+        if field.source != name:
+            options['source'] = field.source
+        if subfields:
+            nested_available = readable_fields(nested)
+            unknown = sorted(set(subfields) - set(nested_available))
+            if unknown:
+                raise ValidationError({
+                    FIELDS_PARAM: f'Unknown field(s): {", ".join(f"{name}.{sub}" for sub in unknown)}'
+                })
+            nested_class = trimmed(type(nested), [sub for sub in nested_available if sub in subfields])
+            declared[name] = nested_class(**options)
+        elif name not in expand:
+            declared[name] = serializers.PrimaryKeyRelatedField(**options)
+
+    return trimmed(serializer_class, names, declared)
+
+
+class SparseFieldsMixin:
+    """
+    ``?fields=`` / ``?expand=`` for ``list`` and ``retrieve``, or the
+    actions named in ``sparse_actions``.
+
+    Viewsets that choose their serializer class themselves pass it through
+    ``sparse_serializer_class()``; ``get_deferred_fields()`` lists the
+    ``deferrable_fields`` the current request does not need.
+    """
+    deferrable_fields = ()
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        """(fields, expand) for this request, or None for the full representation."""
+        request = getattr(self, 'request', None)
+        if request is None or self.action not in self.sparse_actions:
+            return None
+        fields = parse_fields(request.query_params.get(FIELDS_PARAM))
+        if not fields:
+            return None
+        return fields, frozenset(split_names(request.query_params.get(EXPAND_PARAM)))
+
+    def is_field_requested(self, name):
+        sparse = self.get_sparse_fields()
+        return sparse is None or name in dict(sparse[0])
+
+    def get_deferred_fields(self):
+        return [name for name in self.deferrable_fields if not self.is_field_requested(name)]
+
+    def sparse_serializer_class(self, serializer_class):
+        sparse = self.get_sparse_fields()
+        if sparse is None:
+            return serializer_class
+        return sparse_serializer_class(serializer_class, *sparse)
+
+    def get_serializer_class(self):
+        return self.sparse_serializer_class(super().get_serializer_class())
+
+    def get_queryset(self):
+        return super().get_queryset().defer(*self.get_deferred_fields())
@@ -1,3 +1,1380 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from blog.images import link
+from blog.models import Category, ImageAsset, Tag, Post
+from blog.related import rebuild
+from blog.search import search_posts
+from .benchmarks import compare
+from .instrumentation import explain, histograms
+from .models import Snapshot, WebhookDelivery
+from .projection import ListProjection
+from . import snapshots, webhooks
+from .snapshots import snapshot_file
+from .sparse import parse_fields, sparse_serializer_class
+from .serializers import PostListSerializer, PostSearchResultSerializer
+from .webhook_queue import claim_batch, process
 
-# Create your tests here.
+# Maximum number of SQL queries each public endpoint may run, regardless of
+# how many rows are on the page. Raise a budget only together with a
+# matching select_related/prefetch_related change in the view.
+QUERY_BUDGETS = {
+    'post-list': 4,           # validators, COUNT, posts + author + category, tags
+    'post-list-category': 4,
+    'post-list-tag': 4,
+    'post-list-cursor': 3,    # validators, posts + author + category, tags; no COUNT
+    'post-search': 5,         # validators, COUNT, posts + ranks, tags, snippets
+    'post-detail': 3,         # validators, post + author + category, tags
+    'post-related': 2,        # related posts + author + category, tags
+    'post-list-sparse': 3,    # validators, COUNT, posts; tags not requested
+    'post-not-modified': 1,   # validators only
+    'category-list': 3,       # validators, COUNT, categories
+    'tag-list': 3,            # validators, COUNT, tags
+}
+
+
+def create_posts(count, category=None, tags=None, author=None):
+    """Create `count` published posts sharing the given category and tags."""
+    author = author or User.objects.create_user(username=f'author-{User.objects.count()}')
+    category = category or Category.objects.create(name=f'Category {Category.objects.count()}')
+    if tags is None:
+        tags = [Tag.objects.create(name=f'tag-{Tag.objects.count()}') for _ in range(3)]
+    posts = []
+    for i in range(count):
+        post = Post.objects.create(
+            title=f'Post {i}',
+            content=f'Body of post {i}',
+            author=author,
+            category=category,
+            status='published',
+            published_at=timezone.now(),
+        )
+        post.tags.set(tags)
+        posts.append(post)
+    return posts
+
+
+class QueryBudgetMixin:
+    """Assert that a request stays within its entry in QUERY_BUDGETS."""
+
+    def assertWithinQueryBudget(self, budget_name, url, status_code=200, **headers):
+        budget = QUERY_BUDGETS[budget_name]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, status_code)
+        executed = len(ctx.captured_queries)
+        self.assertLessEqual(
+            executed, budget,
+            f'{budget_name} ran {executed} queries (budget {budget}):\n'
+            + '\n'.join(q['sql'] for q in ctx.captured_queries)
+        )
+        return executed
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class PostQueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Zero Waste')
+        self.tag = Tag.objects.create(name='recycling')
+        self.posts = create_posts(3, category=self.category, tags=[self.tag])
+
+    def assertConstantAcrossPageSizes(self, budget_name, url):
+        small = self.assertWithinQueryBudget(budget_name, url)
+        create_posts(12, category=self.category, tags=[self.tag])
+        large = self.assertWithinQueryBudget(budget_name, url)
+        self.assertEqual(small, large)
+
+    def test_post_list(self):
+        self.assertConstantAcrossPageSizes('post-list', '/api/posts/')
+
+    def test_post_list_by_category(self):
+        self.assertConstantAcrossPageSizes(
+            'post-list-category', f'/api/posts/?category={self.category.slug}'
+        )
+
+    def test_post_list_by_tag(self):
+        self.assertConstantAcrossPageSizes('post-list-tag', f'/api/posts/?tag={self.tag.slug}')
+
+    def test_post_detail(self):
+        self.assertWithinQueryBudget('post-detail', f'/api/posts/{self.posts[0].slug}/')
+
+    def test_taxonomy_lists(self):
+        self.assertWithinQueryBudget('category-list', '/api/categories/')
+        self.assertWithinQueryBudget('tag-list', '/api/tags/')
+
+    def test_post_related(self):
+        rebuild()
+        self.assertWithinQueryBudget('post-related', f'/api/posts/{self.posts[0].slug}/related/')
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class RelatedPostsEndpointTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.solar = Tag.objects.create(name='solar')
+        self.posts = create_posts(3, tags=[self.solar])
+        self.other = create_posts(1, tags=[])[0]
+        self.posts[2].status = 'draft'
+        self.posts[2].save()
+        rebuild()
+
+    def test_lists_related_posts_best_first(self):
+        response = self.client.get(f'/api/posts/{self.posts[0].slug}/related/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['slug'] for post in response.json()], [self.posts[1].slug])
+        self.assertEqual(response.json()[0]['tags'][0]['name'], 'solar')
+
+        response = self.client.get(f'/api/posts/{self.posts[0].slug}/related/?fields=title')
+        self.assertEqual(response.json(), [{'title': self.posts[1].title}])
+
+    def test_posts_without_related_posts(self):
+        for post in (self.posts[2], self.other):
+            response = self.client.get(f'/api/posts/{post.slug}/related/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), [])
+        self.assertEqual(self.client.get('/api/posts/no-such-post/related/').status_code, 404)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class PostSearchTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = User.objects.create_user(username='writer')
+        self.energy = Category.objects.create(name='Renewable Energy')
+        self.waste = Category.objects.create(name='Zero Waste')
+        self.solar_tag = Tag.objects.create(name='solar')
+        self.solar = Post.objects.create(
+            title='Solar Power for Beginners', content='Panels on every roof.',
+            author=author, category=self.energy, status='published',
+        )
+        self.compost = Post.objects.create(
+            title='Composting at Home', content='Kitchen scraps and solar drying racks.',
+            author=author, category=self.waste, status='published',
+        )
+        self.draft = Post.objects.create(
+            title='Solar Draft', content='Unfinished.', author=author,
+            category=self.energy, status='draft',
+        )
+        self.solar.tags.add(self.solar_tag)
+
+    def search(self, text):
+        response = self.client.get('/api/posts/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_ranks_title_and_tag_matches_first(self):
+        results = self.search('solar')
+        self.assertEqual([r['slug'] for r in results], [self.solar.slug, self.compost.slug])
+        self.assertGreater(results[0]['search_rank'], results[1]['search_rank'])
+
+    def test_prefix_and_taxonomy_matches(self):
+        self.assertEqual([r['slug'] for r in self.search('compo')], [self.compost.slug])
+        self.assertEqual([r['slug'] for r in self.search('renewable')], [self.solar.slug])
+
+    def test_snippet_highlights_content(self):
+        results = self.search('scraps')
+        self.assertIn('<mark>scraps</mark>', results[0]['search_snippet'])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.solar_tag.name = 'photovoltaic'
+        self.solar_tag.save()
+        self.assertEqual([r['slug'] for r in self.search('photovoltaic')], [self.solar.slug])
+        self.compost.title = 'Vermiculture'
+        self.compost.save()
+        self.assertEqual([r['slug'] for r in self.search('vermiculture')], [self.compost.slug])
+        self.compost.delete()
+        self.assertEqual(self.search('vermiculture'), [])
+
+    def test_only_taxonomy_renames_reindex(self):
+        self.energy.description = 'Sun and wind'
+        with mock.patch('blog.search.index_posts') as index_posts:
+            self.energy.save()
+            index_posts.assert_not_called()
+        self.energy.name = 'Clean Power'
+        self.energy.save()
+        self.assertEqual([r['slug'] for r in self.search('clean')], [self.solar.slug])
+
+    def test_no_duplicates_and_query_syntax_is_ignored(self):
+        self.solar.tags.add(Tag.objects.create(name='solar panels'))
+        self.assertEqual(len(self.search('solar')), 2)
+        self.assertEqual(len(self.search('"solar" * (')), 2)
+
+    def test_query_budget(self):
+        create_posts(12, category=self.energy, tags=[self.solar_tag])
+        self.assertWithinQueryBudget('post-search', '/api/posts/?search=solar')
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class KeysetPaginationTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.posts = create_posts(25)
+        # Half the posts share a timestamp so only the id tiebreak orders them
+        now = timezone.now()
+        Post.objects.filter(id__in=[p.id for p in self.posts[:12]]).update(created_at=now)
+        for i, post in enumerate(self.posts[12:]):
+            Post.objects.filter(id=post.id).update(created_at=now - timedelta(minutes=i + 1))
+        self.expected = list(
+            Post.objects.order_by('-created_at', '-id').values_list('slug', flat=True)
+        )
+
+    def walk(self, url):
+        slugs, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            slugs += [r['slug'] for r in response.data['results']]
+            url = response.data['next']
+        return slugs, pages
+
+    def test_walks_every_post_once_in_order(self):
+        slugs, pages = self.walk('/api/posts/?pagination=cursor')
+        self.assertEqual(slugs, self.expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['count'])
+        self.assertIsNone(pages[0]['previous'])
+
+    def test_previous_link_returns_prior_page(self):
+        _, pages = self.walk('/api/posts/?pagination=cursor')
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual(
+            [r['slug'] for r in response.data['results']],
+            [r['slug'] for r in pages[1]['results']],
+        )
+
+    def test_published_at_ordering_and_exact_count(self):
+        response = self.client.get('/api/posts/?pagination=cursor&ordering=-published_at&count=exact')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 25)
+
+    def test_rejects_unsupported_ordering_and_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/posts/?pagination=cursor&ordering=title').status_code, 400)
+        self.assertEqual(self.client.get('/api/posts/?cursor=garbage').status_code, 404)
+
+    def test_page_number_mode_is_default(self):
+        response = self.client.get('/api/posts/?page=2')
+        self.assertEqual(response.data['count'], 25)
+
+    def test_deep_pages_cost_the_same_as_the_first(self):
+        first = self.assertWithinQueryBudget('post-list-cursor', '/api/posts/?pagination=cursor')
+        _, pages = self.walk('/api/posts/?pagination=cursor')
+        deep = self.assertWithinQueryBudget('post-list-cursor', pages[1]['next'])
+        self.assertEqual(first, deep)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class ListProjectionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        author = User.objects.create_user(username='writer', first_name='Ada', last_name='Green')
+        category = Category.objects.create(name='Zero Waste', description='Less is more')
+        # Created out of name order; both paths must list tags by id
+        zeta, alpha = Tag.objects.create(name='zeta'), Tag.objects.create(name='alpha')
+        tagged = Post.objects.create(
+            title='Compost bins', content='Kitchen scraps.', excerpt='Bins',
+            image_url='https://example.com/bin.jpg', author=author, category=category,
+            status='published', published_at=timezone.now(), is_featured=True,
+        )
+        tagged.tags.set([alpha, zeta])
+        asset = ImageAsset.objects.get(source_url=tagged.image_url)
+        ImageAsset.objects.filter(pk=asset.pk).update(
+            status='done', width=1600, height=900, placeholder='data:image/webp;base64,AAAA',
+            src='/media/images/ab/ab12-1600w.jpeg',
+            sources=[{'type': 'image/webp', 'srcset': '/media/images/ab/cd34-320w.webp 320w'}],
+        )
+        link(asset)
+        Post.objects.create(
+            title='Untagged draft', content='Kitchen scraps, later.', author=author,
+            category=category,
+        )
+
+    def queryset(self):
+        return Post.objects.select_related('author', 'category', 'image').prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('id'))
+        ).order_by('-created_at')
+
+    def assertSameJSON(self, serializer_class, queryset, context=None):
+        expected = JSONRenderer().render(
+            serializer_class(list(queryset), many=True, context=context).data
+        )
+        projection = ListProjection(serializer_class)
+        rendered = JSONRenderer().render(
+            projection.render(projection.values(queryset), serializer_class(context=context))
+        )
+        self.assertEqual(rendered, expected)
+
+    def test_list_matches_serializer(self):
+        self.assertSameJSON(PostListSerializer, self.queryset())
+        self.assertEqual(self.client.get('/api/posts/').json()['results'][0]['image']['width'], 1600)
+        with timezone.override('Europe/Berlin'):
+            self.assertSameJSON(PostListSerializer, self.queryset())
+
+    def test_search_results_match_serializer(self):
+        queryset = search_posts(self.queryset(), 'scraps')
+        snippets = {post.id: f'snippet {post.id}' for post in queryset}
+        self.assertSameJSON(PostSearchResultSerializer, queryset, {'search_snippets': snippets})
+
+    def test_api_renders_same_json_as_serializer(self):
+        response = self.client.get('/api/posts/')
+        published = self.queryset().filter(status='published')
+        self.assertEqual(response.content, JSONRenderer().render({
+            'count': 1, 'next': None, 'previous': None,
+            'results': PostListSerializer(published, many=True).data,
+        }))
+
+    def test_sparse_serializers_match(self):
+        for fields, expand in [
+            ('title,category,tags', ()),
+            ('title,category,tags', ('tags',)),
+            ('slug,author.username,tags.name,published_at', ()),
+        ]:
+            serializer_class = sparse_serializer_class(
+                PostListSerializer, parse_fields(fields), frozenset(expand)
+            )
+            self.assertSameJSON(serializer_class, self.queryset())
+
+    def test_unsupported_fields_are_rejected(self):
+        class ContentSerializer(PostListSerializer):
+            content = serializers.ReadOnlyField()
+
+            class Meta(PostListSerializer.Meta):
+                fields = PostListSerializer.Meta.fields + ['content']
+
+        with self.assertRaises(ImproperlyConfigured):
+            ListProjection(ContentSerializer)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class SparseFieldsTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Zero Waste', description='Long text')
+        self.tag = Tag.objects.create(name='recycling')
+        self.post = create_posts(1, category=self.category, tags=[self.tag])[0]
+
+    def get(self, url, status_code=200):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status_code, response.content)
+        # Leave out the validators' aggregate, which joins every table anyway
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries if 'MAX(' not in q['sql'])
+        return response.json(), sql
+
+    def test_list_fields(self):
+        data, sql = self.get('/api/posts/?fields=title,slug,published_at')
+        self.assertEqual(list(data['results'][0]), ['title', 'slug', 'published_at'])
+        self.assertNotIn('"blog_post"."excerpt"', sql)
+        self.assertNotIn('"blog_category"', sql)
+        self.assertWithinQueryBudget('post-list-sparse', '/api/posts/?fields=title,slug')
+
+    def test_relations_collapse_unless_expanded(self):
+        data, _ = self.get('/api/posts/?fields=title,category,tags')
+        self.assertEqual(data['results'][0]['category'], self.category.id)
+        self.assertEqual(data['results'][0]['tags'], [self.tag.id])
+
+        data, _ = self.get('/api/posts/?fields=title,category,tags&expand=category')
+        self.assertEqual(data['results'][0]['category']['description'], 'Long text')
+        self.assertEqual(data['results'][0]['tags'], [self.tag.id])
+
+        data, sql = self.get('/api/posts/?fields=title,category.name')
+        self.assertEqual(data['results'][0]['category'], {'name': 'Zero Waste'})
+        self.assertNotIn('"blog_category"."description"', sql)
+
+    def test_detail_defers_content(self):
+        url = f'/api/posts/{self.post.slug}/'
+        data, sql = self.get(f'{url}?fields=title,url')
+        self.assertEqual(list(data), ['title', 'url'])
+        self.assertNotIn('"blog_post"."content"', sql)
+        self.assertNotIn('"blog_post_tags"', sql)
+
+        data, sql = self.get(f'{url}?fields=title,content')
+        self.assertEqual(data['content'], self.post.content)
+        self.assertEqual(self.get(url)[0]['tags'][0]['slug'], self.tag.slug)
+
+    def test_taxonomy_fields(self):
+        data, sql = self.get('/api/categories/?fields=name,slug')
+        self.assertEqual(data['results'], [{'name': 'Zero Waste', 'slug': self.category.slug}])
+        self.assertNotIn('"description"', sql)
+        data, _ = self.get(f'/api/tags/{self.tag.slug}/?fields=name')
+        self.assertEqual(data, {'name': 'recycling'})
+
+    def test_cursor_pages_without_the_ordering_field(self):
+        create_posts(12, category=self.category, tags=[self.tag])
+        data, _ = self.get('/api/posts/?pagination=cursor&fields=title')
+        self.assertEqual(list(data['results'][0]), ['title'])
+        data, _ = self.get(data['next'])
+        self.assertEqual(len(data['results']), 3)
+
+    def test_invalid_fields(self):
+        self.get('/api/posts/?fields=title,nope', status_code=400)
+        self.get('/api/posts/?fields=title.name', status_code=400)
+        self.get('/api/posts/?fields=category.nope', status_code=400)
+        self.get('/api/posts/?fields=title&expand=title', status_code=400)
+        # Write-only fields are not readable
+        self.get(f'/api/posts/{self.post.slug}/?fields=tag_ids', status_code=400)
+
+
+class ContentExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = User.objects.create_user(username='staff', is_staff=True)
+        self.posts = create_posts(3)
+
+    def get(self, url, user=None):
+        if user is not None:
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=user).key}')
+        return self.client.get(url)
+
+    def test_staff_only(self):
+        self.assertEqual(self.get('/api/export/').status_code, 401)
+        reader = User.objects.create_user(username='reader')
+        self.assertEqual(self.get('/api/export/', reader).status_code, 403)
+
+    def test_streams_ndjson(self):
+        response = self.get('/api/export/', self.staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['watermark'], response['X-Export-Watermark'])
+        self.assertEqual(
+            [line['slug'] for line in lines if line['type'] == 'post'],
+            [post.slug for post in self.posts],
+        )
+
+    def test_gzip_and_since(self):
+        watermark = timezone.now().isoformat()
+        response = self.get(f'/api/export/?gzip=1&since={watermark.replace("+", "%2B")}', self.staff)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.ndjson.gz"'))
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual([json.loads(line)['type'] for line in lines], ['export'])
+
+        self.assertEqual(self.client.get('/api/export/?since=yesterday').status_code, 400)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.energy = Category.objects.create(name='Renewable Energy')
+        self.waste = Category.objects.create(name='Zero Waste')
+        self.solar_tag = Tag.objects.create(name='solar')
+        self.energy_posts = create_posts(2, category=self.energy, tags=[self.solar_tag])
+        self.waste_posts = create_posts(2, category=self.waste, tags=[])
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assertCached(self, url):
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT', url)
+
+    def assertEvicted(self, url):
+        self.assertEqual(self.get(url)['X-Cache'], 'MISS', url)
+
+    def write(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+
+    def test_count_changes_evict_taxonomy_entries(self):
+        urls = ['/api/tags/', f'/api/tags/{self.solar_tag.slug}/', '/api/categories/',
+                f'/api/categories/{self.energy.slug}/', f'/api/categories/{self.waste.slug}/']
+        for url in urls:
+            self.get(url)
+        post = self.energy_posts[0]
+        post.status = 'draft'
+        self.write(post.save)
+        for url in urls[:4]:
+            self.assertEvicted(url)
+        self.assertCached(urls[4])
+        self.assertEqual(self.get(urls[1]).json()['published_post_count'], 1)
+
+    def test_related_posts_are_evicted_when_lists_change(self):
+        rebuild()
+        post, related = self.energy_posts
+        url = f'/api/posts/{post.slug}/related/'
+        self.assertEqual([p['slug'] for p in self.get(url).json()], [related.slug])
+        self.assertCached(url)
+
+        related.title = 'Renamed'
+        self.write(related.save)
+        self.assertEqual(self.get(url).json()[0]['title'], 'Renamed')
+        self.assertCached(url)
+
+        # No longer sharing a tag or the category: no longer related
+        self.write(related.tags.clear)
+        related.category = self.waste
+        self.write(related.save)
+        self.assertEqual(self.get(url).json(), [])
+
+    def test_repeated_reads_hit_the_cache_without_queries(self):
+        first = self.get('/api/posts/')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.get('/api/posts/')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+
+    def test_post_edit_evicts_only_affected_entries(self):
+        post = self.waste_posts[0]
+        urls = {
+            'list': '/api/posts/',
+            'waste': f'/api/posts/?category={self.waste.slug}',
+            'energy': f'/api/posts/?category={self.energy.slug}',
+            'solar': f'/api/posts/?tag={self.solar_tag.slug}',
+            'detail': f'/api/posts/{post.slug}/',
+            'other': f'/api/posts/{self.energy_posts[0].slug}/',
+            'categories': '/api/categories/',
+        }
+        for url in urls.values():
+            self.get(url)
+
+        post.title = 'Edited'
+        self.write(post.save)
+
+        for name in ('list', 'waste', 'detail'):
+            self.assertEvicted(urls[name])
+        for name in ('energy', 'solar', 'other', 'categories'):
+            self.assertCached(urls[name])
+        self.assertEqual(self.get(urls['detail']).json()['title'], 'Edited')
+
+    def test_moving_a_post_evicts_old_and_new_filters(self):
+        post = self.waste_posts[0]
+        old_list = f'/api/posts/?category={self.waste.slug}'
+        new_list = f'/api/posts/?category={self.energy.slug}'
+        self.get(old_list)
+        self.get(new_list)
+
+        post.category = self.energy
+        self.write(post.save)
+        self.assertEvicted(old_list)
+        self.assertEvicted(new_list)
+
+    def test_retagging_and_deleting_evict_tag_lists(self):
+        url = f'/api/posts/?tag={self.solar_tag.slug}'
+        self.get(url)
+        self.write(lambda: self.waste_posts[0].tags.add(self.solar_tag))
+        self.assertEqual(self.get(url).json()['count'], 3)
+        self.write(self.energy_posts[0].delete)
+        self.assertEqual(self.get(url).json()['count'], 2)
+
+    def test_taxonomy_rename_evicts_embedded_copies(self):
+        detail = f'/api/posts/{self.energy_posts[0].slug}/'
+        self.get(detail)
+        self.get('/api/tags/')
+        self.solar_tag.name = 'photovoltaic'
+        self.write(self.solar_tag.save)
+        self.assertEvicted('/api/tags/')
+        self.assertEqual(self.get(detail).json()['tags'][0]['name'], 'photovoltaic')
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        self.client.force_authenticate(User.objects.create_user(username='editor'))
+        self.assertNotIn('X-Cache', self.get('/api/categories/'))
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class TaxonomyCountTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.busy = Tag.objects.create(name='busy')
+        self.quiet = Tag.objects.create(name='quiet')
+        self.empty = Tag.objects.create(name='empty')
+        create_posts(3, tags=[self.busy])
+        create_posts(1, tags=[self.quiet, self.busy])
+
+    def test_lists_show_counts_and_sort_by_them(self):
+        results = self.client.get('/api/tags/?ordering=-published_post_count').json()['results']
+        self.assertEqual(
+            [(r['slug'], r['published_post_count']) for r in results],
+            [('busy', 4), ('quiet', 1), ('empty', 0)],
+        )
+        categories = self.client.get('/api/categories/?ordering=published_post_count').json()
+        self.assertEqual([r['published_post_count'] for r in categories['results']], [1, 3])
+        self.assertWithinQueryBudget('tag-list', '/api/tags/?ordering=-published_post_count')
+        self.assertWithinQueryBudget('category-list', '/api/categories/')
+
+    def test_lists_default_to_name_order(self):
+        results = self.client.get('/api/tags/').json()['results']
+        self.assertEqual([r['slug'] for r in results], ['busy', 'empty', 'quiet'])
+
+    def test_posts_embed_taxonomy_without_counts(self):
+        post = self.client.get('/api/posts/').json()['results'][0]
+        self.assertNotIn('published_post_count', post['category'])
+        self.assertNotIn('published_post_count', post['tags'][0])
+
+    def test_counts_are_read_only(self):
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_authenticate(staff)
+        response = self.client.patch(
+            f'/api/tags/{self.empty.slug}/', {'published_post_count': 9}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['published_post_count'], 0)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class ConditionalGetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Zero Waste')
+        self.tag = Tag.objects.create(name='recycling')
+        self.posts = create_posts(3, category=self.category, tags=[self.tag])
+        self.detail = f'/api/posts/{self.posts[0].slug}/'
+
+    def get(self, url, **headers):
+        return self.client.get(url, headers=headers)
+
+    def assertRevalidates(self, url, changed):
+        etag = self.get(url)['ETag']
+        self.assertEqual(self.get(url, if_none_match=etag).status_code, 304)
+        changed()
+        response = self.get(url, if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_emits_validators_and_answers_304(self):
+        response = self.get(self.detail)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertWithinQueryBudget(
+            'post-not-modified', self.detail, 304, if_none_match=response['ETag']
+        )
+        self.assertWithinQueryBudget(
+            'post-not-modified', self.detail, 304, if_modified_since=response['Last-Modified']
+        )
+
+    def test_detail_changes_with_post_and_taxonomy_edits(self):
+        post = self.posts[0]
+
+        def edit_post():
+            post.title = 'Edited'
+            post.save()
+
+        def rename_tag():
+            self.tag.name = 'upcycling'
+            self.tag.save()
+
+        self.assertRevalidates(self.detail, edit_post)
+        self.assertRevalidates(self.detail, rename_tag)
+        self.assertRevalidates(self.detail, lambda: post.tags.remove(self.tag))
+
+    def test_deleting_a_tag_revalidates_its_posts(self):
+        # A newer tag stays, so only the posts' own timestamps can move
+        self.posts[0].tags.add(Tag.objects.create(name='compost'))
+        self.assertRevalidates(self.detail, lambda: self.tag.delete())
+        solar = Tag.objects.create(name='solar')
+        self.posts[1].tags.add(solar)
+        Tag.objects.create(name='wind')
+        self.assertRevalidates('/api/posts/', solar.delete)
+
+    def test_list_changes_with_additions_and_deletions(self):
+        url = f'/api/posts/?category={self.category.slug}'
+        self.assertNotIn('Last-Modified', self.get(url))
+        self.assertRevalidates(url, lambda: self.posts[-1].delete())
+        self.assertRevalidates(url, lambda: create_posts(1, category=self.category))
+        self.assertWithinQueryBudget(
+            'post-not-modified', url, 304, if_none_match=self.get(url)['ETag']
+        )
+
+    def test_taxonomy_lists_revalidate(self):
+        def rename_category():
+            self.category.name = 'Less Waste'
+            self.category.save()
+
+        self.assertRevalidates('/api/categories/', rename_category)
+        self.assertRevalidates('/api/tags/', lambda: Tag.objects.create(name='compost'))
+
+    def test_taxonomy_counts_revalidate(self):
+        self.assertRevalidates('/api/tags/', lambda: create_posts(1, tags=[self.tag]))
+        self.assertRevalidates(
+            f'/api/categories/{self.category.slug}/', lambda: self.posts[0].delete()
+        )
+
+    def test_missing_post_is_still_404(self):
+        self.assertEqual(self.get('/api/posts/missing/', if_none_match='"x"').status_code, 404)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CachedConditionalGetTests(TestCase):
+    def test_cache_hit_answers_304_without_queries(self):
+        cache.clear()
+        post = create_posts(1)[0]
+        url = f'/api/posts/{post.slug}/'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'if_none_match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+
+class WebhookClientMixin:
+    url = '/api/webhooks/content/'
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='pipeline')
+        self.category = Category.objects.create(name='Zero Waste')
+
+    def send(self, payload):
+        body = json.dumps(payload).encode()
+        signature = hmac.new(settings.WEBHOOK_SECRET.encode(), body, hashlib.sha1).hexdigest()
+        return self.client.post(
+            self.url, body, content_type='application/json',
+            headers={'x_hub_signature': f'sha1={signature}'},
+        )
+
+    def create_action(self, title, **content):
+        content.setdefault('content', f'{title} body')
+        content.setdefault('author_id', self.author.id)
+        return {'action': 'create_post', 'content': {'title': title, **content}}
+
+
+@override_settings(API_CACHE_TIMEOUT=0, WEBHOOK_QUEUE_ENABLED=False)
+class ContentWebhookTests(WebhookClientMixin, TestCase):
+    def test_rejects_bad_signature(self):
+        response = self.client.post(self.url, b'{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_single_create_keeps_plain_text_response(self):
+        response = self.send(self.create_action(
+            'Solar Basics', category='Renewable Energy', tags=['solar', 'diy'], status='published'
+        ))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'Post created successfully')
+        post = Post.objects.get(title='Solar Basics')
+        self.assertIsNotNone(post.published_at)
+        self.assertEqual(post.category.slug, 'renewable-energy')
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['diy', 'solar'])
+
+    def test_single_errors_keep_legacy_messages(self):
+        self.assertEqual(self.send({'action': 'nope'}).content, b'Invalid action')
+        missing = self.send({'action': 'update_post', 'content': {'id': 999}})
+        self.assertEqual((missing.status_code, missing.content), (400, b'Post not found'))
+
+    def test_rejects_bad_taxonomy_names(self):
+        for content in ({'category': ''}, {'category': None}, {'tags': ['']}, {'tags': [{'name': 'x'}]},
+                        {'tags': ['x' * 51]}, {'tags': ['!!!']}):
+            response = self.send(self.create_action('Bad', **content))
+            self.assertEqual(response.status_code, 400, content)
+            self.assertTrue(response.content.startswith(b'Invalid payload: '), content)
+        response = self.send({'actions': [
+            self.create_action('Bad', tags=['ok', '']), self.create_action('Good', tags=['ok']),
+        ]})
+        statuses = [r['status'] for r in response.json()['results']]
+        self.assertEqual(statuses, ['error', 'created'])
+        self.assertFalse(Post.objects.filter(title='Bad').exists())
+
+    def test_rejects_bad_text_fields(self):
+        post = create_posts(1, category=self.category, author=self.author)[0]
+        response = self.send({'actions': [
+            self.create_action(None), self.create_action({'text': 'x'}), self.create_action('x' * 201),
+            self.create_action('Blank', content=' '), self.create_action('Long', excerpt='x' * 501),
+            {'action': 'update_post', 'content': {'id': post.id, 'title': ''}},
+            {'action': 'update_post', 'content': {'id': post.id, 'excerpt': None}},
+            self.create_action('Good', excerpt=''),
+        ]})
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['error'] * 7 + ['created'])
+        self.assertEqual(results[0]['error'], 'Invalid payload: title must be a string')
+        self.assertEqual(results[2]['error'], 'Invalid payload: title is longer than 200 characters')
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_reuses_taxonomy_inserted_concurrently(self):
+        bulk_create = Tag.objects.bulk_create
+
+        def racing(objs, **kwargs):
+            # Another delivery creates the tag between the lookup and the insert
+            Tag.objects.create(name='Solar', slug='solar')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Tag.objects, 'bulk_create', side_effect=racing):
+            response = self.send(self.create_action('Racing', tags=['solar']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Post.objects.get().tags.values_list('name', flat=True)), ['Solar'])
+
+    def test_unknown_author_fails_only_its_item(self):
+        response = self.send({'actions': [
+            self.create_action('Orphan', author_id=999), self.create_action('Owned'),
+            self.create_action('Garbled', author_id='me'),
+        ]})
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['error', 'created', 'error'])
+        self.assertEqual(results[0]['error'], 'Invalid payload: unknown author 999')
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Owned'])
+
+    def test_batch_reports_status_per_item(self):
+        post = create_posts(1, category=self.category, author=self.author)[0]
+        doomed = create_posts(1, category=self.category, author=self.author)[0]
+        response = self.send({'actions': [
+            self.create_action('Fresh', tags=['compost']),
+            {'action': 'update_post', 'content': {
+                'id': str(post.id), 'title': 'Renamed', 'tags': ['compost'], 'status': 'published',
+            }},
+            {'action': 'delete_post', 'content': {'id': doomed.id}},
+            {'action': 'update_post', 'content': {'id': 999}},
+            {'action': 'create_post', 'content': {'content': 'no title'}},
+        ]})
+        self.assertEqual(response.status_code, 207)
+        statuses = [r['status'] for r in response.json()['results']]
+        self.assertEqual(statuses, ['created', 'updated', 'deleted', 'error', 'error'])
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'Renamed')
+        self.assertEqual(list(post.tags.values_list('name', flat=True)), ['compost'])
+        self.assertFalse(Post.objects.filter(id=doomed.id).exists())
+        self.assertEqual(Tag.objects.filter(name='compost').count(), 1)
+
+    def test_batch_keeps_taxonomy_counts(self):
+        self.send({'actions': [
+            self.create_action(f'Post {i}', tags=['solar'], status='published') for i in range(3)
+        ]})
+        solar = Tag.objects.get(name='solar')
+        self.assertEqual(solar.published_post_count, 3)
+        post = Post.objects.filter(tags=solar).first()
+        self.send({'actions': [
+            {'action': 'update_post', 'content': {'id': post.id, 'status': 'draft', 'tags': []}},
+            {'action': 'delete_post', 'content': {'id': Post.objects.filter(tags=solar)[1].id}},
+        ]})
+        solar.refresh_from_db()
+        uncategorized = Category.objects.get(name='Uncategorized')
+        self.assertEqual((solar.published_post_count, uncategorized.published_post_count), (1, 1))
+
+        # Updated and deleted in one batch: counted out once
+        last = Post.objects.get(tags=solar)
+        self.send(self.create_action('Kept', tags=['solar'], status='published'))
+        response = self.send({'actions': [
+            {'action': 'update_post', 'content': {'id': last.id, 'title': 'Renamed'}},
+            {'action': 'delete_post', 'content': {'id': last.id}},
+        ]})
+        self.assertEqual([r['status'] for r in response.json()['results']], ['updated', 'deleted'])
+        self.assertFalse(Post.objects.filter(id=last.id).exists())
+        self.assertEqual(Tag.objects.get(name='solar').published_post_count, 1)
+        self.assertEqual(Category.objects.get(name='Uncategorized').published_post_count, 1)
+
+    def test_batch_writes_rendered_content(self):
+        self.send({'actions': [self.create_action(
+            'Greywater', content='<h2>Why</h2><p>Reuse <em>shower</em> water.</p>', status='published',
+        )]})
+        post = Post.objects.get(title='Greywater')
+        self.send({'actions': [{'action': 'update_post', 'content': {
+            'id': post.id, 'content': '<h2>How</h2><p>Divert the drain.</p>',
+        }}]})
+
+        detail = self.client.get(f'/api/posts/{post.slug}/').json()
+        self.assertEqual(detail['content_html'], '<h2 id="how">How</h2><p>Divert the drain.</p>')
+        self.assertEqual(detail['toc'], [{'level': 2, 'id': 'how', 'title': 'How'}])
+        listed = self.client.get('/api/posts/').json()['results'][0]
+        self.assertEqual((listed['excerpt'], listed['summary']), ('', 'Divert the drain.'))
+        self.assertEqual((listed['word_count'], listed['reading_time']), (4, 1))
+
+    def test_batch_results_are_searchable(self):
+        self.send({'actions': [self.create_action('Heat pumps', status='published')]})
+        response = self.client.get('/api/posts/', {'search': 'heat'})
+        self.assertEqual([r['title'] for r in response.data['results']], ['Heat pumps'])
+
+    def test_batch_cost_does_not_grow_with_items(self):
+        def batch(prefix, size):
+            return {'actions': [
+                self.create_action(f'{prefix} {i}', category=f'{prefix} cat {i}',
+                                   tags=[f'{prefix}-a{i}', f'{prefix}-b{i}'])
+                for i in range(size)
+            ]}
+
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.send(batch('small', 2)).status_code, 200)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.send(batch('large', 20)).status_code, 200)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(Post.objects.count(), 22)
+
+
+@override_settings(API_CACHE_TIMEOUT=0, WEBHOOK_QUEUE_ENABLED=True, WEBHOOK_MAX_ATTEMPTS=2)
+class WebhookQueueTests(WebhookClientMixin, TestCase):
+    def drain(self):
+        return [process(delivery_id) for delivery_id in claim_batch(10)]
+
+    def test_delivery_is_queued_and_processed(self):
+        response = self.send(self.create_action('Queued post'))
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Post.objects.filter(title='Queued post').exists())
+
+        [delivery] = self.drain()
+        self.assertEqual(delivery.status, 'done')
+        self.assertEqual(delivery.result, 'Post created successfully')
+        self.assertTrue(Post.objects.filter(title='Queued post').exists())
+        self.assertEqual(self.drain(), [])
+
+    def test_invalid_json_is_rejected_before_queueing(self):
+        body = b'not json'
+        signature = hmac.new(settings.WEBHOOK_SECRET.encode(), body, hashlib.sha1).hexdigest()
+        response = self.client.post(
+            self.url, body, content_type='application/json',
+            headers={'x_hub_signature': f'sha1={signature}'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_payload_errors_are_dead_lettered_immediately(self):
+        self.send({'action': 'delete_post', 'content': {'id': 999}})
+        [delivery] = self.drain()
+        self.assertEqual((delivery.status, delivery.attempts), ('dead', 1))
+        self.assertEqual(delivery.last_error, 'Post not found')
+
+    def test_failures_retry_with_backoff_then_dead_letter(self):
+        self.send(self.create_action('Flaky'))
+        failing = mock.patch('api.webhooks.process_actions', side_effect=RuntimeError('db gone'))
+        with failing, self.assertLogs('api.webhook_queue', 'ERROR'):
+            [delivery] = self.drain()
+            self.assertEqual((delivery.status, delivery.attempts), ('pending', 1))
+            self.assertGreater(delivery.next_attempt_at, timezone.now())
+            self.assertEqual(self.drain(), [])
+
+            WebhookDelivery.objects.update(next_attempt_at=timezone.now())
+            [delivery] = self.drain()
+        self.assertEqual((delivery.status, delivery.attempts), ('dead', 2))
+        self.assertIn('db gone', delivery.last_error)
+
+    def test_bad_payload_exceptions_are_not_retried(self):
+        self.send(self.create_action('Broken'))
+        failing = mock.patch('api.webhooks.process_actions', side_effect=KeyError('title'))
+        with failing, self.assertLogs('api.webhook_queue', 'ERROR'):
+            [delivery] = self.drain()
+        self.assertEqual((delivery.status, delivery.attempts), ('dead', 1))
+        self.assertEqual(delivery.last_error, "KeyError: 'title'")
+
+    def test_deliveries_for_the_same_post_run_in_order(self):
+        first, second = create_posts(2, category=self.category, author=self.author)
+        for title in ('One', 'Two'):
+            self.send({'action': 'update_post', 'content': {'id': str(first.id), 'title': title}})
+        self.send({'actions': [{'action': 'update_post', 'content': {'id': second.id, 'title': 'Other'}}]})
+        self.send(self.create_action('New'))
+        one, two, other, new = WebhookDelivery.objects.order_by('id').values_list('id', flat=True)
+
+        self.assertEqual(claim_batch(10), [one, other, new])
+        self.assertEqual(claim_batch(10), [])
+        for delivery_id in (one, other, new):
+            process(delivery_id)
+        self.assertEqual(claim_batch(10), [two])
+        process(two)
+        first.refresh_from_db()
+        self.assertEqual(first.title, 'Two')
+
+    def test_expired_claim_taken_over_is_left_alone(self):
+        self.send(self.create_action('Slow'))
+        [delivery_id] = claim_batch(10)
+        process_actions = webhooks.process_actions
+
+        def slow_process_actions(actions):
+            # Another worker claimed it again after the lease ran out
+            WebhookDelivery.objects.update(locked_at=timezone.now() + timedelta(seconds=1))
+            return process_actions(actions)
+
+        with mock.patch('api.webhooks.process_actions', slow_process_actions), \
+                self.assertLogs('api.webhook_queue', 'WARNING'):
+            delivery = process(delivery_id)
+        self.assertEqual((delivery.status, delivery.attempts), ('processing', 0))
+        self.assertFalse(Post.objects.filter(title='Slow').exists())
+
+    def test_abandoned_claims_are_reclaimed(self):
+        self.send(self.create_action('Orphan'))
+        self.assertEqual(len(claim_batch(10)), 1)
+        self.assertEqual(claim_batch(10), [])
+        WebhookDelivery.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(len(claim_batch(10)), 1)
+
+
+class BenchmarkApiTests(TestCase):
+    def setUp(self):
+        create_posts(3, category=Category.objects.create(name='Zero Waste'),
+                     tags=[Tag.objects.create(name='solar')])
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = os.path.join(directory.name, 'baseline.json')
+
+    def benchmark(self, *args):
+        out = StringIO()
+        call_command('benchmark_api', '--requests', '2', '--warmup', '0',
+                     '--baseline', self.baseline, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_reports_every_scenario_and_rolls_back(self):
+        posts = Post.objects.count()
+        report = self.benchmark('--save')
+        for name in ('post-list', 'post-search', 'post-detail', 'tag-list', 'webhook-batch'):
+            self.assertIn(name, report)
+        self.assertEqual(Post.objects.count(), posts)
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+        with open(self.baseline) as f:
+            results = json.load(f)['results']
+        self.assertEqual(set(results['post-list']), {'p50', 'p95', 'p99', 'mean', 'rps', 'queries'})
+        for name in ('post-list', 'post-list-category', 'post-list-tag', 'post-detail', 'tag-list'):
+            self.assertEqual(results[name]['queries'], QUERY_BUDGETS[name], name)
+
+    def test_check_fails_on_regressions(self):
+        self.benchmark('--save', '--only', 'post-list')
+        self.assertIn('No regressions', self.benchmark(
+            '--check', '--only', 'post-list', '--min-delta-ms', '10000'
+        ))
+
+        with open(self.baseline) as f:
+            baseline = json.load(f)
+        baseline['results']['post-list']['queries'] -= 1
+        with open(self.baseline, 'w') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, 'post-list: 4 queries per request, baseline 3'):
+            self.benchmark('--check', '--only', 'post-list', '--min-delta-ms', '10000')
+
+    def test_compare_thresholds(self):
+        base = {'p50': 10.0, 'p95': 20.0, 'queries': 4}
+        self.assertEqual(compare({'x': {**base, 'p50': 12.0, 'p95': 24.0}}, {'x': base}), [])
+        self.assertEqual(compare({'x': {**base, 'p50': 0.5}}, {'x': {**base, 'p50': 0.2}}), [])
+        [regression] = compare({'x': {**base, 'p95': 30.0}}, {'x': base})
+        self.assertIn('x: p95 30.00ms', regression)
+        self.assertEqual(compare({'new': base}, {}), [])
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        create_posts(3)
+        histograms.reset()
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/posts/')
+        metrics = dict(
+            part.strip().split(';', 1) for part in response['Server-Timing'].split(',')
+        )
+        self.assertEqual(set(metrics), {'db', 'view', 'render', 'total'})
+        self.assertIn(f'desc="{QUERY_BUDGETS["post-list"]} queries"', metrics['db'])
+
+    @override_settings(REQUEST_TIMING_HEADER=False)
+    def test_header_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/posts/'))
+
+    def test_structured_log_line(self):
+        with self.assertLogs('api.timing', 'INFO') as logs:
+            self.client.get('/api/tags/')
+        [line] = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(
+            (line['route'], line['status'], line['queries']),
+            ('GET tag-list', 200, QUERY_BUDGETS['tag-list']),
+        )
+        self.assertLessEqual(line['db_ms'], line['total_ms'])
+
+    @override_settings(REQUEST_TIMING_SLOW_MS=-1)
+    def test_slow_requests_log_a_warning(self):
+        with self.assertLogs('api.timing', 'WARNING'):
+            self.client.get('/api/tags/')
+
+    def test_staff_endpoint_dumps_and_resets_histograms(self):
+        for _ in range(3):
+            self.client.get('/api/posts/')
+        self.client.get('/api/nowhere/')
+        self.assertEqual(self.client.get('/api/metrics/requests/').status_code, 401)
+
+        staff = User.objects.create_user(username='ops', is_staff=True)
+        self.client.force_authenticate(staff)
+        routes = self.client.get('/api/metrics/requests/').json()['routes']
+        self.assertEqual(routes['GET post-list']['count'], 3)
+        self.assertEqual(routes['GET post-list']['queries_mean'], QUERY_BUDGETS['post-list'])
+        self.assertEqual(sum(routes['GET post-list']['buckets'].values()), 3)
+        self.assertLessEqual(routes['GET post-list']['p50_ms'], routes['GET post-list']['max_ms'])
+        self.assertEqual(routes['GET <unresolved>']['count'], 1)
+
+        self.assertEqual(self.client.delete('/api/metrics/requests/').status_code, 204)
+        # Only the reset itself has been recorded since
+        routes = self.client.get('/api/metrics/requests/').json()['routes']
+        self.assertEqual(list(routes), ['DELETE request-metrics'])
+
+
+# Every query counts as slow
+@override_settings(API_CACHE_TIMEOUT=0, SLOW_QUERY_MS=1e-6, SLOW_QUERY_EXPLAIN_SAMPLE=1)
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        create_posts(3)
+
+    def slow_queries(self, path):
+        with self.assertLogs('api.slow_queries', 'WARNING') as logs:
+            self.client.get(path)
+        return [json.loads(record.getMessage()) for record in logs.records]
+
+    def test_logs_sql_route_site_and_plan(self):
+        entries = self.slow_queries('/api/posts/?ordering=title')
+        self.assertEqual(len(entries), QUERY_BUDGETS['post-list'])
+        entry = next(entry for entry in entries if 'blog_post' in entry['sql'])
+        self.assertEqual(entry['route'], 'GET post-list')
+        self.assertEqual(entry['path'], '/api/posts/')
+        self.assertFalse(entry['failed'])
+        self.assertIsInstance(entry['params'], list)
+        self.assertFalse(entry['site'].startswith(('api/instrumentation', '/')))
+        self.assertIn('blog_post', json.dumps(entry['plan']))
+
+    def test_explain_does_not_count_as_a_query(self):
+        response = self.client.get('/api/posts/')
+        self.assertIn(f'desc="{QUERY_BUDGETS["post-list"]} queries"', response['Server-Timing'])
+
+    def test_failed_explain_leaves_the_transaction_usable(self):
+        with transaction.atomic():
+            Tag.objects.create(name='kept')
+            [error] = explain(connection, 'SELECT * FROM missing_table', [])
+            self.assertTrue(error.startswith('EXPLAIN failed: '))
+            self.assertIsInstance(explain(connection, 'SELECT 1', [])[0], list)
+            self.assertTrue(Tag.objects.filter(name='kept').exists())
+
+    @override_settings(SLOW_QUERY_EXPLAIN_SAMPLE=0)
+    def test_explain_is_sampled(self):
+        entries = self.slow_queries('/api/tags/')
+        self.assertEqual([entry['plan'] for entry in entries], [None] * len(entries))
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_zero_threshold_turns_it_off(self):
+        with self.assertNoLogs('api.slow_queries', 'WARNING'):
+            self.client.get('/api/tags/')
+
+
+@override_settings(ROOT_URLCONF='core.async_urls',
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AsyncReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Zero Waste')
+        self.tag = Tag.objects.create(name='compost')
+        self.posts = create_posts(3, category=self.category, tags=[self.tag])
+        histograms.reset()
+
+    def assertServedAsync(self, response, served=True):
+        # The viewset answers with a DRF Response; async_read() with a plain one
+        self.assertEqual(not isinstance(response, Response), served)
+
+    @override_settings(API_CACHE_TIMEOUT=0)
+    async def test_matches_the_viewset(self):
+        urls = ['/api/posts/', f'/api/posts/?category={self.category.slug}&page=1',
+                f'/api/posts/?tag={self.tag.slug}&ordering=title', f'/api/posts/{self.posts[0].slug}/',
+                '/api/categories/', f'/api/categories/{self.category.slug}/', '/api/tags/',
+                f'/api/tags/{self.tag.slug}/']
+        for url in urls:
+            expected = await sync_to_async(self.client.get)(url)
+            response = await self.async_client.get(url)
+            self.assertServedAsync(response)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertEqual(response.json(), expected.json(), url)
+            self.assertEqual(response['ETag'], expected['ETag'], url)
+
+    @override_settings(API_CACHE_TIMEOUT=0)
+    async def test_other_requests_go_to_the_viewset(self):
+        staff = await User.objects.acreate(username='editor', is_staff=True)
+        token = await Token.objects.acreate(user=staff)
+        requests = [
+            ('/api/posts/?search=post', {}, 200),
+            ('/api/posts/?fields=title', {}, 200),
+            ('/api/posts/?page=99', {}, 404),
+            ('/api/posts/missing/', {}, 404),
+            ('/api/posts.json', {}, 200),
+            ('/api/posts/', {'accept': 'text/html'}, 200),
+            ('/api/posts/', {'authorization': f'Token {token.key}'}, 200),
+        ]
+        for url, headers, status in requests:
+            response = await self.async_client.get(url, headers=headers)
+            self.assertServedAsync(response, served=False)
+            self.assertEqual(response.status_code, status, url)
+        response = await self.async_client.post('/api/posts/', {})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_shares_the_response_cache(self):
+        url = f'/api/posts/{self.posts[0].slug}/'
+        self.assertEqual((await sync_to_async(self.client.get)(url))['X-Cache'], 'MISS')
+        response = await self.async_client.get(url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        await sync_to_async(cache.clear)()
+        self.assertEqual((await self.async_client.get(url))['X-Cache'], 'MISS')
+        self.assertEqual((await sync_to_async(self.client.get)(url))['X-Cache'], 'HIT')
+
+    @override_settings(API_CACHE_TIMEOUT=0)
+    async def test_answers_304_and_is_timed(self):
+        url = '/api/posts/'
+        etag = (await self.async_client.get(url))['ETag']
+        response = await self.async_client.get(url, headers={'if_none_match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertIn(f'desc="{QUERY_BUDGETS["post-not-modified"]} queries"',
+                      response['Server-Timing'])
+        response = await self.async_client.get(url)
+        self.assertIn(f'desc="{QUERY_BUDGETS["post-list"]} queries"', response['Server-Timing'])
+        self.assertEqual(histograms.snapshot()['routes']['GET post-list']['count'], 3)
+
+
+class BenchmarkConcurrencyTests(TransactionTestCase):
+    def test_reports_both_servers(self):
+        create_posts(2)
+        out = StringIO()
+        call_command('benchmark_concurrency', '--clients', '2', '--requests', '4',
+                     '--workers', '1', stdout=out)
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[2:]}
+        self.assertEqual(set(rows), {'wsgi', 'asgi'})
+        self.assertEqual([row[-1] for row in rows.values()], ['0', '0'])
+
+
+@override_settings(API_CACHE_TIMEOUT=0, SNAPSHOTS_ENABLED=True, SNAPSHOT_POST_DETAILS=2,
+                   SNAPSHOT_HOST='testserver')
+class SnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        settings_override = override_settings(SNAPSHOT_ROOT=self.root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.energy = Category.objects.create(name='Renewable Energy')
+        self.waste = Category.objects.create(name='Zero Waste')
+        self.energy_posts = create_posts(2, category=self.energy)
+        self.waste_posts = create_posts(1, category=self.waste)
+
+    def build(self, *args):
+        out = StringIO()
+        call_command('build_snapshots', '--processes', '0', '-v', '2', *args, stdout=out, stderr=StringIO())
+        return dict(line.strip().rsplit(': ', 1) for line in out.getvalue().splitlines()
+                    if line.startswith('  '))
+
+    def read(self, url, suffix=''):
+        with open(os.path.join(self.root, snapshot_file(url)) + suffix, 'rb') as f:
+            return f.read()
+
+    def write(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+
+    def test_writes_responses_compressed_copies_and_manifest(self):
+        built = self.build()
+        detail = f'/api/posts/{self.energy_posts[1].slug}/'
+        category = f'/api/posts/?category={self.energy.slug}'
+        for url in ('/api/posts/', category, detail, '/api/categories/', '/api/tags/'):
+            self.assertEqual(built[url], 'written')
+            self.assertEqual(json.loads(self.read(url)), self.client.get(url, secure=True).json(), url)
+            self.assertEqual(gzip.decompress(self.read(url, '.gz')), self.read(url))
+        self.assertTrue(self.read(category).startswith(b'{"count":2,'))
+        # The two latest posts only, and no featured list without featured posts
+        self.assertNotIn(f'/api/posts/{self.energy_posts[0].slug}/', built)
+        self.assertNotIn('/api/posts/?is_featured=true', built)
+
+        with open(os.path.join(self.root, 'manifest.json')) as f:
+            manifest = json.load(f)
+        self.assertEqual(set(manifest), set(built))
+        self.assertEqual(manifest[detail]['file'],
+                         f'api/posts/{self.energy_posts[1].slug}/index.json')
+        self.assertEqual(manifest[detail]['etag'], self.client.get(detail)['ETag'])
+        self.assertEqual(self.build(), {})
+
+    def test_writes_regenerate_affected_snapshots_only(self):
+        self.build()
+        post = self.waste_posts[0]
+        post.title = 'Edited'
+        self.write(post.save)
+        stale = set(Snapshot.objects.exclude(stale_at=None).values_list('url', flat=True))
+        self.assertEqual(stale, {
+            '/api/posts/', f'/api/posts/?category={self.waste.slug}', f'/api/posts/{post.slug}/',
+        })
+        built = self.build()
+        self.assertEqual(set(built), stale)
+        self.assertIn(b'"title":"Edited"', self.read(f'/api/posts/{post.slug}/'))
+
+        self.write(self.waste.delete)
+        built = self.build()
+        self.assertEqual(built['/api/categories/'], 'written')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, snapshot_file(f'/api/posts/?category={self.waste.slug}'))
+        ))
+        self.assertFalse(Snapshot.objects.filter(url__contains=self.waste.slug).exists())
+
+    def test_new_featured_post_adds_snapshots(self):
+        self.build()
+        post = self.energy_posts[0]
+        post.is_featured = True
+        self.write(post.save)
+        built = self.build()
+        self.assertEqual(built['/api/posts/?is_featured=true'], 'written')
+        self.assertEqual(built[f'/api/posts/{post.slug}/'], 'written')
+
+    def test_write_during_a_build_keeps_the_snapshot_stale(self):
+        self.build()
+        post = self.waste_posts[0]
+        url = f'/api/posts/{post.slug}/'
+        snapshot = Snapshot.objects.get(url=url)
+        snapshots.mark_stale({f'post:{post.slug}'})
+        self.assertEqual(snapshots.claim_batch(10), [snapshot.pk])
+        self.assertEqual(snapshots.claim_batch(10), [])
+        render = snapshots.render
+
+        def render_during_write(url):
+            # Rendered from the old row, committed just before the edit
+            response = render(url)
+            post.title = 'Edited mid-build'
+            self.write(post.save)
+            return response
+
+        with mock.patch('api.snapshots.render', render_during_write):
+            self.assertEqual(snapshots.build(snapshot.pk), (url, 'unchanged'))
+        snapshot.refresh_from_db()
+        self.assertIsNotNone(snapshot.stale_at)
+        self.assertIsNone(snapshot.locked_at)
+        self.assertEqual(self.build()[url], 'written')
+        self.assertIn(b'"title":"Edited mid-build"', self.read(url))
+
+    @override_settings(SNAPSHOT_MAX_ATTEMPTS=2)
+    def test_failing_render_backs_off_then_gives_up(self):
+        self.build()
+        post = self.waste_posts[0]
+        url = f'/api/posts/{post.slug}/'
+        snapshots.mark_stale({f'post:{post.slug}'})
+        failing = mock.patch('api.snapshots.render', side_effect=RuntimeError('renderer down'))
+        with failing as render, self.assertLogs('api.snapshots', 'ERROR'):
+            # The run ends instead of re-claiming the failed rows
+            built = self.build()
+            self.assertEqual(built[url], 'failed')
+            self.assertEqual(render.call_count, len(built))
+            snapshot = Snapshot.objects.get(url=url)
+            self.assertEqual(snapshot.attempts, 1)
+            self.assertEqual(snapshot.last_error, 'RuntimeError: renderer down')
+            self.assertGreater(snapshot.next_attempt_at, timezone.now())
+            self.assertEqual(self.build(), {})
+
+            Snapshot.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(self.build()[url], 'failed')
+            snapshot.refresh_from_db()
+            self.assertEqual(snapshot.attempts, 2)
+            self.assertIsNotNone(snapshot.failed_at)
+            self.assertIsNotNone(snapshot.stale_at)
+            self.assertEqual(self.build(), {})
+
+        # A write gives it another try
+        post.title = 'Edited'
+        self.write(post.save)
+        self.assertEqual(self.build()[url], 'written')
+        snapshot.refresh_from_db()
+        self.assertEqual((snapshot.attempts, snapshot.failed_at, snapshot.last_error), (0, None, ''))
@@ -1,41 +1,106 @@
 from django.shortcuts import render
+from django.http import Http404
 from rest_framework import viewsets, filters
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.authentication import TokenAuthentication # <--- NEW IMPORT
+from django.db.models import Count, Max, Prefetch, Subquery
 from django.utils import timezone
 from blog.models import Category, Tag, Post
+from blog.search import get_snippets, parse_terms
+from .cache import CachedReadMixin
+from .conditional import ConditionalGetMixin, Validators, latest
+from .filters import PostSearchFilter
+from .pagination import PostPagination
+from .projection import ProjectedListMixin, get_projection
+from .sparse import SparseFieldsMixin
 from .serializers import (
-    CategorySerializer, TagSerializer,
-    PostListSerializer, PostDetailSerializer
+    CategoryCountSerializer, TagCountSerializer,
+    PostListSerializer, PostSearchResultSerializer, PostDetailSerializer
 )
 
-class CategoryViewSet(viewsets.ModelViewSet):
+def newest_updated_at(model):
+    # Uncorrelated, so evaluated once per query rather than per row
+    return Subquery(model.objects.order_by('-updated_at').values('updated_at')[:1])
+
+
+class TaxonomyValidatorsMixin:
+    """Validators for Category/Tag endpoints from their updated_at column."""
+
+    def get_validators(self):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        if self.action == 'list':
+            stats = queryset.aggregate(latest=Max('updated_at'), count=Count('id'))
+            return Validators(self.request, (stats['latest'], stats['count']))
+        updated_at = queryset.filter(
+            **{self.lookup_field: self.kwargs[self.lookup_field]}
+        ).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        return Validators(self.request, (updated_at,), last_modified=updated_at)
+
+class CategoryViewSet(CachedReadMixin, TaxonomyValidatorsMixin, ConditionalGetMixin, SparseFieldsMixin,
+                      viewsets.ModelViewSet):
     queryset = Category.objects.all()
-    serializer_class = CategorySerializer
+    serializer_class = CategoryCountSerializer
+    deferrable_fields = ('description',)
     permission_classes = [IsAuthenticatedOrReadOnly]
+    filter_backends = [filters.OrderingFilter]
+    # published_post_count is a maintained column (blog.counters), so
+    # "most used first" is a plain sort over the table
+    ordering_fields = ['name', 'created_at', 'published_post_count']
+    ordering = ['name']
     lookup_field = 'slug'
 
-class TagViewSet(viewsets.ModelViewSet):
+    def get_cache_tags(self):
+        if self.action == 'list':
+            return ['categories']
+        return [f'category:{self.kwargs[self.lookup_field]}']
+
+class TagViewSet(CachedReadMixin, TaxonomyValidatorsMixin, ConditionalGetMixin, SparseFieldsMixin,
+                 viewsets.ModelViewSet):
     queryset = Tag.objects.all()
-    serializer_class = TagSerializer
+    serializer_class = TagCountSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = ['name', 'created_at', 'published_post_count']
+    ordering = ['name']
     lookup_field = 'slug'
 
-class PostViewSet(viewsets.ModelViewSet):
+    def get_cache_tags(self):
+        if self.action == 'list':
+            return ['tags']
+        return [f'tag:{self.kwargs[self.lookup_field]}']
+
+class PostViewSet(CachedReadMixin, ConditionalGetMixin, SparseFieldsMixin, ProjectedListMixin,
+                  viewsets.ModelViewSet):
     queryset = Post.objects.all()
+    deferrable_fields = ('content', 'content_html', 'toc')
+    sparse_actions = ('list', 'retrieve', 'related')
     
     # ADDED: This tells DRF to use TokenAuthentication for this ViewSet
     authentication_classes = [TokenAuthentication] 
     
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['title', 'content', 'category__name', 'tags__name']
+    pagination_class = PostPagination
+    filter_backends = [filters.OrderingFilter, PostSearchFilter]
     ordering_fields = ['created_at', 'published_at', 'title']
     ordering = ['-created_at']
     lookup_field = 'slug'
 
     def get_queryset(self):
-        queryset = Post.objects.all()
+        # Load author/category in the main query and all tags in one extra
+        # query, so the cost of a page does not grow with PAGE_SIZE. Lists
+        # are rendered from values() rows by ProjectedListMixin, which orders
+        # tags by id; the prefetch matches so both paths agree.
+        queryset = Post.objects.select_related('author', 'category', 'image').defer(
+            *self.get_deferred_fields()
+        )
+        if self.is_field_requested('tags'):
+            queryset = queryset.prefetch_related(
+                Prefetch('tags', queryset=Tag.objects.order_by('id'))
+            )
         if self.action == 'list':
             if not self.request.user.is_staff:
                 queryset = queryset.filter(status='published')
@@ -45,17 +110,102 @@ class PostViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(category__slug=category)
         if tag:
             queryset = queryset.filter(tags__slug=tag)
+        featured = self.request.query_params.get('is_featured')
+        if featured in ('true', '1'):
+            queryset = queryset.filter(is_featured=True)
+        elif featured in ('false', '0'):
+            queryset = queryset.filter(is_featured=False)
         return queryset
 
+    def get_cache_tags(self):
+        if self.action == 'related':
+            # posts:list changes with any post, whose title etc. may be shown
+            return ['posts:all', 'posts:list', f'related:{self.kwargs[self.lookup_field]}']
+        if self.action != 'list':
+            return ['posts:all', f'post:{self.kwargs[self.lookup_field]}']
+        tags = ['posts:all']
+        category = self.request.query_params.get('category')
+        tag = self.request.query_params.get('tag')
+        if category:
+            tags.append(f'posts:category:{category}')
+        if tag:
+            tags.append(f'posts:tag:{tag}')
+        if not (category or tag):
+            tags.append('posts:list')
+        return tags
+
+    def get_validators(self):
+        # Posts embed their category and tags, so their timestamps count too;
+        # aggregating avoids loading (or even selecting) the content column.
+        # Lists take the newest category and tag overall rather than joining
+        # every post's: taxonomy edits are rare and already expire all post
+        # responses (api.signals), while the join ran on every list.
+        if self.action == 'list':
+            queryset = self.filter_queryset(self.get_queryset())
+            taxonomy = {
+                'category': Max(newest_updated_at(Category)),
+                'tags': Max(newest_updated_at(Tag)),
+            }
+        else:
+            queryset = self.get_queryset().filter(slug=self.kwargs[self.lookup_field])
+            taxonomy = {'category': Max('category__updated_at'), 'tags': Max('tags__updated_at')}
+        stats = queryset.order_by().aggregate(
+            latest=Max('updated_at'),
+            count=Count('id', distinct=True),
+            **taxonomy,
+        )
+        parts = (stats['latest'], stats['category'], stats['tags'], stats['count'])
+        if self.action == 'list':
+            return Validators(self.request, parts)
+        if not stats['count']:
+            return None
+        return Validators(
+            self.request, parts,
+            last_modified=latest(stats['latest'], stats['category'], stats['tags']),
+        )
+
+    def get_search_text(self):
+        text = PostSearchFilter().get_search_text(self.request)
+        return text if parse_terms(text) else ''
+
     def get_serializer_class(self):
+        if self.action == 'related':
+            return self.sparse_serializer_class(PostListSerializer)
         if self.action == 'list':
-            return PostListSerializer
-        return PostDetailSerializer
+            if self.get_search_text():
+                return self.sparse_serializer_class(PostSearchResultSerializer)
+            return self.sparse_serializer_class(PostListSerializer)
+        return self.sparse_serializer_class(PostDetailSerializer)
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        # Highlight matches for the current page only, in a single query
+        if page is not None and self.get_search_text() and self.is_field_requested('search_snippet'):
+            self.search_snippets = get_snippets([row['id'] for row in page], self.get_search_text())
+        return page
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
+        context['search_snippets'] = getattr(self, 'search_snippets', {})
         return context
 
+    @action(detail=True)
+    def related(self, request, *args, **kwargs):
+        """The post's precomputed related posts (blog.related), best first."""
+        return self.cached_response(self.list_related, request, *args, **kwargs)
+
+    def list_related(self, request, *args, **kwargs):
+        slug = self.kwargs[self.lookup_field]
+        queryset = self.get_queryset().filter(
+            status='published', related_to__post__slug=slug,
+        ).order_by('related_to__rank')
+        projection = get_projection(self.get_serializer_class())
+        data = projection.render(projection.values(queryset), self.get_serializer())
+        # Only an empty list needs to tell an unknown post from one without related posts
+        if not data and not Post.objects.filter(slug=slug).exists():
+            raise Http404
+        return Response(data)
+
     def perform_create(self, serializer):
         # Ensure 'published_at' is set if status is 'published'
         if serializer.validated_data.get('status') == 'published':
@@ -0,0 +1,173 @@
+"""
+DB-backed queue for content webhook deliveries.
+
+``content_webhook`` stores the verified raw body as a WebhookDelivery and
+answers 202; ``manage.py process_webhooks`` drains the table. Rows are
+claimed with a conditional UPDATE (``status='pending'`` -> ``'processing'``)
+so several worker threads or processes can share the table without
+row locks or an external broker. A claim older than ``WEBHOOK_LEASE_SECONDS``
+is considered abandoned by a crashed worker and becomes claimable again.
+
+Deliveries that touch the same post are applied in the order they were
+received: one is not claimed while an earlier pending or processing
+delivery updates or deletes any of its posts. A worker applies the payload
+and records the outcome in one transaction that starts by renewing its
+claim, so an attempt that outlived its lease and was claimed again cannot
+overwrite the newer attempt's outcome.
+
+Payload errors (4xx from the handler, or a ValueError, LookupError,
+TypeError, ValidationError or DataError raised while applying it) are
+permanent and go straight to the ``dead`` state; anything else is retried
+with exponential backoff until ``WEBHOOK_MAX_ATTEMPTS`` is reached.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DataError, close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import WebhookDelivery
+
+logger = logging.getLogger(__name__)
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+# Raised for a bad payload; retrying cannot help
+PERMANENT_ERRORS = (ValueError, LookupError, TypeError, ValidationError, DataError)
+
+
+class LeaseLost(Exception):
+    """Another worker claimed the delivery after this one's lease ran out."""
+
+
+def enqueue(body, post_ids=()):
+    return WebhookDelivery.objects.create(
+        body=body, post_ids=sorted(set(post_ids)), next_attempt_at=timezone.now(),
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number `attempts` (1-based), capped."""
+    base = get_setting('WEBHOOK_RETRY_BASE_SECONDS', 30)
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), 6 * 60 * 60))
+
+
+def due_deliveries():
+    now = timezone.now()
+    lease = timedelta(seconds=get_setting('WEBHOOK_LEASE_SECONDS', 300))
+    return WebhookDelivery.objects.filter(
+        Q(status='pending', next_attempt_at__lte=now)
+        | Q(status='processing', locked_at__lt=now - lease)
+    )
+
+
+def claim(delivery_id):
+    """Atomically take a due delivery; False if another worker got it first."""
+    now = timezone.now()
+    return due_deliveries().filter(id=delivery_id).update(
+        status='processing', locked_at=now
+    ) == 1
+
+
+def first_unfinished(before):
+    """{post_id: earliest pending or processing delivery touching it}, up to id `before`."""
+    first = {}
+    rows = (
+        WebhookDelivery.objects.filter(status__in=('pending', 'processing'), id__lte=before)
+        .exclude(post_ids=[]).order_by('id').values_list('id', 'post_ids')
+    )
+    for delivery_id, post_ids in rows.iterator():
+        for post_id in post_ids:
+            first.setdefault(post_id, delivery_id)
+    return first
+
+
+def claim_batch(limit):
+    due = list(due_deliveries().order_by('next_attempt_at', 'id').values_list('id', 'post_ids')[:limit])
+    first = first_unfinished(max((delivery_id for delivery_id, _ in due), default=0))
+    return [
+        delivery_id for delivery_id, post_ids in due
+        if all(first.get(post_id, delivery_id) >= delivery_id for post_id in post_ids)
+        and claim(delivery_id)
+    ]
+
+
+def process(delivery_id):
+    """Apply one claimed delivery and record the outcome."""
+    # Imported here: webhooks imports this module for enqueue()
+    from .webhooks import handle_payload
+
+    delivery = WebhookDelivery.objects.get(id=delivery_id)
+    claimed_at = delivery.locked_at
+    delivery.attempts += 1
+    try:
+        with transaction.atomic():
+            # Renewing the claim locks the row until the outcome is saved
+            renewed_at = timezone.now()
+            if not owned(delivery, claimed_at).update(locked_at=renewed_at):
+                raise LeaseLost
+            response = handle_payload(json.loads(delivery.body))
+            delivery.result = response.content.decode()
+            delivery.processed_at = timezone.now()
+            if response.status_code >= 400:
+                delivery.status = 'dead'
+                delivery.last_error = delivery.result
+            else:
+                delivery.status = 'done'
+                delivery.last_error = ''
+            if not save_outcome(delivery, renewed_at):
+                raise LeaseLost
+    except LeaseLost:
+        logger.warning('Webhook delivery %s was claimed by another worker', delivery.id)
+        delivery.refresh_from_db()
+    except Exception as e:
+        logger.exception('Webhook delivery %s failed (attempt %s)', delivery.id, delivery.attempts)
+        delivery.last_error = f'{type(e).__name__}: {e}'
+        delivery.result = ''
+        if isinstance(e, PERMANENT_ERRORS) or delivery.attempts >= get_setting('WEBHOOK_MAX_ATTEMPTS', 8):
+            delivery.status = 'dead'
+        else:
+            delivery.status = 'pending'
+            delivery.next_attempt_at = timezone.now() + backoff(delivery.attempts)
+        if not save_outcome(delivery, claimed_at):
+            logger.warning('Webhook delivery %s was claimed by another worker', delivery.id)
+            delivery.refresh_from_db()
+    finally:
+        close_old_connections()
+    return delivery
+
+
+def owned(delivery, locked_at):
+    return WebhookDelivery.objects.filter(id=delivery.id, status='processing', locked_at=locked_at)
+
+
+def save_outcome(delivery, locked_at):
+    """Record the attempt if the claim stamped `locked_at` is still ours; False otherwise."""
+    delivery.locked_at = None
+    return owned(delivery, locked_at).update(
+        status=delivery.status, attempts=delivery.attempts, next_attempt_at=delivery.next_attempt_at,
+        locked_at=None, last_error=delivery.last_error, result=delivery.result,
+        processed_at=delivery.processed_at,
+    ) == 1
+
+
+def process_in_thread(delivery_id):
+    # Each worker thread owns its connection; release it when done
+    try:
+        return process(delivery_id)
+    finally:
+        connection.close()
+
+
+def requeue_dead():
+    """Move dead-lettered deliveries back to the queue; returns the count."""
+    return WebhookDelivery.objects.filter(status='dead').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now()
+    )
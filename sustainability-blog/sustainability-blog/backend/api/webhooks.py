@@ -2,11 +2,21 @@ import hmac
 import hashlib
 import json
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.contrib.auth.models import User
+from django.db import DataError, IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.utils import timezone
-from blog.models import Post, Category, Tag
+from django.utils.dateparse import parse_datetime
+from blog.bulk import (
+    current_tag_ids, notify_bulk_change, resolve_categories, resolve_tags, set_post_tags,
+    validate_name,
+)
+from blog.counters import snapshot
+from blog.models import Category, Post, Tag
+from blog.rendering import RENDERED_FIELDS
+from .webhook_queue import enqueue
 
 def verify_webhook_signature(request):
     if 'HTTP_X_HUB_SIGNATURE' not in request.META:
@@ -22,87 +32,275 @@ def verify_webhook_signature(request):
     
     return hmac.compare_digest(computed, expected)
 
-@csrf_exempt
-@require_POST
-def content_webhook(request):
-    if not verify_webhook_signature(request):
-        return HttpResponseBadRequest('Invalid signature')
-    
-    try:
-        payload = json.loads(request.body)
-        action = payload.get('action')
-        content = payload.get('content', {})
-        
-        if action == 'create_post':
-            category, _ = Category.objects.get_or_create(
-                name=content.get('category', 'Uncategorized'),
-                defaults={'description': ''}
+POST_ACTIONS = ('create_post', 'update_post', 'delete_post')
+UPDATE_FIELDS = ['title', 'content', 'excerpt', 'status', 'publish_at']
+TEXT_FIELDS = ('title', 'content', 'excerpt')
+STATUSES = {value for value, _ in Post._meta.get_field('status').choices}
+DEFAULT_AUTHOR_ID = 1  # The first admin
+
+SUCCESS_MESSAGES = {
+    'create_post': 'Post created successfully',
+    'update_post': 'Post updated successfully',
+    'delete_post': 'Post deleted successfully',
+}
+
+
+def validate_text(value, name):
+    """Return why `value` can't be stored in the post's `name` field, or None."""
+    field = Post._meta.get_field(name)
+    if not isinstance(value, str):
+        return f'{name} must be a string'
+    if not field.blank and not value.strip():
+        return f'{name} must not be empty'
+    if field.max_length and len(value) > field.max_length:
+        return f'{name} is longer than {field.max_length} characters'
+    return None
+
+
+def validate_action(item):
+    """Return an error message for a malformed action, or None."""
+    if not isinstance(item, dict) or item.get('action') not in POST_ACTIONS:
+        return 'Invalid action'
+    content = item.get('content', {})
+    if not isinstance(content, dict):
+        return 'Invalid payload: content must be an object'
+    required = ['title', 'content'] if item['action'] == 'create_post' else ['id']
+    for key in required:
+        if key not in content:
+            return f'Invalid payload: {KeyError(key)}'
+    for key, label in (('id', 'post id'), ('author_id', 'author id')):
+        if key in content:
+            try:
+                content[key] = int(content[key])
+            except (TypeError, ValueError):
+                return f'Invalid payload: bad {label} {content[key]!r}'
+    for name in TEXT_FIELDS:
+        if name in content:
+            error = validate_text(content[name], name)
+            if error:
+                return f'Invalid payload: {error}'
+    if 'category' in content:
+        error = validate_name(content['category'], Category)
+        if error:
+            return f'Invalid payload: category {error}'
+    if not isinstance(content.get('tags', []), list):
+        return 'Invalid payload: tags must be a list'
+    for name in content.get('tags', []):
+        error = validate_name(name, Tag)
+        if error:
+            return f'Invalid payload: tag {error}'
+    if content.get('publish_at') is not None:
+        publish_at = parse_datetime(str(content['publish_at']))
+        if publish_at is None:
+            return f"Invalid payload: bad publish_at {content['publish_at']!r}"
+        if timezone.is_naive(publish_at):
+            publish_at = timezone.make_aware(publish_at)
+        content['publish_at'] = publish_at
+    if 'status' in content and content['status'] not in STATUSES:
+        return f"Invalid payload: unknown status {content['status']!r}"
+    return None
+
+
+def process_actions(actions):
+    """
+    Apply a list of create/update/delete actions in one transaction.
+
+    Taxonomy is resolved with one lookup and one bulk insert per model,
+    posts are written with bulk_create/bulk_update and tag links with one
+    delete plus one insert. Creates run first, then updates, then deletes;
+    an update of a post the batch also deletes is not written.
+    Returns one {'index', 'action', 'status', ...} dict per action.
+    """
+    results = [
+        {'index': index, 'action': item.get('action') if isinstance(item, dict) else None}
+        for index, item in enumerate(actions)
+    ]
+    valid = {}
+    for result, item in zip(results, actions):
+        error = validate_action(item)
+        if error:
+            result.update(status='error', error=error)
+        else:
+            valid[result['index']] = (item['action'], item.get('content', {}))
+
+    # One lookup for the batch; an unknown author would otherwise fail the
+    # foreign key at commit and roll back every item
+    author_ids = {
+        content.setdefault('author_id', DEFAULT_AUTHOR_ID)
+        for name, content in valid.values() if name == 'create_post'
+    }
+    known_authors = set(User.objects.filter(id__in=author_ids).values_list('id', flat=True))
+    for index, (name, content) in list(valid.items()):
+        if name == 'create_post' and content['author_id'] not in known_authors:
+            results[index].update(
+                status='error', error=f"Invalid payload: unknown author {content['author_id']}"
             )
-            
-            tags = []
-            for tag_name in content.get('tags', []):
-                tag, _ = Tag.objects.get_or_create(name=tag_name)
-                tags.append(tag)
-            
-            post = Post.objects.create(
+            del valid[index]
+
+    def items_for(action):
+        return [(index, content) for index, (name, content) in valid.items() if name == action]
+
+    creates, updates, deletes = (items_for(action) for action in POST_ACTIONS)
+    now = timezone.now()
+
+    with transaction.atomic():
+        categories, new_categories = resolve_categories(
+            [content.get('category', 'Uncategorized') for _, content in creates]
+            + [content['category'] for _, content in updates if 'category' in content]
+        )
+        tags, new_tags = resolve_tags(
+            name for _, content in creates + updates for name in content.get('tags', [])
+        )
+        existing = Post.objects.in_bulk(
+            [content['id'] for _, content in updates + deletes]
+        )
+        for index, content in updates + deletes:
+            if content['id'] not in existing:
+                results[index].update(status='error', error='Post not found')
+        updates = [(i, c) for i, c in updates if c['id'] in existing]
+        deletes = [(i, c) for i, c in deletes if c['id'] in existing]
+        # A post the batch also deletes ends up deleted whatever the update
+        # said; writing it too would make its counters drop twice (once by
+        # the update's snapshot, once by the post_delete receiver)
+        deleted_ids = {content['id'] for _, content in deletes}
+        applied = [(i, c) for i, c in updates if c['id'] not in deleted_ids]
+        previous = snapshot([content['id'] for _, content in applied])
+
+        new_posts = []
+        for index, content in creates:
+            post = Post(
                 title=content['title'],
                 content=content['content'],
                 excerpt=content.get('excerpt', ''),
-                category=category,
+                category=categories[content.get('category', 'Uncategorized')],
                 status=content.get('status', 'draft'),
-                author_id=content.get('author_id', 1)  # Default to first admin
+                author_id=content['author_id'],
+                publish_at=content.get('publish_at'),
             )
-            
-            if tags:
-                post.tags.set(tags)
-            
+            post.slug = post.generate_unique_slug()
             if post.status == 'published':
-                post.published_at = timezone.now()
-                post.save()
-                
-            return HttpResponse('Post created successfully')
-            
-        elif action == 'update_post':
-            try:
-                post = Post.objects.get(id=content['id'])
-                
-                if 'category' in content:
-                    category, _ = Category.objects.get_or_create(
-                        name=content['category'],
-                        defaults={'description': ''}
-                    )
-                    post.category = category
-                
-                if 'tags' in content:
-                    tags = []
-                    for tag_name in content['tags']:
-                        tag, _ = Tag.objects.get_or_create(name=tag_name)
-                        tags.append(tag)
-                    post.tags.set(tags)
-                
-                update_fields = ['title', 'content', 'excerpt', 'status']
-                for field in update_fields:
-                    if field in content:
-                        setattr(post, field, content[field])
-                
-                if content.get('status') == 'published' and not post.published_at:
-                    post.published_at = timezone.now()
-                
-                post.save()
-                return HttpResponse('Post updated successfully')
-                
-            except Post.DoesNotExist:
-                return HttpResponseBadRequest('Post not found')
-                
-        elif action == 'delete_post':
+                post.published_at = now
+            post.render_content()
+            new_posts.append(post)
+        Post.objects.bulk_create(new_posts)
+
+        stale_category_ids = set()
+        updated_posts = {}
+        rendered = False
+        for index, content in applied:
+            post = existing[content['id']]
+            stale_category_ids.add(post.category_id)
+            if 'category' in content:
+                post.category = categories[content['category']]
+            for field in UPDATE_FIELDS:
+                if field in content:
+                    setattr(post, field, content[field])
+            if content.get('status') == 'published' and not post.published_at:
+                post.published_at = now
+            if 'content' in content or 'excerpt' in content:
+                post.render_content()
+                rendered = True
+            post.updated_at = now
+            updated_posts[post.id] = post
+        Post.objects.bulk_update(
+            updated_posts.values(),
+            UPDATE_FIELDS + ['category', 'published_at', 'updated_at']
+            + (RENDERED_FIELDS if rendered else []),
+        )
+
+        tag_ids_by_post = {
+            post.id: [tags[name].id for name in content.get('tags', [])]
+            for post, (_, content) in zip(new_posts, creates)
+        }
+        retagged = {
+            content['id']: [tags[name].id for name in content['tags']]
+            for _, content in applied if 'tags' in content
+        }
+        stale_tag_ids = set().union(*current_tag_ids(retagged).values())
+        tag_ids_by_post.update(retagged)
+        set_post_tags(tag_ids_by_post)
+
+        if deletes:
+            Post.objects.filter(id__in=[content['id'] for _, content in deletes]).delete()
+
+        notify_bulk_change(
+            [post.id for post in new_posts] + list(updated_posts),
+            stale_category_ids, stale_tag_ids,
+            taxonomy_created=new_categories or new_tags,
+            previous=previous,
+        )
+
+    for post, (index, _) in zip(new_posts, creates):
+        results[index].update(status='created', id=post.id, slug=post.slug)
+    for index, content in updates:
+        results[index].update(status='updated', id=content['id'])
+    for index, content in deletes:
+        results[index].update(status='deleted', id=content['id'])
+    return results
+
+
+def touched_post_ids(payload):
+    """Ids of the existing posts a payload updates or deletes, as far as they parse."""
+    items = payload.get('actions') if isinstance(payload, dict) else None
+    if not isinstance(items, list):
+        items = [payload]
+    post_ids = set()
+    for item in items:
+        content = item.get('content') if isinstance(item, dict) else None
+        if isinstance(content, dict) and 'id' in content:
             try:
-                post = Post.objects.get(id=content['id'])
-                post.delete()
-                return HttpResponse('Post deleted successfully')
-            except Post.DoesNotExist:
-                return HttpResponseBadRequest('Post not found')
-        
-        return HttpResponseBadRequest('Invalid action')
-        
-    except (json.JSONDecodeError, KeyError) as e:
-        return HttpResponseBadRequest(f'Invalid payload: {str(e)}')
\ No newline at end of file
+                post_ids.add(int(content['id']))
+            except (TypeError, ValueError):
+                pass
+    return post_ids
+
+
+def handle_payload(payload):
+    """
+    Apply a decoded webhook payload: a single ``{"action": ..., "content":
+    {...}}`` or a batch ``{"actions": [...]}`` of such objects. Batches get
+    a JSON status per item (207 if any item failed); single actions keep
+    the plain-text responses.
+    """
+    if not isinstance(payload, dict):
+        return HttpResponseBadRequest('Invalid payload: expected an object')
+    try:
+        if 'actions' in payload:
+            if not isinstance(payload['actions'], list):
+                return HttpResponseBadRequest('Invalid payload: actions must be a list')
+            results = process_actions(payload['actions'])
+            failed = any(result['status'] == 'error' for result in results)
+            return JsonResponse({'results': results}, status=207 if failed else 200)
+
+        result = process_actions([payload])[0]
+        if result['status'] == 'error':
+            return HttpResponseBadRequest(result['error'])
+        return HttpResponse(SUCCESS_MESSAGES[result['action']])
+
+    except (IntegrityError, DataError) as e:
+        return HttpResponseBadRequest(f'Invalid payload: {str(e)}')
+
+
+@csrf_exempt
+@require_POST
+def content_webhook(request):
+    """
+    Verify and accept a content delivery.
+
+    With ``WEBHOOK_QUEUE_ENABLED`` (the default) the raw body is stored for
+    ``manage.py process_webhooks`` and the sender gets 202 straight away;
+    otherwise the payload is applied inline.
+    """
+    if not verify_webhook_signature(request):
+        return HttpResponseBadRequest('Invalid signature')
+
+    try:
+        body = request.body.decode()
+        payload = json.loads(body)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        return HttpResponseBadRequest(f'Invalid payload: {str(e)}')
+
+    if getattr(settings, 'WEBHOOK_QUEUE_ENABLED', True):
+        delivery = enqueue(body, touched_post_ids(payload))
+        return JsonResponse({'id': delivery.id, 'status': delivery.status}, status=202)
+    return handle_payload(payload)
@@ -0,0 +1,258 @@
+"""
+Set-based helpers for writing many posts at once.
+
+Used by the batched content webhook, the bulk import/maintenance
+commands and the admin's bulk actions. None of these go through ``Model.save()``, so callers must send
+``posts_bulk_changed`` (via ``notify_bulk_change()``) once their writes are
+done; the search index and API cache listen to it. ``render_posts()``,
+which only rewrites the fields derived from content, is announced with
+``posts_rendered`` (via ``notify_rendered()``) instead.
+"""
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .counters import snapshot
+from .models import Category, Tag, Post
+from .rendering import RENDER_VERSION, RENDERED_FIELDS
+from .signals import posts_bulk_changed, posts_rendered
+
+
+def validate_name(name, model):
+    """Return why `name` can't be a category/tag name, or None."""
+    if not isinstance(name, str) or not name.strip():
+        return f'{name!r} must be a non-empty string'
+    if len(name) > model._meta.get_field('name').max_length:
+        return f'{name!r} is too long'
+    if not slugify(name):
+        return f'{name!r} needs a letter or digit'
+    return None
+
+
+def _resolve_by_name(model, names, **defaults):
+    names = {name for name in names if name}
+    found = {obj.name: obj for obj in model.objects.filter(name__in=names)}
+    missing = names - found.keys()
+    if not missing:
+        return found, False
+
+    slugs = {name: slugify(name) for name in missing}
+    # A name that differs only in case or punctuation already owns the slug
+    by_slug = {obj.slug: obj for obj in model.objects.filter(slug__in=slugs.values())}
+    to_create = {}
+    for name in missing:
+        if slugs[name] not in by_slug:
+            to_create.setdefault(slugs[name], model(name=name, slug=slugs[name], **defaults))
+    if to_create:
+        # A concurrent writer (e.g. another webhook worker) may insert the
+        # same slug first; keep its row rather than failing on the constraint
+        model.objects.bulk_create(to_create.values(), ignore_conflicts=True)
+        by_slug.update((obj.slug, obj) for obj in model.objects.filter(slug__in=to_create))
+    found.update((name, by_slug[slugs[name]]) for name in missing)
+    return found, bool(to_create)
+
+
+def resolve_categories(names):
+    """
+    Return ({name: Category}, created_any) for `names`, creating the missing
+    ones with one bulk insert.
+    """
+    return _resolve_by_name(Category, names, description='')
+
+
+def resolve_tags(names):
+    """Return ({name: Tag}, created_any) for `names`, bulk-creating missing ones."""
+    return _resolve_by_name(Tag, names)
+
+
+def current_tag_ids(post_ids):
+    """Return {post_id: {tag_id, ...}} for the given posts in one query."""
+    tag_ids = {post_id: set() for post_id in post_ids}
+    rows = Post.tags.through.objects.filter(post_id__in=tag_ids).values_list('post_id', 'tag_id')
+    for post_id, tag_id in rows:
+        tag_ids[post_id].add(tag_id)
+    return tag_ids
+
+
+def set_post_tags(tag_ids_by_post, replace=True):
+    """Replace the tag sets of many posts with one delete and one insert."""
+    through = Post.tags.through
+    if replace:
+        through.objects.filter(post_id__in=tag_ids_by_post.keys()).delete()
+    through.objects.bulk_create([
+        through(post_id=post_id, tag_id=tag_id)
+        for post_id, tag_ids in tag_ids_by_post.items()
+        for tag_id in set(tag_ids)
+    ])
+
+
+def notify_bulk_change(post_ids, stale_category_ids=(), stale_tag_ids=(), taxonomy_created=False,
+                       previous=None):
+    """
+    Announce posts written without model signals.
+
+    `stale_category_ids` and `stale_tag_ids` are the categories/tags the
+    posts belonged to *before* the change; `taxonomy_created` says whether
+    new Category or Tag rows were bulk-inserted. `previous` is a
+    ``blog.counters.snapshot()`` of the posts taken before writing; with
+    it the taxonomy counters are adjusted by difference instead of
+    recounted.
+    """
+    posts_bulk_changed.send(
+        sender=Post,
+        post_ids=list(post_ids),
+        stale_category_ids=set(stale_category_ids),
+        stale_tag_ids=set(stale_tag_ids),
+        taxonomy_created=taxonomy_created,
+        previous=previous,
+    )
+
+
+def id_chunks(queryset, chunk_size=1000):
+    """Yield the ids of `queryset`'s posts, `chunk_size` at a time in id order."""
+    last_id = 0
+    while True:
+        ids = list(
+            queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        yield ids
+        last_id = ids[-1]
+
+
+def publish_posts(queryset, chunk_size=1000):
+    """
+    Publish the drafts among `queryset`'s posts, one transaction per chunk;
+    returns how many. A post published before keeps its published_at.
+    """
+    published = 0
+    for ids in id_chunks(queryset.filter(status='draft'), chunk_size):
+        with transaction.atomic():
+            previous = snapshot(ids)
+            now = timezone.now()
+            published += Post.objects.filter(id__in=ids, status='draft').update(
+                status='published', published_at=Coalesce(F('published_at'), Value(now)),
+                updated_at=now,
+            )
+            notify_bulk_change(ids, previous=previous)
+    return published
+
+
+def archive_posts(queryset, chunk_size=1000):
+    """Archive `queryset`'s posts; returns how many were not archived yet."""
+    archived = 0
+    for ids in id_chunks(queryset.filter(is_archived=False), chunk_size):
+        # Like manage_content: is_archived is not part of any API
+        # representation, so there is nothing to notify
+        archived += Post.objects.filter(id__in=ids, is_archived=False).update(is_archived=True)
+    return archived
+
+
+def add_tags(queryset, tags, chunk_size=1000, taxonomy_created=False):
+    """Attach `tags` to `queryset`'s posts; returns how many links were added."""
+    through = Post.tags.through
+    tag_ids = {tag.id for tag in tags}
+    added = 0
+    for ids in id_chunks(queryset, chunk_size):
+        with transaction.atomic():
+            current = current_tag_ids(ids)
+            links = [
+                through(post_id=post_id, tag_id=tag_id)
+                for post_id in ids for tag_id in tag_ids - current[post_id]
+            ]
+            changed = sorted({link.post_id for link in links})
+            if not (changed or taxonomy_created):
+                continue
+            previous = snapshot(changed)
+            through.objects.bulk_create(links)
+            # Tags are part of a post's representation (see blog.signals)
+            Post.objects.filter(id__in=changed).update(updated_at=timezone.now())
+            added += len(links)
+            notify_bulk_change(changed, taxonomy_created=taxonomy_created, previous=previous)
+            taxonomy_created = False
+    return added
+
+
+def remove_tags(queryset, tags, chunk_size=1000):
+    """Detach `tags` from `queryset`'s posts; returns how many links were removed."""
+    links = Post.tags.through.objects.filter(tag_id__in=[tag.id for tag in tags])
+    removed = 0
+    for ids in id_chunks(queryset, chunk_size):
+        with transaction.atomic():
+            changed = sorted(set(links.filter(post_id__in=ids).values_list('post_id', flat=True)))
+            if not changed:
+                continue
+            previous = snapshot(changed)
+            removed += links.filter(post_id__in=changed).delete()[0]
+            Post.objects.filter(id__in=changed).update(updated_at=timezone.now())
+            notify_bulk_change(changed, stale_tag_ids=[tag.id for tag in tags], previous=previous)
+    return removed
+
+
+def unrendered_post_ids(everything=False):
+    """Ids of the posts rendered by an older RENDER_VERSION (or of all posts)."""
+    posts = Post.objects.all() if everything else Post.objects.filter(render_version__lt=RENDER_VERSION)
+    return list(posts.order_by('id').values_list('id', flat=True))
+
+
+def render_posts(post_ids):
+    """
+    Render the stored content of the given posts again; returns their ids.
+    Callers send ``posts_rendered`` (see ``notify_rendered()``).
+    """
+    # Rendered outside the transaction, so parallel workers only queue for the writes
+    posts = list(Post.objects.filter(pk__in=list(post_ids)).only('id', 'content', 'excerpt'))
+    for post in posts:
+        post.render_content()
+    with transaction.atomic():
+        current = {
+            pk: (content, excerpt) for pk, content, excerpt in
+            Post.objects.select_for_update().filter(pk__in=[post.id for post in posts])
+            .values_list('id', 'content', 'excerpt')
+        }
+        # A post edited in the meantime was rendered by that write
+        posts = [post for post in posts if current.get(post.id) == (post.content, post.excerpt)]
+        now = timezone.now()
+        for post in posts:
+            # The API's validators are derived from updated_at
+            post.updated_at = now
+        update_posts(posts, RENDERED_FIELDS + ['updated_at'])
+    return [post.id for post in posts]
+
+
+def update_posts(posts, field_names):
+    """
+    Write `field_names` of `posts` with one executemany() UPDATE. Cheaper
+    than bulk_update(), whose CASE expression per column and row costs more
+    than the rendering when every row gets its own values.
+    """
+    if not posts:
+        return
+    meta = Post._meta
+    fields = [meta.get_field(name) for name in field_names]
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {quote(meta.db_table)} SET {assignments} WHERE {quote(meta.pk.column)} = %s',
+            [
+                [*(field.get_db_prep_save(getattr(post, field.attname), connection) for field in fields),
+                 post.pk]
+                for post in posts
+            ],
+        )
+
+
+def render_posts_in_worker(post_ids):
+    # Worker processes are long-lived; drop broken or expired connections
+    try:
+        return render_posts(post_ids)
+    finally:
+        close_old_connections()
+
+
+def notify_rendered(post_ids):
+    posts_rendered.send(sender=Post, post_ids=list(post_ids))
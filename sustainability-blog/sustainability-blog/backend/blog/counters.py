@@ -0,0 +1,121 @@
+"""
+Maintained ``published_post_count`` counters on Category and Tag.
+
+Counts change in the same transaction as the posts they count:
+
+* single-object writes (``save()``, ``delete()``, ``post.tags`` and
+  ``tag.post_set`` changes) apply +1/-1 deltas from the receivers in
+  ``blog.signals``;
+* bulk writers take a ``snapshot()`` of the posts they are about to
+  change and pass it to ``notify_bulk_change(previous=...)``; the
+  ``posts_bulk_changed`` receiver compares it with the posts' new state.
+  Without a snapshot the affected terms are recounted, which is exact but
+  costs a count over each term's posts (over 100ms for a tag on half of
+  a 100k-post corpus).
+
+Changing a counter bumps the term's ``updated_at``, so the taxonomy
+endpoints' validators change with it, and sends
+``taxonomy_counts_changed``, which the API cache listens to.
+``recount()`` (``manage.py recount_taxonomy``) recomputes the counters
+from scratch and repairs any drift.
+"""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Category, Tag, Post
+
+# Sent after counters changed. Arguments: ids (of `sender` rows).
+taxonomy_counts_changed = Signal()
+
+
+def snapshot(post_ids):
+    """{post_id: (category_id, {tag_id, ...})} for those of the posts that are published."""
+    published = dict(
+        Post.objects.filter(pk__in=list(post_ids), status='published').values_list('id', 'category_id')
+    )
+    state = {post_id: (category_id, set()) for post_id, category_id in published.items()}
+    if state:
+        rows = Post.tags.through.objects.filter(post_id__in=state).values_list('post_id', 'tag_id')
+        for post_id, tag_id in rows:
+            state[post_id][1].add(tag_id)
+    return state
+
+
+def apply_deltas(model, deltas):
+    """Add `deltas` ({pk: n}) to the counters, one UPDATE per distinct n."""
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta and pk is not None:
+            by_delta[delta].append(pk)
+    if not by_delta:
+        return
+    now = timezone.now()
+    for delta, ids in by_delta.items():
+        # Clamped so a drifted counter can never make the write fail
+        model.objects.filter(pk__in=ids).update(
+            published_post_count=Greatest(F('published_post_count') + delta, Value(0)),
+            updated_at=now,
+        )
+    taxonomy_counts_changed.send(sender=model, ids=[pk for ids in by_delta.values() for pk in ids])
+
+
+def post_moved(before, after):
+    """
+    Apply the change of one post from `before` to `after`, each a
+    (category_id, tag_ids) pair, or None while the post is not published.
+    """
+    categories, tags = Counter(), Counter()
+    if before is not None:
+        categories[before[0]] -= 1
+        tags.update({tag_id: -1 for tag_id in before[1]})
+    if after is not None:
+        categories[after[0]] += 1
+        tags.update({tag_id: 1 for tag_id in after[1]})
+    apply_deltas(Category, categories)
+    apply_deltas(Tag, tags)
+
+
+def posts_changed(previous, post_ids):
+    """Apply the difference between a snapshot() and the posts' current state."""
+    current = snapshot(post_ids)
+    categories, tags = Counter(), Counter()
+    for state, sign in ((previous, -1), (current, 1)):
+        for category_id, tag_ids in state.values():
+            categories[category_id] += sign
+            tags.update({tag_id: sign for tag_id in tag_ids})
+    apply_deltas(Category, categories)
+    apply_deltas(Tag, tags)
+
+
+def published_counts(model, ids=None):
+    """{pk: published post count} for `model` rows (all, or `ids`), counted from posts."""
+    if model is Category:
+        rows = Post.objects.filter(status='published').values('category_id')
+        column = 'category_id'
+    else:
+        rows = Post.tags.through.objects.filter(post__status='published').values('tag_id')
+        column = 'tag_id'
+    if ids is not None:
+        rows = rows.filter(**{f'{column}__in': list(ids)})
+    return dict(rows.order_by().annotate(n=Count('*')).values_list(column, 'n'))
+
+
+def recount(model, ids=None, dry_run=False):
+    """
+    Recompute `model`'s counters (all of them, or those of `ids`) and fix
+    the ones that drifted; returns {pk: (stored, actual)} of those.
+    """
+    counts = published_counts(model, ids)
+    stored = model.objects.all() if ids is None else model.objects.filter(pk__in=list(ids))
+    drifted = {
+        pk: (value, counts.get(pk, 0))
+        for pk, value in stored.values_list('pk', 'published_post_count')
+        if value != counts.get(pk, 0)
+    }
+    if drifted and not dry_run:
+        apply_deltas(model, {pk: actual - value for pk, (value, actual) in drifted.items()})
+    return drifted
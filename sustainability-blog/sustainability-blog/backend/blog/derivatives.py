@@ -0,0 +1,114 @@
+"""
+Pillow side of the image pipeline (see blog.images): decode a source
+image once and produce its resized variants and blur placeholder.
+
+Orientation from EXIF is applied to the pixels, then every bit of
+metadata (EXIF, XMP, ICC profile, comments) is dropped, so variants carry
+neither camera or location data nor a rotation flag browsers could apply
+twice. Widths larger than the original are not generated: an upscaled
+variant costs bytes without adding detail.
+"""
+import base64
+import hashlib
+from io import BytesIO
+
+from PIL import Image, ImageFilter, ImageOps
+
+# Pillow's save() name, MIME type and encoder options per format
+FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 55}),
+    'webp': ('WEBP', 'image/webp', {'quality': 78, 'method': 6}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'png': ('PNG', 'image/png', {'optimize': True}),
+}
+PLACEHOLDER_WIDTH = 16
+
+
+class Variant:
+    __slots__ = ('format', 'width', 'height', 'content', 'digest')
+
+    def __init__(self, format, width, height, content):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.content = content
+        self.digest = hashlib.sha256(content).hexdigest()
+
+    @property
+    def mime_type(self):
+        return FORMATS[self.format][1]
+
+    @property
+    def name(self):
+        # Named after the bytes: a URL never changes what it serves
+        return f'{self.digest[:20]}-{self.width}w.{self.format}'
+
+
+def available_formats(wanted):
+    """The formats of `wanted` this Pillow build can write."""
+    Image.init()
+    return [name for name in wanted if FORMATS[name][0] in Image.SAVE]
+
+
+def open_image(content):
+    """The decoded, upright and metadata-free image in `content`."""
+    image = Image.open(BytesIO(content))
+    image.load()
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    clean = image.convert('RGBA' if has_alpha else 'RGB')
+    clean.info = {}
+    return clean
+
+
+def has_alpha(image):
+    return image.mode == 'RGBA' and image.getextrema()[3][0] < 255
+
+
+def encode(image, format):
+    name, _, options = FORMATS[format]
+    buffer = BytesIO()
+    image.save(buffer, name, **options)
+    return buffer.getvalue()
+
+
+def resized(image, width):
+    if width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def variant_widths(original_width, widths):
+    """The `widths` below the original's, plus the original's when below the largest."""
+    chosen = sorted({width for width in widths if width < original_width})
+    if original_width <= max(widths):
+        chosen.append(original_width)
+    return chosen
+
+
+def make_variants(image, widths, formats):
+    """
+    ([Variant], fallback) for `image` at `widths`, in each of `formats` and
+    in the fallback format every browser reads (PNG for transparent images).
+    """
+    fallback = 'png' if has_alpha(image) else 'jpeg'
+    if fallback == 'jpeg':
+        image = image.convert('RGB')
+    variants = []
+    for width in variant_widths(image.width, widths):
+        scaled = resized(image, width)
+        for format in [*formats, fallback]:
+            variants.append(Variant(format, scaled.width, scaled.height, encode(scaled, format)))
+    return variants, fallback
+
+
+def placeholder(image, formats):
+    """A blurred thumbnail of `image` as a data: URI of a few hundred bytes."""
+    small = resized(image, PLACEHOLDER_WIDTH).filter(ImageFilter.GaussianBlur(1))
+    format = 'webp' if 'webp' in formats else 'jpeg'
+    if format == 'jpeg':
+        small = small.convert('RGB')
+    _, mime_type, _ = FORMATS[format]
+    content = encode(small, format)
+    return f'data:{mime_type};base64,{base64.b64encode(content).decode()}'
@@ -0,0 +1,280 @@
+"""
+Responsive image variants for ``Post.image_url`` and ``ArticleImage.image_url``.
+
+Every distinct image URL gets an ImageAsset row. ``manage.py process_images``
+fetches the original, and generates resized variants in the formats the
+installed Pillow can write (``IMAGE_VARIANT_FORMATS``, AVIF and WebP by
+default) plus JPEG, or PNG for transparent images, at the
+``IMAGE_VARIANT_WIDTHS`` below the original's width. It also records the
+dimensions and a blurred placeholder. Variants are stored under
+``MEDIA_ROOT/images/`` with names derived from their content, so they can
+be served with a far-future ``Cache-Control: immutable``.
+
+The work runs in worker processes, off the request path: saving a post
+only makes sure its URL has an asset (and unlinks a stale one). When an
+asset is done, the posts and article images using its URL are linked to it
+and ``post_images_changed`` is sent, so cached API responses pick up the
+``image`` structure (see ``api.serializers.ImageAssetSerializer``).
+
+Assets are claimed with a conditional UPDATE, like ``api.webhook_queue``.
+Fetch and decode errors are retried up to ``IMAGE_MAX_ATTEMPTS`` times.
+
+Image URLs come from imports and editors, so ``fetch()`` only follows
+http(s) URLs, redirects included, and refuses to connect to an address
+that is not public (loopback, private, link-local, ...). The address is
+checked on the connected socket, after DNS resolution, so a host name
+pointing inside the network is refused too. Such URLs fail at once.
+"""
+import http.client
+import ipaddress
+import logging
+import posixpath
+import socket
+import urllib.request
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import ArticleImage, ImageAsset, Post
+
+logger = logging.getLogger(__name__)
+
+# Sent once posts were linked to a finished asset. Arguments: post_ids.
+post_images_changed = Signal()
+
+# Models with an image URL and the ImageAsset foreign key that follows it
+IMAGE_FIELDS = ((Post, 'image_url', 'image'), (ArticleImage, 'image_url', 'asset'))
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def asset_for(url):
+    """The finished asset for `url`, or None; queues the URL if it has none."""
+    if not url:
+        return None
+    asset, _ = ImageAsset.objects.get_or_create(source_url=url)
+    return asset if asset.status == 'done' else None
+
+
+def discover():
+    """
+    Queue the image URLs that have no asset yet, e.g. from bulk imports
+    that skip save(); returns how many were added.
+    """
+    urls = set()
+    for model, url_field, _ in IMAGE_FIELDS:
+        urls.update(
+            model.objects.exclude(Q(**{f'{url_field}__isnull': True}) | Q(**{url_field: ''}))
+            .exclude(**{f'{url_field}__in': ImageAsset.objects.values('source_url')})
+            .values_list(url_field, flat=True).distinct()
+        )
+    created = ImageAsset.objects.bulk_create(
+        [ImageAsset(source_url=url) for url in urls], ignore_conflicts=True,
+    )
+    return len(created)
+
+
+def due_assets():
+    lease = timedelta(seconds=get_setting('IMAGE_LEASE_SECONDS', 600))
+    return ImageAsset.objects.filter(
+        Q(status='pending') | Q(status='processing', locked_at__lt=timezone.now() - lease)
+    )
+
+
+def claim_batch(limit):
+    ids = list(due_assets().order_by('created_at', 'id').values_list('id', flat=True)[:limit])
+    return [
+        asset_id for asset_id in ids
+        if due_assets().filter(id=asset_id).update(status='processing', locked_at=timezone.now()) == 1
+    ]
+
+
+SOURCE_SCHEMES = ('http', 'https')
+
+
+class UnsafeSourceError(ValueError):
+    """An image URL that must not be fetched."""
+
+
+def is_public(address):
+    address = ipaddress.ip_address(address)
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def source_url_error(url):
+    """
+    Why `url` can't be an image source, as far as can be told without
+    resolving its host, or None.
+    """
+    try:
+        parts = urlsplit(url)
+        parts.port
+    except ValueError:
+        return 'is not a valid URL'
+    if parts.scheme.lower() not in SOURCE_SCHEMES:
+        return 'must be an http or https URL'
+    if not parts.hostname:
+        return 'has no host'
+    try:
+        if not is_public(parts.hostname):
+            return 'points at a non-public address'
+    except ValueError:
+        pass  # A host name; checked when connecting
+    return None
+
+
+def check_source(url):
+    error = source_url_error(url)
+    if error:
+        raise UnsafeSourceError(f'{url} {error}')
+
+
+def create_public_connection(address, *args, **kwargs):
+    sock = socket.create_connection(address, *args, **kwargs)
+    peer = sock.getpeername()[0]
+    if not is_public(peer):
+        sock.close()
+        raise UnsafeSourceError(f'{address[0]} resolves to non-public address {peer}')
+    return sock
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = create_public_connection
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class SourceRedirectHandler(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_source(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+# No proxies: the address check needs the connection to go to the source
+opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), PublicHTTPHandler, PublicHTTPSHandler, SourceRedirectHandler,
+)
+
+
+def fetch(url):
+    check_source(url)
+    limit = get_setting('IMAGE_MAX_SOURCE_BYTES', 20 * 1024 * 1024)
+    request = urllib.request.Request(url, headers={'User-Agent': 'vastmind-images/1.0'})
+    with opener.open(request, timeout=get_setting('IMAGE_FETCH_TIMEOUT', 15)) as response:
+        content = response.read(limit + 1)
+    if len(content) > limit:
+        raise ValueError(f'larger than {limit} bytes')
+    return content
+
+
+def store(variant, prefix):
+    name = posixpath.join('images', prefix, variant.name)
+    # Same name, same bytes: an existing file is already right
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(variant.content))
+    return default_storage.url(name)
+
+
+def derive(content):
+    """The ImageAsset fields for the image bytes in `content`."""
+    # Imported here: only the image workers need Pillow
+    from . import derivatives
+
+    image = derivatives.open_image(content)
+    formats = derivatives.available_formats(get_setting('IMAGE_VARIANT_FORMATS', ('avif', 'webp')))
+    variants, fallback = derivatives.make_variants(
+        image, get_setting('IMAGE_VARIANT_WIDTHS', (320, 640, 960, 1280, 1920)), formats,
+    )
+    prefix = variants[0].digest[:2]
+    srcsets = {}
+    for variant in variants:
+        srcsets.setdefault(variant.format, []).append(f'{store(variant, prefix)} {variant.width}w')
+    return {
+        'width': image.width,
+        'height': image.height,
+        'placeholder': derivatives.placeholder(image, formats),
+        'src': srcsets[fallback][-1].rsplit(' ', 1)[0],
+        'sources': [
+            {'type': derivatives.FORMATS[format][1], 'srcset': ', '.join(srcsets[format])}
+            for format in [*formats, fallback]
+        ],
+    }
+
+
+def link(asset):
+    """Point the posts and article images using `asset`'s URL at it; returns the post ids."""
+    now = timezone.now()
+    posts = Post.objects.filter(image_url=asset.source_url).exclude(image=asset)
+    post_ids = list(posts.values_list('id', flat=True))
+    # updated_at feeds the posts' ETags, which must change with the image
+    Post.objects.filter(id__in=post_ids).update(image=asset, updated_at=now)
+    ArticleImage.objects.filter(image_url=asset.source_url).exclude(asset=asset).update(asset=asset)
+    return post_ids
+
+
+def process(asset_id):
+    """Generate one claimed asset's variants and record the outcome."""
+    asset = ImageAsset.objects.get(id=asset_id)
+    asset.attempts += 1
+    asset.locked_at = None
+    try:
+        fields = derive(fetch(asset.source_url))
+    except Exception as e:
+        logger.warning('Image %s failed (attempt %s): %s', asset.source_url, asset.attempts, e)
+        asset.last_error = f'{type(e).__name__}: {e}'
+        failed = (isinstance(e, UnsafeSourceError)
+                  or asset.attempts >= get_setting('IMAGE_MAX_ATTEMPTS', 3))
+        asset.status = 'failed' if failed else 'pending'
+        asset.save()
+        return asset
+    for name, value in fields.items():
+        setattr(asset, name, value)
+    asset.status = 'done'
+    asset.last_error = ''
+    asset.processed_at = timezone.now()
+    with transaction.atomic():
+        asset.save()
+        post_ids = link(asset)
+        if post_ids:
+            post_images_changed.send(sender=ImageAsset, post_ids=post_ids)
+    return asset
+
+
+def process_in_worker(asset_id):
+    # Worker processes are long-lived; drop broken or expired connections
+    try:
+        return process(asset_id)
+    finally:
+        close_old_connections()
+
+
+def retry_failed():
+    """Queue failed assets again; returns the count."""
+    return ImageAsset.objects.filter(status='failed').update(status='pending', attempts=0)
@@ -0,0 +1,470 @@
+"""
+Bulk import of categories, tags, posts and article images.
+
+Reads the NDJSON written by ``blog.export``, or a CSV file with one post
+per row, and writes the records in batches. Each batch is one transaction
+of a few set-based queries, whatever its size:
+
+* categories and tags are upserted by slug;
+* posts whose slug already exists are updated, the others are inserted
+  with ``bulk_create()``, with a slug from ``Post.generate_unique_slug()``
+  when the record has none; new or changed content is rendered first
+  (see ``blog.rendering``);
+* post tags are written to the through table with one delete and one
+  insert (see ``blog.bulk``).
+
+Posts name their category and tags by slug or name and their author by
+username, as in the export. Categories and tags not seen before are
+created, as the content webhook does. A CSV header names the post fields;
+``title`` and ``category`` are required and ``tags`` is a comma-separated
+list.
+
+Records that cannot be imported are reported and skipped; the rest of
+their batch is still written.
+
+A post's ``updated_at`` feeds the API's validators, so it never moves
+backwards: it is the record's ``updated_at`` only when that is later than
+the import, and the time of the import otherwise. ``created_at`` is kept
+as in the source.
+"""
+import csv
+import json
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_slug
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from .bulk import (
+    current_tag_ids, notify_bulk_change, resolve_categories, resolve_tags, set_post_tags,
+    validate_name,
+)
+from .counters import snapshot
+from .images import source_url_error
+from .models import ArticleImage, Category, Tag, Post
+from .rendering import RENDERED_FIELDS
+
+DEFAULT_BATCH_SIZE = 1000
+
+POST_FIELDS = [
+    'title', 'content', 'excerpt', 'image_url', 'workflow_id', 'is_featured',
+    'is_archived', 'status', 'published_at', 'publish_at',
+]
+# Compared to tell a changed post from an unchanged one
+UPDATE_FIELDS = POST_FIELDS + ['author_id', 'category_id', 'created_at']
+STATUSES = {value for value, _ in Post._meta.get_field('status').choices}
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+class RecordError(ValueError):
+    """A record that cannot be imported."""
+
+
+def read_ndjson(lines, skip=0):
+    """
+    Yield (line number, record) for NDJSON `lines`, passing over the first
+    `skip` lines without parsing them. A line that is not a JSON object
+    yields a RecordError in place of the record.
+    """
+    for number, line in enumerate(lines, 1):
+        if number <= skip or not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            record = RecordError(f'invalid JSON: {e}')
+        if not isinstance(record, (dict, RecordError)):
+            record = RecordError('not a JSON object')
+        yield number, record
+
+
+def read_csv(lines, skip=0):
+    """Yield (row number, post record) for CSV `lines`, after the first `skip` rows."""
+    for number, row in enumerate(csv.DictReader(lines), 1):
+        if number > skip:
+            # Cells beyond the header end up under None
+            yield number, {**{key: value for key, value in row.items() if key}, 'type': 'post'}
+
+
+def text(record, key, limit=None, required=False):
+    value = record.get(key)
+    if value is None or value == '':
+        if required:
+            raise RecordError(f'{key} is required')
+        return value
+    if not isinstance(value, str):
+        raise RecordError(f'{key} must be a string')
+    if limit and len(value) > limit:
+        raise RecordError(f'{key} is longer than {limit} characters')
+    return value
+
+
+def boolean(record, key):
+    value = record.get(key)
+    if isinstance(value, bool):
+        return value
+    if value is None or str(value).strip().lower() in FALSE_VALUES:
+        return False
+    if str(value).strip().lower() in TRUE_VALUES:
+        return True
+    raise RecordError(f'{key} must be a boolean')
+
+
+def moment(record, key):
+    value = record.get(key)
+    if value is None or value == '':
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise RecordError(f'{key} must be an ISO 8601 date and time')
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+def clean_slug(record, key, required=False):
+    value = text(record, key, max_length(Post, 'slug'), required=required)
+    if value:
+        try:
+            validate_slug(value)
+        except ValidationError:
+            raise RecordError(f'{key} is not a valid slug: {value!r}')
+    return value or None
+
+
+def clean_taxonomy(model, record):
+    name = text(record, 'name', max_length(model, 'name'), required=True)
+    values = {'name': name, 'slug': clean_slug(record, 'slug') or slugify(name)}
+    if not values['slug']:
+        raise RecordError(f'name needs a letter or digit, or a slug: {name!r}')
+    if 'description' in record and hasattr(model, 'description'):
+        values['description'] = text(record, 'description') or ''
+    return values
+
+
+def clean_category(record):
+    return clean_taxonomy(Category, record)
+
+
+def clean_tag(record):
+    return clean_taxonomy(Tag, record)
+
+
+def clean_post(record):
+    """
+    The model values of a post record. Fields missing from the record are
+    left out, so an update keeps their current value.
+    """
+    values = {
+        'title': text(record, 'title', max_length(Post, 'title'), required=True),
+        'category': text(record, 'category', required=True),
+        'slug': clean_slug(record, 'slug'),
+        'author': text(record, 'author') or None,
+        'created_at': moment(record, 'created_at'),
+        'updated_at': moment(record, 'updated_at'),
+    }
+    for field in ('content', 'excerpt'):
+        if field in record:
+            values[field] = text(record, field) or ''
+    for field in ('image_url', 'workflow_id'):
+        if field in record:
+            values[field] = text(record, field, max_length(Post, field)) or None
+    if values.get('image_url'):
+        check_image_url('image_url', values['image_url'])
+    for field in ('is_featured', 'is_archived'):
+        if field in record:
+            values[field] = boolean(record, field)
+    for field in ('published_at', 'publish_at'):
+        if field in record:
+            values[field] = moment(record, field)
+    if 'status' in record:
+        values['status'] = record['status'] or 'draft'
+        if values['status'] not in STATUSES:
+            raise RecordError(f'status must be one of {", ".join(sorted(STATUSES))}')
+    check_name('category', values['category'], Category)
+    if 'tags' in record:
+        tags = record['tags'] or []
+        if isinstance(tags, str):
+            tags = [name.strip() for name in tags.split(',') if name.strip()]
+        if not isinstance(tags, list):
+            raise RecordError('tags must be a list of strings')
+        for name in tags:
+            check_name('tag', name, Tag)
+        values['tags'] = tags
+    return values
+
+
+def check_name(key, value, model):
+    # As the content webhook does: created by name, so the name must fit and slugify
+    error = validate_name(value, model)
+    if error:
+        raise RecordError(f'{key} {error}')
+
+
+def check_image_url(key, value):
+    error = source_url_error(value)
+    if error:
+        raise RecordError(f'{key} {error}: {value!r}')
+
+
+def clean_image(record):
+    image_url = text(record, 'image_url', max_length(ArticleImage, 'image_url'), required=True)
+    check_image_url('image_url', image_url)
+    return {'post': clean_slug(record, 'post', required=True), 'image_url': image_url}
+
+
+def restore_timestamps(created):
+    """
+    Put the source's created_at, and an updated_at later than the import,
+    back on posts that bulk_create() stamped with the current time. One
+    executemany() instead of bulk_update(), whose CASE expressions cost
+    more than the inserts.
+    """
+    if not created:
+        return
+    meta = Post._meta
+    fields = [meta.get_field('created_at'), meta.get_field('updated_at')]
+    quote = connection.ops.quote_name
+    params = []
+    for post, values in created:
+        post.created_at = values['created_at'] or post.created_at
+        post.updated_at = max(values['updated_at'] or post.updated_at, post.updated_at)
+        params.append([
+            *(field.get_db_prep_value(getattr(post, field.attname), connection) for field in fields),
+            post.pk,
+        ])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {quote(meta.db_table)} SET {quote(fields[0].column)} = %s, '
+            f'{quote(fields[1].column)} = %s WHERE {quote(meta.pk.column)} = %s',
+            params,
+        )
+
+
+CLEANERS = {
+    'category': clean_category,
+    'tag': clean_tag,
+    'post': clean_post,
+    'image': clean_image,
+}
+
+
+class Importer:
+    """
+    Buffers records passed to add() and writes them `batch_size` at a time.
+
+    `position` is the number of the last record whose batch has been
+    committed, for resuming an interrupted import. Posts without a known
+    author get `default_author`, unless `create_authors` is set, in which
+    case missing usernames become users without a usable password.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, default_author=None,
+                 create_authors=False, on_error=None):
+        self.batch_size = max(1, batch_size)
+        self.default_author = default_author
+        self.create_authors = create_authors
+        self.on_error = on_error
+        self.counts = Counter()
+        self.errors = []
+        self.position = self.last_number = 0
+        self.reset()
+
+    def reset(self):
+        self.pending = {kind: [] for kind in CLEANERS}
+        self.buffered = 0
+
+    def reject(self, number, error):
+        self.counts['rejected'] += 1
+        self.errors.append((number, str(error)))
+        if self.on_error:
+            self.on_error(number, str(error))
+
+    def add(self, number, record):
+        """Buffer one record, writing a batch when it is full; return True if one was."""
+        self.last_number = number
+        try:
+            if isinstance(record, RecordError):
+                raise record
+            kind = record.get('type', 'post')
+            if kind != 'export':
+                if kind not in CLEANERS:
+                    raise RecordError(f'unknown record type {kind!r}')
+                self.pending[kind].append((number, CLEANERS[kind](record)))
+                self.buffered += 1
+        except RecordError as e:
+            self.reject(number, e)
+        if self.buffered >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """Write the buffered records in one transaction."""
+        if self.buffered:
+            with transaction.atomic():
+                self.write_batch()
+        self.reset()
+        self.position = self.last_number
+
+    def write_batch(self):
+        taxonomy_created = self.upsert_taxonomy(Category, 'categories', self.pending['category'])
+        taxonomy_created |= self.upsert_taxonomy(Tag, 'tags', self.pending['tag'])
+        self.write_posts(self.pending['post'], taxonomy_created)
+        # Images are not part of any post representation, so they need no notification
+        self.write_images(self.pending['image'])
+
+    def upsert_taxonomy(self, model, label, records):
+        """Create or update categories/tags by slug; return whether any were created."""
+        by_slug = {values['slug']: values for _, values in records}
+        existing = model.objects.in_bulk(list(by_slug), field_name='slug')
+        created = model.objects.bulk_create([
+            model(**values) for slug, values in by_slug.items() if slug not in existing
+        ])
+        for slug, obj in existing.items():
+            values = by_slug[slug]
+            if any(getattr(obj, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                # Renames are rare; save() lets the signals reindex and
+                # invalidate every post that embeds the old name
+                obj.save()
+                self.counts[f'{label} updated'] += 1
+        self.counts[f'{label} created'] += len(created)
+        return bool(created)
+
+    def resolve_authors(self, usernames):
+        usernames = {username for username in usernames if username}
+        users = User.objects.in_bulk(list(usernames), field_name='username')
+        missing = usernames - users.keys()
+        if missing and self.create_authors:
+            new_users = [User(username=username) for username in sorted(missing)]
+            for user in new_users:
+                user.set_unusable_password()
+            User.objects.bulk_create(new_users)
+            users.update((user.username, user) for user in new_users)
+            self.counts['authors created'] += len(new_users)
+        return users
+
+    def write_posts(self, records, taxonomy_created=False):
+        # The last record for a slug wins, as it would if applied one by one
+        latest = {}
+        for number, values in records:
+            latest[values['slug'] or number] = (number, values)
+        records = list(latest.values())
+        if not records and not taxonomy_created:
+            return
+
+        categories, new_categories = resolve_categories(values['category'] for _, values in records)
+        tags, new_tags = resolve_tags(
+            name for _, values in records for name in values.get('tags', [])
+        )
+        authors = self.resolve_authors(values['author'] for _, values in records)
+        existing = Post.objects.in_bulk(
+            [values['slug'] for _, values in records if values['slug']], field_name='slug'
+        )
+        current_tags = current_tag_ids([post.id for post in existing.values()])
+        now = timezone.now()
+
+        new_posts, updated, retagged = [], {}, {}
+        changed_fields, stale_category_ids, stale_tag_ids = set(), set(), set()
+        for number, values in records:
+            author = authors.get(values['author'], self.default_author)
+            post = existing.get(values['slug'])
+            if post is None:
+                if author is None:
+                    self.reject(number, f'unknown author {values["author"]!r}')
+                    continue
+                post = Post(author=author)
+                self.assign(post, values, categories[values['category']], now)
+                post.slug = values['slug'] or post.generate_unique_slug()
+                post.render_content()
+                new_posts.append((post, values))
+                continue
+
+            category_id = post.category_id
+            if author is not None:
+                post.author = author
+            before = {field: getattr(post, field) for field in UPDATE_FIELDS}
+            self.assign(post, values, categories[values['category']], now)
+            changed = {field for field in UPDATE_FIELDS if getattr(post, field) != before[field]}
+            tag_ids = {tags[name].id for name in values['tags']} if 'tags' in values else None
+            retag = tag_ids is not None and tag_ids != current_tags[post.id]
+            # Re-importing the same content should cost a read, not a write
+            if not changed and not retag:
+                self.counts['posts unchanged'] += 1
+                continue
+            # An older source timestamp would leave clients a stale ETag
+            post.updated_at = max(values['updated_at'] or now, now)
+            if changed & {'content', 'excerpt'}:
+                post.render_content()
+                changed.update(RENDERED_FIELDS)
+            changed_fields.update(changed)
+            stale_category_ids.add(category_id)
+            updated[post.id] = post
+            if retag:
+                retagged[post.id] = tag_ids
+                stale_tag_ids.update(current_tags[post.id])
+
+        previous = snapshot(updated)
+        Post.objects.bulk_create([post for post, _ in new_posts])
+        restore_timestamps([
+            (post, values) for post, values in new_posts
+            if values['created_at'] or values['updated_at']
+        ])
+        # Only the columns some post in the batch changed: bulk_update()
+        # builds a CASE expression per column and row
+        Post.objects.bulk_update(updated.values(), sorted(changed_fields) + ['updated_at'])
+
+        set_post_tags({
+            post.id: [tags[name].id for name in values.get('tags', [])]
+            for post, values in new_posts
+        }, replace=False)
+        set_post_tags(retagged)
+
+        self.counts['posts created'] += len(new_posts)
+        self.counts['posts updated'] += len(updated)
+        notify_bulk_change(
+            [post.id for post, _ in new_posts] + list(updated),
+            stale_category_ids, stale_tag_ids,
+            taxonomy_created=taxonomy_created or new_categories or new_tags,
+            previous=previous,
+        )
+
+    def assign(self, post, values, category, now):
+        post.category = category
+        for field in POST_FIELDS:
+            if field in values:
+                setattr(post, field, values[field])
+        if values['created_at']:
+            post.created_at = values['created_at']
+        if post.status == 'published' and not post.published_at:
+            post.published_at = values['created_at'] or now
+
+    def write_images(self, records):
+        post_ids = dict(
+            Post.objects.filter(slug__in={values['post'] for _, values in records})
+            .values_list('slug', 'id')
+        )
+        # Re-importing an export must not duplicate images
+        seen = set(
+            ArticleImage.objects.filter(post_id__in=post_ids.values())
+            .values_list('post_id', 'image_url')
+        )
+        new_images = []
+        for number, values in records:
+            post_id = post_ids.get(values['post'])
+            if post_id is None:
+                self.reject(number, f'unknown post {values["post"]!r}')
+            elif (post_id, values['image_url']) not in seen:
+                seen.add((post_id, values['image_url']))
+                new_images.append(ArticleImage(post_id=post_id, image_url=values['image_url']))
+        ArticleImage.objects.bulk_create(new_images)
+        self.counts['images created'] += len(new_images)
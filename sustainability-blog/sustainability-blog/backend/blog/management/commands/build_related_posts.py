@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from blog.related import rebuild, refresh_queued
+
+class Command(BaseCommand):
+    help = "Recompute every published post's precomputed related posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Lists written per transaction')
+        parser.add_argument('--pending', action='store_true',
+                            help='Only refresh the posts queued by large changes')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        if options['pending']:
+            refreshed = refresh_queued(batch_size=max(1, options['batch_size']))
+            self.stdout.write(self.style.SUCCESS(
+                f'{refreshed} queued related post list(s) refreshed in {time.monotonic() - started:.2f}s'
+            ))
+            return
+        progress = None
+        if options['verbosity'] >= 2:
+            def progress(done, total):
+                self.stdout.write(f'  {done}/{total} lists written')
+        written = rebuild(batch_size=max(1, options['batch_size']), progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'{written} related post list(s) rebuilt in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,66 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from blog.export import DEFAULT_CHUNK_SIZE, gzip_chunks, ndjson_chunks, next_watermark
+
+class Command(BaseCommand):
+    help = 'Stream categories, tags, posts and images as NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', default='-',
+                            help='File to write; "-" (default) writes to stdout')
+        parser.add_argument('--gzip', action='store_true',
+                            help='gzip the output (implied by an --output ending in .gz)')
+        parser.add_argument('--since',
+                            help='Only rows changed after this ISO 8601 time, '
+                                 'e.g. the watermark of the previous export')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help='Rows read per query')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 date and time')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        started = time.monotonic()
+        watermark = next_watermark()
+        chunks = ndjson_chunks(since, max(1, options['chunk_size']), watermark)
+        records = 0
+
+        def counted(chunks):
+            nonlocal records
+            for chunk in chunks:
+                records += chunk.count(b'\n')
+                yield chunk
+
+        chunks = counted(chunks)
+        output = options['output']
+        if options['gzip'] or output.endswith('.gz'):
+            chunks = gzip_chunks(chunks)
+
+        if output == '-' and options['gzip']:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            report = self.stderr
+        elif output == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
+            report = self.stderr
+        else:
+            with open(output, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            report = self.stdout
+
+        # The header line is not a row
+        report.write(self.style.SUCCESS(
+            f'Exported {records - 1} row(s) in {time.monotonic() - started:.2f}s; '
+            f'next --since {watermark.isoformat()}'
+        ))
@@ -0,0 +1,121 @@
+import contextlib
+import gzip
+import json
+import os
+import sys
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from blog.importer import DEFAULT_BATCH_SIZE, Importer, read_csv, read_ndjson
+
+READERS = {'ndjson': read_ndjson, 'csv': read_csv}
+
+class Command(BaseCommand):
+    help = 'Bulk-import categories, tags, posts and images from NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path',
+                            help='NDJSON (e.g. from export_content) or CSV file, optionally '
+                                 'gzipped; "-" reads stdin')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Input format (default: from the file extension, else ndjson)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Records written per transaction')
+        parser.add_argument('--author',
+                            help='Username to attribute posts without a known author to')
+        parser.add_argument('--create-authors', action='store_true',
+                            help='Create missing authors as users without a usable password')
+        parser.add_argument('--checkpoint',
+                            help='Progress file (default: <path>.checkpoint)')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue an interrupted import from its checkpoint')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.verbosity = options['verbosity']
+        name = path[:-3] if path.endswith('.gz') else path
+        reader = READERS[options['format'] or ('csv' if name.endswith('.csv') else 'ndjson')]
+
+        default_author = None
+        if options['author']:
+            default_author = User.objects.filter(username=options['author']).first()
+            if default_author is None:
+                raise CommandError(f'No user named {options["author"]!r}')
+
+        # Checkpoints need a file that can be read again
+        self.checkpoint = None
+        if path != '-':
+            self.checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        skip = self.read_checkpoint(path, options['resume'])
+
+        importer = Importer(
+            batch_size=options['batch_size'],
+            default_author=default_author,
+            create_authors=options['create_authors'],
+            on_error=lambda number, error: self.stderr.write(f'Record {number}: {error}'),
+        )
+        importer.position = skip
+        started = time.monotonic()
+        with self.open(path) as lines:
+            for number, record in reader(lines, skip=skip):
+                if importer.add(number, record):
+                    self.save_checkpoint(path, importer.position, skip, started)
+            importer.flush()
+
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        elapsed = time.monotonic() - started
+        counts = importer.counts
+        style = self.style.WARNING if counts['rejected'] else self.style.SUCCESS
+        read = importer.position - skip
+        self.stdout.write(style(
+            f'Imported {read - counts["rejected"]} record(s), rejected {counts["rejected"]}, '
+            f'in {elapsed:.2f}s ({self.rate(read, elapsed)} rows/s): '
+            f'posts {counts["posts created"]} created / {counts["posts updated"]} updated / '
+            f'{counts["posts unchanged"]} unchanged, '
+            f'categories {counts["categories created"]} created / {counts["categories updated"]} updated, '
+            f'tags {counts["tags created"]} created / {counts["tags updated"]} updated, '
+            f'images {counts["images created"]} created'
+        ))
+
+    def open(self, path):
+        if path == '-':
+            return contextlib.nullcontext(sys.stdin)
+        # utf-8-sig drops the byte order mark spreadsheet tools put on CSV files
+        if path.endswith('.gz'):
+            return gzip.open(path, 'rt', encoding='utf-8-sig', newline='')
+        return open(path, encoding='utf-8-sig', newline='')
+
+    def rate(self, rows, elapsed):
+        return f'{rows / elapsed:.0f}' if elapsed else '-'
+
+    def read_checkpoint(self, path, resume):
+        """Number of records a previous run already committed."""
+        if self.checkpoint is None or not os.path.exists(self.checkpoint):
+            if resume:
+                raise CommandError('There is no checkpoint to resume from')
+            return 0
+        if not resume:
+            raise CommandError(
+                f'{self.checkpoint} records an interrupted import; pass --resume to '
+                'continue it, or delete the file to start over'
+            )
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        if state.get('size') != os.path.getsize(path):
+            raise CommandError(f'{path} has changed since the checkpoint was written')
+        self.stdout.write(f'Resuming after record {state["position"]}')
+        return state['position']
+
+    def save_checkpoint(self, path, position, skip, started):
+        if self.checkpoint:
+            # Replace atomically so a crash never leaves a torn checkpoint
+            with open(f'{self.checkpoint}.tmp', 'w') as f:
+                json.dump({'path': os.path.abspath(path), 'size': os.path.getsize(path),
+                           'position': position}, f)
+            os.replace(f'{self.checkpoint}.tmp', self.checkpoint)
+        if self.verbosity >= 2:
+            self.stdout.write(
+                f'  {position} record(s) committed, '
+                f'{self.rate(position - skip, time.monotonic() - started)} rows/s'
+            )
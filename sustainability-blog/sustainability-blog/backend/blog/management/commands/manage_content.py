@@ -1,38 +1,77 @@
+import time
+from datetime import timedelta
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 from blog.models import Post
-from datetime import timedelta
+from blog.scheduling import publish_due_posts, scheduled_drafts
 
 class Command(BaseCommand):
     help = 'Perform scheduled content management tasks'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows updated per transaction')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report what would change without writing')
+
     def handle(self, *args, **options):
-        # Publish scheduled posts
-        scheduled_posts = Post.objects.filter(
-            status='draft',
-            created_at__lte=timezone.now() - timedelta(days=1)
-        )
-        
-        for post in scheduled_posts:
-            post.status = 'published'
-            post.published_at = timezone.now()
-            post.save()
-            self.stdout.write(
-                self.style.SUCCESS(f'Published scheduled post: {post.title}')
-            )
+        self.chunk_size = max(1, options['chunk_size'])
+        self.dry_run = options['dry_run']
+        self.verbosity = options['verbosity']
+        now = timezone.now()
+
+        # Publish scheduled posts whose publish_at has passed (run_scheduler
+        # normally gets there first; this is the cron safety net)
+        started = time.monotonic()
+        if self.dry_run:
+            self.preview('publish', scheduled_drafts().filter(publish_at__lte=now), started)
+        else:
+            published = publish_due_posts(now, batch_size=self.chunk_size)
+            self.report('publish', len(published), started, 'updated')
 
-        # Archive old posts (optional)
-        old_posts = Post.objects.filter(
-            published_at__lte=timezone.now() - timedelta(days=365)
+        # Archive old posts. is_archived is not part of any API representation,
+        # so updated_at is left alone and caches keyed on it stay valid.
+        self.run_phase(
+            'archive',
+            Post.objects.filter(is_archived=False, published_at__lte=now - timedelta(days=365)),
+            lambda: {'is_archived': True},
         )
-        
-        for post in old_posts:
-            post.is_archived = True
-            post.save()
-            self.stdout.write(
-                self.style.SUCCESS(f'Archived old post: {post.title}')
-            )
 
         self.stdout.write(
             self.style.SUCCESS('Successfully completed content management tasks')
-        )
\ No newline at end of file
+        )
+
+    def run_phase(self, name, queryset, values):
+        """Update every row of `queryset` in id-ordered chunks, one transaction each."""
+        started = time.monotonic()
+        if self.dry_run:
+            self.preview(name, queryset, started)
+            return
+
+        total, chunks, last_id = 0, 0, 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=last_id).order_by('id')
+                .values_list('id', flat=True)[:self.chunk_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                # Re-apply the phase filter so rows changed meanwhile are skipped
+                total += queryset.filter(id__in=ids).update(**values())
+            chunks += 1
+            last_id = ids[-1]
+        self.report(name, total, started, f'updated in {chunks} chunk(s)')
+
+    def preview(self, name, queryset, started):
+        count = queryset.count()
+        if self.verbosity >= 2:
+            for title in queryset.values_list('title', flat=True)[:50]:
+                self.stdout.write(f'  would {name}: {title}')
+        self.report(name, count, started, 'would update')
+
+    def report(self, name, count, started, detail):
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: {count} post(s) {detail} in {time.monotonic() - started:.2f}s'
+        ))
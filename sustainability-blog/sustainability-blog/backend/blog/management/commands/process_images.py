@@ -0,0 +1,67 @@
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+from blog.images import claim_batch, discover, process, process_in_worker, retry_failed
+from blog.models import ImageAsset
+
+class Command(BaseCommand):
+    help = 'Generate the resized variants of post and article images (see blog.images)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Worker processes; 0 processes images in this process')
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds to sleep when nothing is queued')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the queued images and exit')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Queue failed images again first')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'Requeued {retry_failed()} failed image(s)')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        processes = max(0, options['processes'])
+        pool = None
+        if processes:
+            # Forked workers must not share this process's connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+        totals = {'done': 0, 'pending': 0, 'failed': 0}
+        try:
+            while not self.stopping:
+                discovered = discover()
+                if discovered:
+                    self.stdout.write(f'Queued {discovered} new image URL(s)')
+                claimed = claim_batch(max(1, processes) * 4)
+                if not claimed:
+                    if options['once']:
+                        break
+                    close_old_connections()
+                    time.sleep(options['poll_interval'])
+                    continue
+                results = pool.map(process_in_worker, claimed) if pool else map(process, claimed)
+                for asset in results:
+                    totals[asset.status] += 1
+                    style = self.style.SUCCESS if asset.status == 'done' else self.style.WARNING
+                    detail = f'{asset.width}x{asset.height}' if asset.status == 'done' else asset.last_error
+                    self.stdout.write(style(f'{asset.source_url}: {asset.status} ({detail})'))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed images: {totals['done']} done, {totals['pending']} retrying, "
+            f"{totals['failed']} failed; "
+            f"{ImageAsset.objects.filter(status='pending').count()} pending"
+        ))
+
+    def stop(self, signum, frame):
+        self.stopping = True
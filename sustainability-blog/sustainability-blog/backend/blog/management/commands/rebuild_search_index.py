@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.models import Post
+from blog.search import rebuild_index
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all posts'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {Post.objects.count()} posts')
+        )
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from blog.counters import recount
+from blog.models import Category, Tag
+
+class Command(BaseCommand):
+    help = 'Recompute the published post counts of categories and tags, fixing any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report drifted counters without fixing them')
+
+    def handle(self, *args, **options):
+        for model in (Category, Tag):
+            started = time.monotonic()
+            with transaction.atomic():
+                drifted = recount(model, dry_run=options['dry_run'])
+            label = model._meta.verbose_name_plural
+            if options['verbosity'] >= 2:
+                names = dict(model.objects.filter(pk__in=drifted).values_list('pk', 'name'))
+                for pk, (stored, actual) in sorted(drifted.items()):
+                    self.stdout.write(f'  {names.get(pk, pk)}: {stored} -> {actual}')
+            verb = 'would fix' if options['dry_run'] else 'fixed'
+            style = self.style.WARNING if drifted and options['dry_run'] else self.style.SUCCESS
+            self.stdout.write(style(
+                f'{label}: {len(drifted)} drifted counter(s) {verb} '
+                f'in {time.monotonic() - started:.2f}s'
+            ))
@@ -0,0 +1,49 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from blog.bulk import notify_rendered, render_posts, render_posts_in_worker, unrendered_post_ids
+from blog.rendering import RENDER_VERSION
+
+class Command(BaseCommand):
+    help = "Render posts' content HTML, word count, reading time, TOC and summary (see blog.rendering)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2,
+                            help='Worker processes; 0 renders in this process')
+        parser.add_argument('--chunk-size', type=int, default=200,
+                            help='Posts rendered and written per transaction')
+        parser.add_argument('--all', action='store_true',
+                            help=f'Render every post, not only those older than version {RENDER_VERSION}')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        post_ids = unrendered_post_ids(everything=options['all'])
+        size = max(1, options['chunk_size'])
+        chunks = [post_ids[start:start + size] for start in range(0, len(post_ids), size)]
+
+        processes = max(0, options['processes'])
+        pool = None
+        if processes and len(chunks) > 1:
+            # Forked workers must not share this process's connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('fork'))
+        rendered = []
+        try:
+            results = pool.map(render_posts_in_worker, chunks) if pool else map(render_posts, chunks)
+            for ids in results:
+                rendered += ids
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'  {len(rendered)}/{len(post_ids)} posts rendered')
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            # Once, from this process: per chunk, evicting the API cache
+            # costs more than rendering, and the cache may be process-local
+            if rendered:
+                notify_rendered(rendered)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(rendered)} post(s) rendered in {time.monotonic() - started:.2f}s'
+        ))
@@ -0,0 +1,45 @@
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from blog.scheduling import next_due_at, publish_due_posts
+
+class Command(BaseCommand):
+    help = 'Publish scheduled posts as their publish_at time arrives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-sleep', type=float, default=5.0,
+                            help='Longest nap between checks, so newly scheduled posts are noticed')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Posts published per transaction')
+        parser.add_argument('--once', action='store_true',
+                            help='Publish what is due now and exit')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while not self.stopping:
+            close_old_connections()
+            published = publish_due_posts(batch_size=options['batch_size'])
+            if published:
+                self.stdout.write(self.style.SUCCESS(f'Published {len(published)} scheduled post(s)'))
+            if options['once']:
+                break
+
+            next_due = next_due_at()
+            delay = options['max_sleep']
+            if next_due is not None:
+                delay = min(delay, max(0.0, (next_due - timezone.now()).total_seconds()))
+            self.sleep(delay)
+
+    def sleep(self, seconds):
+        # Wake up in small steps so SIGTERM is honoured promptly
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(max(0.0, min(0.5, deadline - time.monotonic())))
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -1,14 +1,70 @@
-from django.core.management.base import BaseCommand
+import time
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from blog.importer import DEFAULT_BATCH_SIZE, Importer
 from blog.models import Category, Tag, Post
+from blog.synthetic import synthetic_records
 from django.db import transaction
 
 class Command(BaseCommand):
-    help = 'Seeds the database with initial data'
+    help = 'Seeds the database with initial data, plus optional synthetic posts at scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=0,
+                            help='Synthetic posts to generate on top of the sample content')
+        parser.add_argument('--tags', type=int, default=50, help='Synthetic tags')
+        parser.add_argument('--categories', type=int, default=8, help='Synthetic categories')
+        parser.add_argument('--authors', type=int, default=10, help='Synthetic authors')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed generates the same content')
+        parser.add_argument('--days', type=int, default=3 * 365,
+                            help='Spread post dates over this many days')
+        parser.add_argument('--until',
+                            help='ISO 8601 time the post dates lead up to (default: today, '
+                                 'midnight UTC); fix it to reproduce a corpus exactly')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Posts written per transaction')
+
+    def handle(self, *args, **options):
+        self.seed_samples()
+        if options['posts'] > 0:
+            self.seed_synthetic(options)
+
+    def seed_synthetic(self, options):
+        if options['until']:
+            until = parse_datetime(options['until'])
+            if until is None:
+                raise CommandError('--until must be an ISO 8601 date and time')
+            if timezone.is_naive(until):
+                until = timezone.make_aware(until)
+        else:
+            until = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        self.stdout.write(f'Generating {options["posts"]} synthetic posts (seed {options["seed"]})...')
+        started = time.monotonic()
+        # Writes through the bulk import path; authors are created as needed
+        importer = Importer(batch_size=options['batch_size'], create_authors=True)
+        records = synthetic_records(
+            options['posts'], tags=options['tags'], categories=options['categories'],
+            authors=options['authors'], seed=options['seed'], until=until, days=options['days'],
+        )
+        for number, record in enumerate(records, 1):
+            if importer.add(number, record) and options['verbosity'] >= 2:
+                self.stdout.write(f'  {importer.counts["posts created"]} posts created')
+        importer.flush()
+
+        elapsed = time.monotonic() - started
+        counts = importer.counts
+        self.stdout.write(self.style.SUCCESS(
+            f'Synthetic posts: {counts["posts created"]} created, {counts["posts updated"]} updated, '
+            f'{counts["posts unchanged"]} unchanged in {elapsed:.2f}s '
+            f'({options["posts"] / elapsed if elapsed else 0:.0f} posts/s)'
+        ))
 
     @transaction.atomic
-    def handle(self, *args, **kwargs):
+    def seed_samples(self):
         self.stdout.write('Seeding database...')
 
         # Create superuser if it doesn't exist
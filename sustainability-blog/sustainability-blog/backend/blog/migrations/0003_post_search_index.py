@@ -0,0 +1,66 @@
+from django.db import migrations
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE blog_post_search (
+        post_id bigint PRIMARY KEY REFERENCES blog_post (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    'CREATE INDEX blog_post_search_document_gin ON blog_post_search USING GIN (document)',
+    """
+    INSERT INTO blog_post_search (post_id, document)
+    SELECT p.id,
+           setweight(to_tsvector('english', p.title), 'A') ||
+           setweight(to_tsvector('english', coalesce(c.name, '')), 'B') ||
+           setweight(to_tsvector('english', coalesce(string_agg(t.name, ' '), '')), 'B') ||
+           setweight(to_tsvector('english', p.content), 'C')
+    FROM blog_post p
+    LEFT JOIN blog_category c ON c.id = p.category_id
+    LEFT JOIN blog_post_tags pt ON pt.post_id = p.id
+    LEFT JOIN blog_tag t ON t.id = pt.tag_id
+    GROUP BY p.id, c.name
+    """,
+]
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE blog_post_search
+    USING fts5(title, content, category, tags, tokenize='porter unicode61')
+    """,
+    """
+    INSERT INTO blog_post_search (rowid, title, content, category, tags)
+    SELECT p.id, p.title, p.content, coalesce(c.name, ''),
+           coalesce(group_concat(t.name, ' '), '')
+    FROM blog_post p
+    LEFT JOIN blog_category c ON c.id = p.category_id
+    LEFT JOIN blog_post_tags pt ON pt.post_id = p.id
+    LEFT JOIN blog_tag t ON t.id = pt.tag_id
+    GROUP BY p.id
+    """,
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {
+        'postgresql': POSTGRES_CREATE,
+        'sqlite': SQLITE_CREATE,
+    }.get(schema_editor.connection.vendor, [])
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('postgresql', 'sqlite'):
+        schema_editor.execute('DROP TABLE blog_post_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_post_image_url_workflow_id_articleimage'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:13
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_published_posts(apps, schema_editor):
+    Category = apps.get_model('blog', 'Category')
+    Tag = apps.get_model('blog', 'Tag')
+    Post = apps.get_model('blog', 'Post')
+    counts = [
+        (Category, 'category_id', Post.objects.filter(status='published').values('category_id')),
+        (Tag, 'tag_id', Post.tags.through.objects.filter(post__status='published').values('tag_id')),
+    ]
+    for model, column, rows in counts:
+        totals = dict(rows.order_by().annotate(n=Count('*')).values_list(column, 'n'))
+        objs = [model(pk=pk, published_post_count=n) for pk, n in totals.items()]
+        model.objects.bulk_update(objs, ['published_post_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0006_post_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='published_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='published_post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_published_posts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_render_existing_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedRefresh',
+            fields=[
+                ('post_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('queued_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -2,12 +2,16 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils.text import slugify
 import secrets
+from .rendering import RENDERED_FIELDS, render
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by blog.counters; repair with manage.py recount_taxonomy
+    published_post_count = models.PositiveIntegerField(default=0, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -24,6 +28,9 @@ class Tag(models.Model):
     name = models.CharField(max_length=50)
     slug = models.SlugField(unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by blog.counters; repair with manage.py recount_taxonomy
+    published_post_count = models.PositiveIntegerField(default=0, editable=False)
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -33,12 +40,62 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+class ImageAsset(models.Model):
+    """
+    Resized variants of an image URL, generated by ``manage.py process_images``
+    (see blog.images). Posts and article images using the URL link to it
+    once it is done.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    source_url = models.URLField(max_length=500, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    # Of the original, after applying its EXIF orientation
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    # Tiny blurred preview as a data: URI, shown while a variant loads
+    placeholder = models.TextField(blank=True)
+    # Largest variant in a format every browser reads
+    src = models.CharField(max_length=500, blank=True)
+    # [{"type": "image/webp", "srcset": "<url> 320w, <url> 640w"}, ...], best format first
+    sources = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='blog_imageasset_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.source_url} ({self.status})"
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     content = models.TextField()
     image_url = models.URLField(blank=True, null=True)
+    # Set by blog.images once image_url's variants exist
+    image = models.ForeignKey(ImageAsset, related_name='posts', blank=True, null=True,
+                              on_delete=models.SET_NULL, editable=False)
     excerpt = models.TextField(max_length=500, blank=True)
+    # Rendered from content and excerpt on write (see blog.rendering)
+    content_html = models.TextField(blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
+    reading_time = models.PositiveSmallIntegerField(default=0, editable=False)  # minutes
+    toc = models.JSONField(default=list, blank=True, editable=False)
+    # excerpt, or the start of the content when there is none
+    summary = models.TextField(blank=True, editable=False)
+    # blog.rendering.RENDER_VERSION of the fields above; 0 = never rendered
+    render_version = models.PositiveSmallIntegerField(default=0, editable=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     tags = models.ManyToManyField(Tag)
@@ -53,23 +110,102 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     published_at = models.DateTimeField(blank=True, null=True)
+    publish_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Public lists only ever see published posts, ordered by either
+            # timestamp with the keyset pagination's id tiebreak
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(status='published'),
+                name='blog_post_pub_created_idx',
+            ),
+            models.Index(
+                fields=['-published_at', '-id'],
+                condition=models.Q(status='published'),
+                name='blog_post_pub_published_idx',
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'],
+                condition=models.Q(status='published'),
+                name='blog_post_category_idx',
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                condition=models.Q(status='published', is_featured=True),
+                name='blog_post_featured_idx',
+            ),
+            # Admin changelist and staff lists, which include drafts
+            models.Index(fields=['-created_at', '-id'], name='blog_post_created_idx'),
+            # Posts manage_content may still archive; shrinks as they age out
+            models.Index(
+                fields=['published_at'],
+                condition=models.Q(is_archived=False),
+                name='blog_post_archive_due_idx',
+            ),
+            # Only drafts waiting to go live, so the scheduler's "next due"
+            # lookup stays a tiny index probe however large the table grows
+            models.Index(
+                fields=['publish_at'],
+                condition=models.Q(status='draft', publish_at__isnull=False),
+                name='blog_post_publish_due_idx',
+            ),
+        ]
 
     def generate_unique_slug(self):
-        base_slug = slugify(self.title)
+        # Leave room for the suffix so long titles still fit the column
+        max_base = self._meta.get_field('slug').max_length - 9
+        base_slug = slugify(self.title)[:max_base].rstrip('-')
         random_hex = secrets.token_hex(4)  # 8 characters long
         return f"{base_slug}-{random_hex}"
 
+    def render_content(self):
+        for field, value in render(self.content, self.excerpt).items():
+            setattr(self, field, value)
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = self.generate_unique_slug()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'content', 'excerpt'} & set(update_fields):
+            self.render_content()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, *RENDERED_FIELDS}
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
+class RelatedPost(models.Model):
+    """One entry of a post's precomputed related-posts list; see blog.related."""
+    post = models.ForeignKey(Post, related_name='related_posts', on_delete=models.CASCADE)
+    related = models.ForeignKey(Post, related_name='related_to', on_delete=models.CASCADE)
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also the index the related endpoint reads a list through
+            models.UniqueConstraint(fields=['post', 'rank'], name='blog_relatedpost_post_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} -> {self.related_id} ({self.score:.3f})'
+
+class RelatedRefresh(models.Model):
+    """A post whose related list waits for ``build_related_posts --pending``; see blog.related."""
+    post_id = models.BigIntegerField(primary_key=True)
+    queued_at = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.post_id} (queued {self.queued_at:%Y-%m-%d %H:%M})'
+
 class ArticleImage(models.Model):
     post = models.ForeignKey(Post, related_name='images', on_delete=models.CASCADE)
     image_url = models.URLField()
+    asset = models.ForeignKey(ImageAsset, related_name='article_images', blank=True, null=True,
+                              on_delete=models.SET_NULL, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -0,0 +1,405 @@
+"""
+Precomputed related posts.
+
+Every published post keeps its ``TOP_K`` most similar published posts in
+the ``RelatedPost`` table, so showing them reads K rows. Similarity is
+
+    TAG_WEIGHT * weighted Jaccard of the two tag sets
+    + CATEGORY_WEIGHT * (1 if the category is the same)
+    + RECENCY_WEIGHT * 2 ** (-age of the related post / RECENCY_HALF_LIFE_DAYS)
+
+The Jaccard weighs each tag by its inverse document frequency,
+``log(1 + published posts / published posts with the tag)``, so sharing a
+niche tag counts for more than sharing one that is on half the blog.
+
+A post's candidates are the ``TAG_CANDIDATES`` newest posts of each of
+its tags plus the ``CATEGORY_CANDIDATES`` newest of its category; without
+that cut popular tags would make every post a candidate of every other.
+
+``rebuild()`` (``manage.py build_related_posts``) recomputes every list
+in one in-memory pass. ``refresh()`` runs after commits that change
+posts' tags, category or published state (see ``blog.signals``): it
+recomputes the changed posts' lists, enters them into or drops them from
+their candidates' lists, and recomputes the lists in which a changed post
+dropped out or down. The posts of one transaction are refreshed together
+once it commits; more than ``INLINE_REFRESH_LIMIT`` of them (a bulk
+change, a cascade) are queued as RelatedRefresh rows instead, for
+``build_related_posts --pending``, so the commit does not wait for them.
+What it leaves for the next rebuild:
+
+* older posts outside a changed post's candidates, and the other posts'
+  lists after a large bulk change (``BULK_PROPAGATE_LIMIT``), do not pick
+  the changed posts up;
+* the other entries of amended lists keep the tag weights and recency of
+  when they were scored.
+
+A nightly rebuild keeps all of them fresh.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .models import Category, Post, RelatedPost, RelatedRefresh, Tag
+
+TOP_K = 5
+TAG_WEIGHT = 0.6
+CATEGORY_WEIGHT = 0.25
+RECENCY_WEIGHT = 0.15
+RECENCY_HALF_LIFE_DAYS = 180
+TAG_CANDIDATES = 100
+CATEGORY_CANDIDATES = 25
+# refresh() takes the candidates of popular tags and categories from this
+# many newest posts instead of sorting all of a tag's posts by date
+RECENT_WINDOW = 2000
+# Bulk changes of more posts than this only recompute the changed posts'
+# own lists; entering them into other posts' lists is left to the next
+# rebuild, which costs less than propagating a large import
+BULK_PROPAGATE_LIMIT = 200
+# Commits that changed more posts than this have them refreshed by
+# build_related_posts --pending rather than by the committing process
+INLINE_REFRESH_LIMIT = 200
+
+# Sent after related lists were rewritten. Arguments: post_ids.
+related_posts_changed = Signal()
+
+
+def published_posts():
+    return Post.objects.filter(status='published').order_by('-published_at', '-id')
+
+
+class Corpus:
+    """Published posts' categories, tags and ages, and their terms' candidate lists."""
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.category = {}   # post id -> category id
+        self.recency = {}    # post id -> recency score
+        self.tags = {}       # post id -> frozenset of tag ids
+        self.total = {}      # post id -> summed weight of its tags
+        self.weight = {}     # tag id -> idf weight
+        # term -> newest post ids (list) and the same as a set
+        self.postings = {}
+        self.members = {}
+
+    def load(self, queryset, everything=False):
+        """
+        Add the posts of `queryset` (published ones, newest first) that
+        are not loaded yet; returns all their ids in that order.
+        """
+        rows = list(queryset.values_list('id', 'category_id', 'published_at'))
+        new = [pk for pk, _, _ in rows if pk not in self.category]
+        for pk, category_id, published_at in rows:
+            age = (self.now - (published_at or self.now)).total_seconds() / 86400
+            self.category[pk] = category_id
+            self.recency[pk] = 2 ** (-max(age, 0) / RECENCY_HALF_LIFE_DAYS)
+        if new:
+            through = Post.tags.through.objects
+            if everything:
+                # Cheaper than an IN list of every post id
+                through = through.filter(post__status='published')
+            else:
+                through = through.filter(post_id__in=new)
+            tags = {pk: set() for pk in new}
+            for post_id, tag_id in through.values_list('post_id', 'tag_id'):
+                tags[post_id].add(tag_id)
+            self.tags.update((pk, frozenset(tag_ids)) for pk, tag_ids in tags.items())
+        return [pk for pk, _, _ in rows]
+
+    def set_weights(self, document_frequency, published):
+        self.weight = {
+            tag_id: math.log(1 + published / max(count, 1))
+            for tag_id, count in document_frequency.items()
+        }
+
+    def totals(self):
+        weight = self.weight
+        for pk, tag_ids in self.tags.items():
+            self.total[pk] = sum(weight.get(tag_id, 0.0) for tag_id in tag_ids)
+
+    def set_postings(self, term, post_ids):
+        self.postings[term] = post_ids
+        self.members[term] = set(post_ids)
+
+    def terms(self, pk):
+        return [('tag', tag_id) for tag_id in self.tags[pk]] + [('category', self.category[pk])]
+
+    def candidates(self, pk):
+        found = set()
+        for term in self.terms(pk):
+            found.update(self.postings.get(term, ()))
+        found.discard(pk)
+        return found
+
+    def entering(self, post_ids, of):
+        """
+        {post id in `of`: set of the `post_ids` among its candidates}. Only
+        the postings of `post_ids`' own terms need to be loaded.
+        """
+        by_term = defaultdict(list)
+        for pk in of:
+            for term in self.terms(pk):
+                by_term[term].append(pk)
+        found = defaultdict(set)
+        for other in post_ids:
+            for term in self.terms(other):
+                if other in self.members[term]:
+                    for pk in by_term.get(term, ()):
+                        found[pk].add(other)
+        return found
+
+    def score(self, pk, other):
+        """How related `other` is to `pk`."""
+        score = RECENCY_WEIGHT * self.recency[other]
+        if self.category[pk] == self.category[other]:
+            score += CATEGORY_WEIGHT
+        shared = self.tags[pk] & self.tags[other]
+        if shared:
+            weight = self.weight
+            common = sum(weight.get(tag_id, 0.0) for tag_id in shared)
+            union = self.total[pk] + self.total[other] - common
+            if union > 0:
+                score += TAG_WEIGHT * common / union
+        return score
+
+    def top(self, pk):
+        """[(score, related id)] of `pk`'s best candidates, best first."""
+        # score() inlined: this runs for every candidate of every post
+        tags, total, recency, category = self.tags, self.total, self.recency, self.category
+        own_category, own_total = category[pk], self.total[pk]
+        own_tags = [(tag_id, self.weight.get(tag_id, 0.0)) for tag_id in tags[pk]]
+        scored = []
+        for other in self.candidates(pk):
+            score = RECENCY_WEIGHT * recency[other]
+            if category[other] == own_category:
+                score += CATEGORY_WEIGHT
+            other_tags = tags[other]
+            common = 0.0
+            shared = False
+            for tag_id, weight in own_tags:
+                if tag_id in other_tags:
+                    common += weight
+                    shared = True
+            if shared:
+                union = own_total + total[other] - common
+                if union > 0:
+                    score += TAG_WEIGHT * common / union
+            scored.append((score, other))
+        return heapq.nlargest(TOP_K, scored)
+
+    @classmethod
+    def everything(cls):
+        """The whole published corpus, for rebuild()."""
+        corpus = cls()
+        ids = corpus.load(published_posts(), everything=True)
+        frequency = defaultdict(int)
+        postings = defaultdict(list)
+        # Newest first, so each term keeps its newest posts
+        for pk in ids:
+            for tag_id in corpus.tags[pk]:
+                frequency[tag_id] += 1
+            for term in corpus.terms(pk):
+                limit = CATEGORY_CANDIDATES if term[0] == 'category' else TAG_CANDIDATES
+                if len(postings[term]) < limit:
+                    postings[term].append(pk)
+        for term, post_ids in postings.items():
+            corpus.set_postings(term, post_ids)
+        corpus.set_weights(frequency, len(ids))
+        corpus.totals()
+        return corpus
+
+    @classmethod
+    def around(cls, post_ids):
+        """
+        The given posts, their candidates and the posts whose lists hold
+        them. Returns (corpus, published ids among `post_ids`, holders).
+        """
+        corpus = cls()
+        targets = corpus.load(published_posts().filter(id__in=post_ids))
+        window = corpus.load(published_posts()[:RECENT_WINDOW])
+        complete = len(window) < RECENT_WINDOW
+
+        terms = {term for pk in targets for term in corpus.terms(pk)}
+        from_window = defaultdict(list)
+        for pk in window:
+            for term in corpus.terms(pk):
+                if term in terms:
+                    from_window[term].append(pk)
+        for term in terms:
+            kind, term_id = term
+            limit = CATEGORY_CANDIDATES if kind == 'category' else TAG_CANDIDATES
+            found = from_window[term][:limit]
+            if len(found) < limit and not complete:
+                # A term too rare for the window: its own posts are few
+                queryset = published_posts().filter(
+                    **{'category_id' if kind == 'category' else 'tags__id': term_id}
+                )
+                found = list(queryset.values_list('id', flat=True)[:limit])
+            corpus.set_postings(term, found)
+
+        holders = set(
+            RelatedPost.objects.filter(related_id__in=post_ids).values_list('post_id', flat=True)
+        ) - set(post_ids)
+        needed = set().union(*corpus.postings.values(), holders) - corpus.category.keys()
+        corpus.load(published_posts().filter(id__in=needed))
+
+        tag_ids = {tag_id for tag_ids in corpus.tags.values() for tag_id in tag_ids}
+        corpus.set_weights(
+            dict(Tag.objects.filter(id__in=tag_ids).values_list('id', 'published_post_count')),
+            Category.objects.aggregate(n=Sum('published_post_count'))['n'] or 0,
+        )
+        corpus.totals()
+        return corpus, targets, holders & corpus.category.keys()
+
+
+def write_lists(lists):
+    """Replace the lists of the posts in `lists` ({post id: [(score, related id)]})."""
+    RelatedPost.objects.filter(post_id__in=list(lists)).delete()
+    RelatedPost.objects.bulk_create([
+        RelatedPost(post_id=pk, related_id=related_id, score=round(score, 6), rank=rank)
+        for pk, entries in lists.items()
+        for rank, (score, related_id) in enumerate(entries, 1)
+    ], batch_size=1000)
+    related_posts_changed.send(sender=RelatedPost, post_ids=list(lists))
+
+
+def current_lists(post_ids):
+    lists = {pk: [] for pk in post_ids}
+    rows = RelatedPost.objects.filter(post_id__in=list(post_ids)).order_by('post_id', 'rank')
+    for pk, related_id, score in rows.values_list('post_id', 'related_id', 'score'):
+        lists[pk].append((score, related_id))
+    return lists
+
+
+def refresh(post_ids, propagate=True):
+    """
+    Bring the related lists up to date after `post_ids` changed (or were
+    unpublished or deleted). With `propagate`, the changed posts are also
+    entered into or removed from other posts' lists.
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    corpus, targets, holders = Corpus.around(post_ids)
+    lists = {pk: corpus.top(pk) for pk in targets}
+    gone = post_ids - set(targets)
+
+    refill = set()
+    if propagate:
+        neighbours = set(holders)
+        for pk in targets:
+            neighbours.update(corpus.candidates(pk))
+        neighbours -= post_ids
+        entering = corpus.entering(targets, neighbours)
+        for pk, entries in current_lists(neighbours).items():
+            scores = {other: corpus.score(pk, other) for other in entering.get(pk, ())}
+            kept = [(score, other) for score, other in entries if other not in post_ids]
+            kept = heapq.nlargest(TOP_K, kept + [(score, other) for other, score in scores.items()])
+            # A changed post that left pk's candidates or now scores lower
+            # may have to make way for a candidate the stored list never held
+            if any(other in post_ids and round(scores.get(other, -1), 6) < score
+                   for score, other in entries):
+                refill.add(pk)
+            elif kept != entries:
+                lists[pk] = kept
+
+    with transaction.atomic():
+        # Unpublished posts have no list and are in no list
+        RelatedPost.objects.filter(post_id__in=gone).delete()
+        RelatedPost.objects.filter(related_id__in=gone).delete()
+        write_lists(lists)
+    if refill:
+        refresh(refill, propagate=False)
+
+
+class PendingRefresh:
+    """The posts to refresh once the current transaction commits."""
+
+    def __init__(self):
+        self.post_ids = {True: set(), False: set()}
+        self.done = False
+
+    def __call__(self):
+        # Registered once per call of refresh_on_commit; the first run does the work
+        if self.done:
+            return
+        self.done = True
+        propagated = self.post_ids[True]
+        refilled = self.post_ids[False] - propagated
+        if len(propagated) + len(refilled) > INLINE_REFRESH_LIMIT:
+            queue_refresh(propagated | refilled)
+            return
+        if propagated:
+            refresh(propagated)
+        if refilled:
+            refresh(refilled, propagate=False)
+
+
+def refresh_on_commit(post_ids, propagate=True):
+    """
+    Refresh `post_ids` after the current transaction commits, together with
+    the other posts it changes.
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    # The transaction's callbacks, which a rollback discards with ours. The
+    # newest are looked at first: in a cascade the last one is ours.
+    connection = transaction.get_connection()
+    pending = next(
+        (func for _, func, _ in reversed(connection.run_on_commit)
+         if isinstance(func, PendingRefresh) and not func.done),
+        None,
+    ) or PendingRefresh()
+    pending.post_ids[propagate].update(post_ids)
+    # Registered again so a savepoint's callbacks always include it
+    transaction.on_commit(pending)
+
+
+def queue_refresh(post_ids):
+    RelatedRefresh.objects.bulk_create(
+        [RelatedRefresh(post_id=pk, queued_at=timezone.now()) for pk in post_ids],
+        update_conflicts=True, unique_fields=['post_id'], update_fields=['queued_at'],
+        batch_size=1000,
+    )
+
+
+def refresh_queued(batch_size=500):
+    """Refresh the posts queued by large commits; returns how many were."""
+    done = 0
+    while True:
+        started = timezone.now()
+        post_ids = list(
+            RelatedRefresh.objects.order_by('queued_at').values_list('post_id', flat=True)[:batch_size]
+        )
+        if not post_ids:
+            return done
+        refresh(post_ids, propagate=False)
+        # A post queued again meanwhile is refreshed again
+        RelatedRefresh.objects.filter(post_id__in=post_ids, queued_at__lte=started).delete()
+        done += len(post_ids)
+
+
+def rebuild(batch_size=1000, progress=None):
+    """
+    Recompute every published post's list. Lists are written `batch_size`
+    posts per transaction, so readers keep seeing complete lists.
+    Returns the number of lists written.
+    """
+    started = timezone.now()
+    corpus = Corpus.everything()
+    ids = list(corpus.category)
+    for start in range(0, len(ids), batch_size):
+        chunk = ids[start:start + batch_size]
+        with transaction.atomic():
+            write_lists({pk: corpus.top(pk) for pk in chunk})
+        if progress:
+            progress(start + len(chunk), len(ids))
+    RelatedPost.objects.exclude(post__status='published').delete()
+    RelatedPost.objects.exclude(related__status='published').delete()
+    RelatedRefresh.objects.filter(queued_at__lte=started).delete()
+    return len(ids)
@@ -0,0 +1,263 @@
+"""
+Pre-rendered post content: the values stored next to ``Post.content`` so
+read endpoints serve them without rendering anything per request.
+
+``render()`` turns a post's content into:
+
+* ``content_html``: the content as sanitized HTML. Tags and attributes
+  outside an allowlist are dropped (the text of unknown tags is kept, that
+  of ``<script>``, ``<style>`` etc. is not), links and images may only use
+  http(s), mailto or relative URLs, ``<h1>`` becomes ``<h2>`` (the page
+  title is the ``<h1>``), images load lazily and headings get ids. Content
+  without any markup, as written by imports, is split into paragraphs at
+  blank lines;
+* ``word_count`` and ``reading_time`` (whole minutes at
+  ``WORDS_PER_MINUTE``);
+* ``toc``: ``[{"level": 2, "id": ..., "title": ...}, ...]`` for the
+  ``<h2>``/``<h3>`` headings, whose ids are the anchors;
+* ``summary``: the post's excerpt, or the start of its text when the
+  excerpt is empty.
+
+``Post.save()`` renders whenever content or excerpt may have changed; the
+bulk writers (content webhook, importer) call ``Post.render_content()``
+themselves. Rows rendered by an older ``RENDER_VERSION``, or never rendered
+(``render_version`` 0, as left by the migration that added the fields), are
+rendered by ``manage.py render_content``.
+"""
+import math
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+from django.utils.text import slugify
+
+# Bump when the output of render() changes, so render_content redoes every post
+RENDER_VERSION = 2
+
+# The Post fields render() sets
+RENDERED_FIELDS = ['content_html', 'word_count', 'reading_time', 'toc', 'summary', 'render_version']
+
+WORDS_PER_MINUTE = 230
+SUMMARY_LENGTH = 300
+TOC_LEVELS = ('h2', 'h3')
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'blockquote', 'br', 'caption', 'cite', 'code', 'dd', 'del', 'div', 'dl',
+    'dt', 'em', 'figcaption', 'figure', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'img', 'ins',
+    'kbd', 'li', 'mark', 'ol', 'p', 'pre', 'q', 's', 'small', 'span', 'strong', 'sub', 'sup',
+    'table', 'tbody', 'td', 'tfoot', 'th', 'thead', 'tr', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+    'img': {'src', 'alt', 'title', 'width', 'height'},
+    'ol': {'start'},
+    'td': {'colspan', 'rowspan'},
+    'th': {'colspan', 'rowspan', 'scope'},
+}
+URL_ATTRIBUTES = {'href', 'src'}
+URL_SCHEMES = {'', 'http', 'https', 'mailto'}
+RENAMED_TAGS = {'h1': 'h2', 'b': 'strong', 'i': 'em'}
+# Elements without content or end tag, as in HTML
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+    'source', 'track', 'wbr',
+}
+# Dropped together with everything inside them
+DROPPED_TAGS = {
+    'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template', 'svg', 'math',
+    'form', 'button', 'select', 'textarea', 'head', 'title',
+}
+# Text that does not make a good summary
+NO_SUMMARY_TAGS = {'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'figcaption', 'caption', 'table'}
+BLOCK_TAGS = {
+    'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure', 'h2', 'h3', 'h4',
+    'h5', 'h6', 'hr', 'li', 'ol', 'p', 'pre', 'table', 'td', 'th', 'tr', 'ul',
+}
+
+# Elements whose start tag implicitly closes these open ones, as in HTML
+IMPLIED_ENDS = {
+    'li': {'li'},
+    'dt': {'dt', 'dd'},
+    'dd': {'dt', 'dd'},
+    'tr': {'tr', 'td', 'th'},
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+}
+CLOSES_PARAGRAPH = {
+    'blockquote', 'div', 'dl', 'figure', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'ol', 'p', 'pre',
+    'table', 'ul',
+}
+
+# Content is HTML once it has a tag this module knows; "a <b" or "<para>" is text
+MARKUP = re.compile(
+    r'</?(?:%s)[\s/>]' % '|'.join(sorted(ALLOWED_TAGS | DROPPED_TAGS | RENAMED_TAGS.keys())),
+    re.IGNORECASE,
+)
+WORD = re.compile(r"\w+(?:['’-]\w+)*")
+
+
+def safe_url(value):
+    # Browsers ignore whitespace and control characters inside a scheme
+    value = re.sub(r'[\x00-\x20]', '', value or '')
+    try:
+        scheme = urlsplit(value).scheme.lower()
+    except ValueError:
+        return False
+    return scheme in URL_SCHEMES
+
+
+def text_to_html(content):
+    """Paragraphs for markup-free content: blank lines separate them."""
+    paragraphs = [part.strip() for part in re.split(r'\n\s*\n', content) if part.strip()]
+    return ''.join(
+        '<p>' + '<br>'.join(escape(line.strip()) for line in paragraph.splitlines()) + '</p>'
+        for paragraph in paragraphs
+    )
+
+
+class Sanitizer(HTMLParser):
+    """Rebuilds HTML from the allowed parts, collecting text and headings on the way."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+        self.text = []
+        self.summary_text = []
+        self.skip_summary = 0
+        self.heading = None
+        self.headings = []
+        self.ids = set()
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping += 1
+            return
+        if self.dropping:
+            return
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag in BLOCK_TAGS:
+            self.add_break()
+        if tag not in ALLOWED_TAGS:
+            return
+        implied = IMPLIED_ENDS.get(tag, set()) | ({'p'} if tag in CLOSES_PARAGRAPH else set())
+        while self.open_tags and self.open_tags[-1] in implied:
+            self.close_tag(self.open_tags.pop())
+        allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+        kept = [
+            (name, value or '') for name, value in attrs
+            if name in allowed and (name not in URL_ATTRIBUTES or safe_url(value))
+        ]
+        if tag == 'img':
+            if not any(name == 'src' for name, _ in kept):
+                return
+            kept += [('loading', 'lazy'), ('decoding', 'async')]
+        if tag in TOC_LEVELS and self.heading is None:
+            # The id depends on the heading's text; filled in by its end tag
+            self.heading = (tag, len(self.output), kept, [])
+            self.output.append(None)
+        else:
+            self.output.append(self.start_tag(tag, kept))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+            if tag in NO_SUMMARY_TAGS:
+                self.skip_summary += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if RENAMED_TAGS.get(tag, tag) not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self.dropping = max(0, self.dropping - 1)
+            return
+        if self.dropping:
+            return
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag in BLOCK_TAGS:
+            self.add_break()
+        if tag not in self.open_tags:
+            return
+        # Closing an outer element closes whatever is still open inside it
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.close_tag(open_tag)
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.output.append(escape(data, quote=False))
+        self.text.append(data)
+        if not self.skip_summary:
+            self.summary_text.append(data)
+        if self.heading is not None:
+            self.heading[3].append(data)
+
+    def add_break(self):
+        self.text.append(' ')
+        self.summary_text.append(' ')
+
+    def start_tag(self, tag, attrs):
+        rendered = ''.join(f' {name}="{escape(value)}"' for name, value in attrs)
+        return f'<{tag}{rendered}>'
+
+    def close_tag(self, tag):
+        if tag in NO_SUMMARY_TAGS:
+            self.skip_summary -= 1
+        if self.heading is not None and self.heading[0] == tag:
+            level, position, attrs, parts = self.heading
+            self.heading = None
+            title = ' '.join(''.join(parts).split())
+            anchor = self.unique_id(slugify(title) or 'section')
+            self.output[position] = self.start_tag(level, [('id', anchor), *attrs])
+            if title:
+                self.headings.append({'level': int(level[1]), 'id': anchor, 'title': title})
+        self.output.append(f'</{tag}>')
+
+    def unique_id(self, base):
+        anchor, number = base, 1
+        while anchor in self.ids:
+            number += 1
+            anchor = f'{base}-{number}'
+        self.ids.add(anchor)
+        return anchor
+
+    def finish(self):
+        self.close()
+        while self.open_tags:
+            self.close_tag(self.open_tags.pop())
+        return ''.join(self.output)
+
+
+def summarize(text, length=SUMMARY_LENGTH):
+    """The start of `text` up to `length` characters, cut at a word boundary."""
+    text = ' '.join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text[:length + 1].rsplit(' ', 1)[0] if ' ' in text[:length + 1] else text[:length]
+    return cut.rstrip(' ,;:-–—') + '…'
+
+
+def render(content, excerpt=''):
+    """The RENDERED_FIELDS values for a post's `content` and `excerpt`."""
+    content = content or ''
+    sanitizer = Sanitizer()
+    sanitizer.feed(content if MARKUP.search(content) else text_to_html(content))
+    content_html = sanitizer.finish()
+    word_count = len(WORD.findall(''.join(sanitizer.text)))
+    return {
+        'content_html': content_html,
+        'word_count': word_count,
+        'reading_time': math.ceil(word_count / WORDS_PER_MINUTE),
+        'toc': sanitizer.headings,
+        'summary': (excerpt or '').strip() or summarize(''.join(sanitizer.summary_text)),
+        'render_version': RENDER_VERSION,
+    }
@@ -0,0 +1,228 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+from .models import ArticleImage, Category, Tag, Post, RelatedPost
+from . import counters, images, related, search
+
+# Sent by blog.bulk.notify_bulk_change() after posts were written with
+# bulk_create()/QuerySet.update(), which skip the model signals below.
+# Arguments: post_ids, stale_category_ids, stale_tag_ids, taxonomy_created,
+# previous (a blog.counters.snapshot() from before the writes, or None).
+posts_bulk_changed = Signal()
+
+# Sent by blog.bulk.render_posts() after re-rendering posts' content
+# (manage.py render_content). Arguments: post_ids.
+posts_rendered = Signal()
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_posts([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_posts([instance.pk])
+
+
+def retagged_post_ids(instance, action, reverse, pk_set):
+    """Ids of the posts whose tag set a m2m_changed signal reports."""
+    if not reverse:
+        return [instance.pk]
+    if action == 'pre_clear':
+        # tag.post_set.clear() does not report which posts it detaches
+        instance._cleared_post_ids = list(instance.post_set.values_list('id', flat=True))
+    if action == 'post_clear':
+        return getattr(instance, '_cleared_post_ids', [])
+    return list(pk_set or [])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def index_retagged_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    post_ids = retagged_post_ids(instance, action, reverse, pk_set)
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    search.index_posts(post_ids)
+    # Tags are part of a post's content, so HTTP validators derived from
+    # updated_at must change with them
+    now = timezone.now()
+    Post.objects.filter(pk__in=post_ids).update(updated_at=now)
+    if not reverse:
+        instance.updated_at = now
+
+
+@receiver(pre_save, sender=Category)
+@receiver(pre_save, sender=Tag)
+def remember_indexed_name(sender, instance, raw=False, **kwargs):
+    # The name is all the search index holds of a category or tag
+    instance._indexed_name = None
+    if instance.pk and not raw:
+        instance._indexed_name = sender.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+def index_renamed_taxonomy_posts(sender, instance, created, raw=False, **kwargs):
+    if created or raw or getattr(instance, '_indexed_name', None) == instance.name:
+        return
+    search.index_posts(instance.post_set.values_list('id', flat=True))
+
+
+@receiver(posts_bulk_changed)
+def index_bulk_changed_posts(sender, post_ids, **kwargs):
+    search.index_posts(post_ids)
+
+
+@receiver(pre_save, sender=Post)
+def remember_counted_state(sender, instance, raw=False, **kwargs):
+    instance._counted_previous = None
+    if instance.pk and not raw:
+        instance._counted_previous = (
+            Post.objects.filter(pk=instance.pk).values_list('status', 'category_id').first()
+        )
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counted_previous', None)
+    was_published = previous is not None and previous[0] == 'published'
+    is_published = instance.status == 'published'
+    if not (was_published or is_published):
+        return
+    if was_published and is_published and previous[1] == instance.category_id:
+        return
+    # Tags only come and go with the published state; a new post has none yet
+    tag_ids = set()
+    if was_published != is_published and not created:
+        tag_ids = set(
+            Post.tags.through.objects.filter(post_id=instance.pk).values_list('tag_id', flat=True)
+        )
+    counters.post_moved(
+        (previous[1], tag_ids) if was_published else None,
+        (instance.category_id, tag_ids) if is_published else None,
+    )
+
+
+@receiver(pre_delete, sender=Post)
+def remember_counted_tags(sender, instance, **kwargs):
+    instance._counted_tag_ids = None
+    if instance.status == 'published':
+        instance._counted_tag_ids = set(
+            Post.tags.through.objects.filter(post_id=instance.pk).values_list('tag_id', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Post)
+def uncount_deleted_post(sender, instance, **kwargs):
+    tag_ids = getattr(instance, '_counted_tag_ids', None)
+    if tag_ids is not None:
+        counters.post_moved((instance.category_id, tag_ids), None)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def count_retagged_posts(sender, instance, action, reverse, pk_set, **kwargs):
+    # pk_set of an add only holds the newly attached ids, but a remove
+    # reports whatever was asked for, so removals count what is attached
+    attached = Post.tags.through.objects
+    if not reverse:
+        if instance.status != 'published':
+            return
+        if action == 'post_add':
+            counters.apply_deltas(Tag, dict.fromkeys(pk_set, 1))
+        elif action in ('pre_remove', 'pre_clear'):
+            attached = attached.filter(post_id=instance.pk)
+            if action == 'pre_remove':
+                attached = attached.filter(tag_id__in=pk_set)
+            instance._uncounted_tag_ids = list(attached.values_list('tag_id', flat=True))
+        elif action in ('post_remove', 'post_clear'):
+            counters.apply_deltas(Tag, dict.fromkeys(instance._uncounted_tag_ids, -1))
+    elif action == 'post_add':
+        added = Post.objects.filter(pk__in=pk_set, status='published').count()
+        counters.apply_deltas(Tag, {instance.pk: added})
+    elif action in ('pre_remove', 'pre_clear'):
+        attached = attached.filter(tag_id=instance.pk, post__status='published')
+        if action == 'pre_remove':
+            attached = attached.filter(post_id__in=pk_set)
+        instance._uncounted_posts = attached.count()
+    elif action in ('post_remove', 'post_clear'):
+        counters.apply_deltas(Tag, {instance.pk: -instance._uncounted_posts})
+
+
+@receiver(posts_bulk_changed)
+def count_bulk_changed_posts(sender, post_ids, stale_category_ids, stale_tag_ids,
+                             previous=None, **kwargs):
+    if previous is not None:
+        counters.posts_changed(previous, post_ids)
+        return
+    # No snapshot of the posts before the change: recount every term they
+    # were or are in
+    category_ids = set(stale_category_ids) | set(
+        Post.objects.filter(pk__in=post_ids).values_list('category_id', flat=True)
+    )
+    tag_ids = set(stale_tag_ids) | set(
+        Post.tags.through.objects.filter(post_id__in=post_ids).values_list('tag_id', flat=True)
+    )
+    counters.recount(Category, category_ids)
+    counters.recount(Tag, tag_ids)
+
+
+@receiver(post_save, sender=Post)
+def refresh_saved_post_related(sender, instance, created, raw=False, **kwargs):
+    # Related lists depend on the published state, category and tags only
+    if raw:
+        return
+    previous = getattr(instance, '_counted_previous', None)
+    was_published = previous is not None and previous[0] == 'published'
+    if instance.status == 'published':
+        if was_published and previous[1] == instance.category_id:
+            return
+    elif not was_published:
+        return
+    related.refresh_on_commit([instance.pk])
+
+
+@receiver(pre_delete, sender=Post)
+def remember_related_holders(sender, instance, **kwargs):
+    # The cascade deletes these posts' entries for the deleted post
+    instance._related_holders = list(
+        RelatedPost.objects.filter(related_id=instance.pk).values_list('post_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Post)
+def refill_related_holders(sender, instance, **kwargs):
+    related.refresh_on_commit(getattr(instance, '_related_holders', []), propagate=False)
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def refresh_retagged_related(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse and instance.status != 'published':
+        return
+    related.refresh_on_commit(retagged_post_ids(instance, action, reverse, pk_set))
+
+
+@receiver(posts_bulk_changed)
+def refresh_bulk_changed_related(sender, post_ids, **kwargs):
+    related.refresh_on_commit(post_ids, propagate=len(post_ids) <= related.BULK_PROPAGATE_LIMIT)
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=ArticleImage)
+def attach_image_asset(sender, instance, raw=False, **kwargs):
+    # Keep the asset only while it matches image_url; a new URL is queued
+    # for process_images and linked when its variants exist
+    if raw:
+        return
+    field = 'image' if sender is Post else 'asset'
+    url = instance.image_url or ''
+    if getattr(instance, f'{field}_id') is not None:
+        if getattr(instance, field).source_url == url:
+            return
+    elif not url:
+        return
+    setattr(instance, field, images.asset_for(url))
@@ -0,0 +1,191 @@
+"""
+Deterministic synthetic content for load and scale testing.
+
+``synthetic_records()`` yields import records (see ``blog.importer``) for
+a corpus shaped like a production blog:
+
+* tag popularity follows a Zipf distribution, so a few tags sit on most
+  posts and most tags on a handful; categories and authors are skewed too;
+* most bodies run a few paragraphs, about one in seven is a long read;
+* posts are published, drafts (some scheduled) or archived, with
+  timestamps spread over the ``days`` before ``until``.
+
+The same arguments yield the same records, slugs included, so a corpus
+can be rebuilt exactly and seeding it again is an unchanged re-import.
+"""
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+from django.utils.text import slugify
+
+CATEGORY_NAMES = [
+    'Zero Waste', 'Renewable Energy', 'Eco-Friendly Living', 'Sustainable Food',
+    'Green Transport', 'Water Conservation', 'Circular Economy', 'Climate Policy',
+    'Biodiversity', 'Green Building', 'Ethical Fashion', 'Community Action',
+]
+TOPICS = [
+    'sustainability', 'eco-friendly', 'green-living', 'renewable', 'recycling',
+    'composting', 'solar', 'wind power', 'heat pumps', 'insulation', 'cycling',
+    'electric cars', 'public transit', 'plastic-free', 'upcycling', 'repair',
+    'secondhand', 'plant-based', 'local food', 'food waste', 'gardening',
+    'rainwater', 'greywater', 'rewilding', 'pollinators', 'carbon footprint',
+    'energy saving', 'batteries', 'minimalism', 'bulk shopping', 'refill',
+    'textiles', 'circularity', 'policy', 'activism', 'urban farming', 'forests',
+    'oceans', 'air quality', 'climate adaptation',
+]
+QUALIFIERS = ['basics', 'at home', 'in cities', 'for renters', 'on a budget', 'for families',
+              'at work', 'research', 'myths', 'tools']
+TITLE_PATTERNS = [
+    'A beginner\'s guide to {topic}', 'Why {topic} matters more than you think',
+    '{count} simple ways to start with {topic}', 'What a year of {topic} taught us',
+    '{Topic} on a budget', 'The truth about {topic}', 'How {topic} and {other} fit together',
+    'Ask an expert: {topic}', 'Common mistakes with {topic}', '{Topic}: a field report',
+]
+WORDS = (
+    'we you people households cities communities energy water waste food soil '
+    'carbon heat light power packaging materials products habits choices costs '
+    'savings emissions footprint climate season garden kitchen street market '
+    'reduce reuse repair share grow cook switch measure insulate plant choose '
+    'start avoid compare track install recycle compost save walk cycle '
+    'small simple local seasonal efficient durable affordable practical shared '
+    'every each most many some often usually rarely already still '
+    'the a this that our your their with without for from into over under '
+    'and but so because while when if'
+).split()
+
+# Share of posts in each state; archived posts are more than a year old,
+# like the ones manage_content archives
+STATES = ['published', 'draft', 'scheduled', 'archived']
+STATE_WEIGHTS = [70, 15, 5, 10]
+# Tags per post
+TAG_COUNTS = [0, 1, 2, 3, 4, 5]
+TAG_COUNT_WEIGHTS = [5, 20, 30, 25, 12, 8]
+LONG_READ_SHARE = 0.15
+FEATURED_SHARE = 0.03
+IMAGE_SHARE = 0.6
+SENTENCE_POOL = 600
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative weights for ranks 1..n with P(rank) proportional to 1/rank**exponent."""
+    total, weights = 0.0, []
+    for rank in range(1, n + 1):
+        total += 1 / rank ** exponent
+        weights.append(total)
+    return weights
+
+
+def numbered(names, count, qualifiers=()):
+    """`count` distinct names: `names`, then qualified variants, then numbered ones."""
+    result = list(names[:count])
+    for qualifier in qualifiers:
+        result.extend(f'{name} {qualifier}' for name in names[:count - len(result)])
+    round_ = 2
+    while len(result) < count:
+        result.extend(f'{name} {round_}' for name in names[:count - len(result)])
+        round_ += 1
+    return result
+
+
+def make_sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(6, 20))
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_body(rng, sentences):
+    # Lengths in sentences of ~13 words: 80-400 words, or 1500-6000 for long reads
+    if rng.random() < LONG_READ_SHARE:
+        count = rng.randint(115, 460)
+    else:
+        count = rng.randint(6, 30)
+    chosen = rng.choices(sentences, k=count)
+    paragraphs, start = [], 0
+    while start < count:
+        size = rng.randint(3, 6)
+        paragraphs.append(' '.join(chosen[start:start + size]))
+        start += size
+    return '\n\n'.join(paragraphs)
+
+
+def sample_distinct(rng, population, cum_weights, k):
+    k = min(k, len(population))
+    chosen = []
+    while len(chosen) < k:
+        item = rng.choices(population, cum_weights=cum_weights)[0]
+        if item not in chosen:
+            chosen.append(item)
+    return chosen
+
+
+def synthetic_records(posts, tags=50, categories=8, authors=10, seed=0, until=None,
+                      days=3 * 365, tag_exponent=1.1):
+    """
+    Yield category, tag and post records for `posts` posts. Post times are
+    spread over the `days` before `until` (default: now); scheduled drafts
+    go live in the month after it.
+    """
+    rng = random.Random(seed)
+    until = until or timezone.now()
+    category_names = numbered(CATEGORY_NAMES, max(1, categories))
+    tag_names = numbered(TOPICS, tags, QUALIFIERS)
+    usernames = [f'writer{n:03d}' for n in range(1, max(1, authors) + 1)]
+
+    for name in category_names:
+        yield {'type': 'category', 'name': name}
+    for name in tag_names:
+        yield {'type': 'tag', 'name': name}
+
+    tag_weights = zipf_cum_weights(len(tag_names), tag_exponent)
+    category_weights = zipf_cum_weights(len(category_names), 0.6)
+    author_weights = zipf_cum_weights(len(usernames), 0.8)
+    sentences = [make_sentence(rng) for _ in range(SENTENCE_POOL)]
+    days = max(1, days)
+
+    for number in range(posts):
+        post_tags = sample_distinct(
+            rng, tag_names, tag_weights, rng.choices(TAG_COUNTS, TAG_COUNT_WEIGHTS)[0]
+        )
+        topic = post_tags[0] if post_tags else rng.choice(TOPICS)
+        other = post_tags[-1] if len(post_tags) > 1 else rng.choice(TOPICS)
+        title = rng.choice(TITLE_PATTERNS).format(
+            topic=topic, Topic=topic.capitalize(), other=other, count=rng.randint(3, 12),
+        )
+        suffix = f'-{seed}-{number}'
+        slug = slugify(title)[:50 - len(suffix)].rstrip('-') + suffix
+        body = make_body(rng, sentences)
+
+        state = rng.choices(STATES, STATE_WEIGHTS)[0]
+        if state == 'archived':
+            age = rng.uniform(367, max(days, 368))
+        elif state == 'published':
+            age = rng.uniform(0, min(days, 365))
+        else:
+            age = rng.uniform(0, min(days, 60))
+        created_at = until - timedelta(days=age)
+        published_at = publish_at = None
+        if state in ('published', 'archived'):
+            published_at = min(until, created_at + timedelta(hours=rng.uniform(0, 48)))
+        elif state == 'scheduled':
+            publish_at = until + timedelta(days=rng.uniform(1, 30))
+        updated_at = min(until, (published_at or created_at) + timedelta(days=rng.expovariate(0.2)))
+
+        yield {
+            'type': 'post',
+            'title': title,
+            'slug': slug,
+            'content': body,
+            'excerpt': body.split('. ', 1)[0][:200].rstrip('.') + '.',
+            'image_url': (f'https://images.example.com/{slug}.jpg'
+                          if rng.random() < IMAGE_SHARE else None),
+            'author': rng.choices(usernames, cum_weights=author_weights)[0],
+            'category': rng.choices(category_names, cum_weights=category_weights)[0],
+            'tags': post_tags,
+            'status': 'published' if published_at else 'draft',
+            'is_featured': state == 'published' and rng.random() < FEATURED_SHARE,
+            'is_archived': state == 'archived',
+            'created_at': created_at.isoformat(),
+            'updated_at': updated_at.isoformat(),
+            'published_at': published_at and published_at.isoformat(),
+            'publish_at': publish_at and publish_at.isoformat(),
+        }
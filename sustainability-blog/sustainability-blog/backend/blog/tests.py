@@ -1,3 +1,1190 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.core.cache import cache
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .bulk import notify_bulk_change
+from .counters import recount, snapshot
+from . import images, related
+from .importer import Importer
+from .models import ArticleImage, Category, ImageAsset, Post, RelatedPost, RelatedRefresh, Tag
+from .related import Corpus, rebuild
+from .rendering import RENDER_VERSION, SUMMARY_LENGTH, render
+from .scheduling import next_due_at, publish_due_posts
+from .synthetic import synthetic_records
 
-# Create your tests here.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+class ManageContentTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.category = Category.objects.create(name='Zero Waste')
+        now = timezone.now()
+        self.old_draft = self.make_post('Due draft', publish_at=now - timedelta(hours=1))
+        self.new_draft = self.make_post('Future draft', publish_at=now + timedelta(days=1))
+        self.old_post = self.make_post(
+            'Old post', status='published', published_at=now - timedelta(days=400)
+        )
+        self.archived = self.make_post(
+            'Archived', status='published', published_at=now - timedelta(days=500),
+            is_archived=True, updated_at=now - timedelta(days=100),
+        )
+
+    def make_post(self, title, created_at=None, updated_at=None, **fields):
+        post = Post.objects.create(
+            title=title, content='...', author=self.author, category=self.category, **fields
+        )
+        # auto_now/auto_now_add ignore explicit values on create
+        timestamps = {'created_at': created_at, 'updated_at': updated_at}
+        timestamps = {key: value for key, value in timestamps.items() if value}
+        if timestamps:
+            Post.objects.filter(pk=post.pk).update(**timestamps)
+        post.refresh_from_db()
+        return post
+
+    def run_command(self, *args):
+        out = StringIO()
+        call_command('manage_content', *args, stdout=out)
+        return out.getvalue()
+
+    def test_publishes_due_drafts_and_archives_old_posts(self):
+        output = self.run_command('--chunk-size', '1')
+        self.assertIn('publish: 1 post(s) updated', output)
+        self.assertIn('archive: 1 post(s) updated', output)
+
+        for post in (self.old_draft, self.new_draft, self.old_post, self.archived):
+            post.refresh_from_db()
+        self.assertEqual(self.old_draft.status, 'published')
+        self.assertEqual(self.old_draft.published_at, self.old_draft.publish_at)
+        self.assertEqual(self.new_draft.status, 'draft')
+        self.assertTrue(self.old_post.is_archived)
+
+    def test_archiving_is_idempotent_and_keeps_updated_at(self):
+        updated_at = self.old_post.updated_at
+        archived_updated_at = self.archived.updated_at
+        self.run_command()
+        self.assertIn('archive: 0 post(s)', self.run_command())
+        self.old_post.refresh_from_db()
+        self.archived.refresh_from_db()
+        self.assertEqual(self.old_post.updated_at, updated_at)
+        self.assertEqual(self.archived.updated_at, archived_updated_at)
+
+    def test_dry_run_reports_without_writing(self):
+        output = self.run_command('--dry-run')
+        self.assertIn('publish: 1 post(s) would update', output)
+        self.assertIn('archive: 1 post(s) would update', output)
+        self.old_draft.refresh_from_db()
+        self.assertEqual(self.old_draft.status, 'draft')
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def run_with_backlog(size):
+            now = timezone.now()
+            for i in range(size):
+                self.make_post(f'Backlog {size}-{i}', publish_at=now - timedelta(days=3))
+                self.make_post(f'Old {size}-{i}', status='published',
+                               published_at=now - timedelta(days=400))
+            with CaptureQueriesContext(connection) as ctx:
+                self.run_command()
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run_with_backlog(2), run_with_backlog(20))
+        self.assertFalse(Post.objects.filter(status='draft', title__startswith='Backlog').exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SchedulingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='editor')
+        self.category = Category.objects.create(name='Zero Waste')
+        self.now = timezone.now()
+
+    def schedule(self, title, delta, **fields):
+        return Post.objects.create(
+            title=title, content='...', author=self.author, category=self.category,
+            publish_at=self.now + delta, **fields
+        )
+
+    def test_publishes_only_due_drafts_in_batches(self):
+        due = [self.schedule(f'Due {i}', -timedelta(minutes=i + 1)) for i in range(5)]
+        later = self.schedule('Later', timedelta(minutes=5))
+        unscheduled = Post.objects.create(
+            title='Unscheduled', content='...', author=self.author, category=self.category
+        )
+
+        published = publish_due_posts(now=self.now, batch_size=2)
+        self.assertCountEqual(published, [post.id for post in due])
+        for post in due:
+            post.refresh_from_db()
+            self.assertEqual(post.status, 'published')
+            self.assertEqual(post.published_at, post.publish_at)
+        later.refresh_from_db()
+        unscheduled.refresh_from_db()
+        self.assertEqual((later.status, unscheduled.status), ('draft', 'draft'))
+        self.assertEqual(publish_due_posts(now=self.now), [])
+
+    def test_next_due_ignores_published_posts(self):
+        self.assertIsNone(next_due_at())
+        self.schedule('Done already', -timedelta(days=1), status='published')
+        soon = self.schedule('Soon', timedelta(seconds=30))
+        self.schedule('Later', timedelta(hours=1))
+        self.assertEqual(next_due_at(), soon.publish_at)
+
+    def test_published_posts_appear_in_the_api(self):
+        post = self.schedule('Scheduled', -timedelta(seconds=1))
+        self.assertEqual(self.client.get('/api/posts/').json()['count'], 0)
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('run_scheduler', '--once', stdout=out)
+        self.assertIn('Published 1 scheduled post(s)', out.getvalue())
+        slugs = [r['slug'] for r in self.client.get('/api/posts/').json()['results']]
+        self.assertEqual(slugs, [post.slug])
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN the statements the API, admin and manage_content really send, so
+    a query or index change that falls back to a table scan (or an extra
+    sort) fails here instead of in production.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_superuser(username='admin', password='...')
+        cls.category = Category.objects.create(name='Zero Waste')
+        now = timezone.now()
+        for i in range(3):
+            Post.objects.create(
+                title=f'Post {i}', content='...', author=cls.author, category=cls.category,
+                status='published', published_at=now - timedelta(days=400 * i),
+                is_featured=i == 0,
+            )
+
+    def capture(self, func):
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            func()
+        return statements
+
+    def query_plan(self, sql, params):
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tiny test tables are always cheaper to scan; ask whether
+                # an index *can* serve the query, not whether it would here
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}', params)
+                return '\n'.join(row[0] for row in cursor.fetchall())
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def assertUsesIndex(self, index, func, *fragments, ordered=True):
+        """Assert the first SELECT containing `fragments` is served by `index`."""
+        statements = [
+            (sql, params) for sql, params in self.capture(func)
+            if sql.startswith('SELECT') and all(fragment in sql for fragment in fragments)
+        ]
+        self.assertTrue(statements, f'No query matching {fragments}')
+        plan = self.query_plan(*statements[0])
+        self.assertIn(index, plan, plan)
+        if ordered:
+            self.assertNotRegex(plan, r'TEMP B-TREE FOR ORDER BY|\bSort\b', plan)
+
+    def get(self, url):
+        return lambda: self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_public_list(self):
+        self.assertUsesIndex(
+            'blog_post_pub_created_idx', self.get('/api/posts/'), 'ORDER BY'
+        )
+
+    def test_public_list_cursor_pages(self):
+        self.assertUsesIndex(
+            'blog_post_pub_created_idx', self.get('/api/posts/?pagination=cursor'), 'ORDER BY'
+        )
+        self.assertUsesIndex(
+            'blog_post_pub_published_idx',
+            self.get('/api/posts/?pagination=cursor&ordering=-published_at'), 'ORDER BY',
+        )
+
+    def test_public_list_by_published_at(self):
+        self.assertUsesIndex(
+            'blog_post_pub_published_idx', self.get('/api/posts/?ordering=-published_at'), 'ORDER BY'
+        )
+
+    def test_category_list(self):
+        self.assertUsesIndex(
+            'blog_post_category_idx',
+            self.get(f'/api/posts/?category={self.category.slug}'), 'ORDER BY',
+        )
+
+    def test_featured_list(self):
+        self.assertUsesIndex(
+            'blog_post_featured_idx', self.get('/api/posts/?is_featured=true'), 'ORDER BY'
+        )
+
+    def test_admin_changelist(self):
+        self.client.force_login(self.author)
+        self.assertUsesIndex(
+            'blog_post_created_idx', self.get('/admin/blog/post/'), '"blog_post"."title"', 'ORDER BY'
+        )
+
+    def test_archive_phase(self):
+        # Most old posts are archived already; let the planner know that
+        Post.objects.bulk_create([
+            Post(title='Archived', slug=f'archived-{i}', content='...', author=self.author,
+                 category=self.category, status='published', is_archived=True,
+                 published_at=timezone.now() - timedelta(days=800))
+            for i in range(200)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertUsesIndex(
+            'blog_post_archive_due_idx',
+            lambda: call_command('manage_content', stdout=StringIO()),
+            '"is_archived"', 'ORDER BY',
+            ordered=False,
+        )
+
+    def test_scheduler(self):
+        self.assertUsesIndex('blog_post_publish_due_idx', next_due_at, '"publish_at"')
+
+
+class ExportContentTests(TestCase):
+    def setUp(self):
+        author = User.objects.create_user(username='editor')
+        self.category = Category.objects.create(name='Zero Waste')
+        self.tags = [Tag.objects.create(name='compost'), Tag.objects.create(name='solar')]
+        self.posts = []
+        for i in range(5):
+            post = Post.objects.create(
+                title=f'Post {i}', content='Ünïcode body', author=author,
+                category=self.category, status='published',
+            )
+            post.tags.set(self.tags[:i % 3])
+            self.posts.append(post)
+        ArticleImage.objects.create(post=self.posts[0], image_url='https://example.com/a.jpg')
+
+    def export(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('export_content', *args, stdout=out, stderr=err)
+        return [json.loads(line) for line in out.getvalue().splitlines()], err.getvalue()
+
+    def test_exports_every_table_in_dependency_order(self):
+        records, report = self.export('--chunk-size', '2')
+        self.assertEqual(
+            [record['type'] for record in records],
+            ['export', 'category', 'tag', 'tag'] + ['post'] * 5 + ['image'],
+        )
+        post = records[6]
+        self.assertEqual((post['slug'], post['author'], post['category']),
+                         (self.posts[2].slug, 'editor', self.category.slug))
+        self.assertEqual(post['tags'], [tag.slug for tag in self.tags])
+        self.assertEqual(post['content'], 'Ünïcode body')
+        self.assertEqual(records[-1]['post'], self.posts[0].slug)
+        self.assertIn('Exported 9 row(s)', report)
+
+    def test_incremental_export_since_watermark(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        for model in (Category, Tag, Post):
+            model.objects.update(updated_at=an_hour_ago)
+        ArticleImage.objects.update(uploaded_at=an_hour_ago)
+        started = timezone.now()
+        header = self.export()[0][0]
+        Post.objects.filter(pk=self.posts[1].pk).update(title='Edited', updated_at=timezone.now())
+        # Stamped before the export started, committed after it read the posts
+        Post.objects.filter(pk=self.posts[2].pk).update(title='Late', updated_at=started)
+        records, _ = self.export('--since', header['watermark'])
+        self.assertEqual([(r['type'], r.get('title')) for r in records[1:]],
+                         [('post', 'Edited'), ('post', 'Late')])
+
+    def test_query_count_grows_with_chunks_not_rows(self):
+        def queries(chunk_size):
+            with CaptureQueriesContext(connection) as ctx:
+                self.export('--chunk-size', str(chunk_size))
+            return len(ctx.captured_queries)
+
+        # 5 posts in chunks of 2 instead of 1: two more post queries and
+        # two more tag queries; nothing per row
+        self.assertEqual(queries(1000) + 4, queries(2))
+
+    def test_gzip_file_output(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.ndjson.gz')
+            call_command('export_content', '-o', path, stdout=StringIO())
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 10)
+
+
+class TaxonomyCounterTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.energy = Category.objects.create(name='Renewable Energy')
+        self.waste = Category.objects.create(name='Zero Waste')
+        self.solar = Tag.objects.create(name='solar')
+        self.wind = Tag.objects.create(name='wind')
+
+    def make_post(self, title, tags=(), **fields):
+        fields.setdefault('category', self.energy)
+        post = Post.objects.create(title=title, content='...', author=self.author, **fields)
+        post.tags.set(tags)
+        return post
+
+    def assertCounts(self, **expected):
+        objs = {obj.slug: obj for obj in [*Category.objects.all(), *Tag.objects.all()]}
+        actual = {slug: objs[slug].published_post_count for slug in expected}
+        self.assertEqual(actual, expected)
+        # Whatever path got here, the counters match a full recount
+        self.assertEqual(recount(Category, dry_run=True), {})
+        self.assertEqual(recount(Tag, dry_run=True), {})
+
+    def test_single_post_lifecycle(self):
+        post = self.make_post('Solar', tags=[self.solar, self.wind], status='published')
+        draft = self.make_post('Draft', tags=[self.solar])
+        self.assertCounts(**{'renewable-energy': 1, 'solar': 1, 'wind': 1})
+
+        post.category = self.waste
+        post.save()
+        self.assertCounts(**{'renewable-energy': 0, 'zero-waste': 1, 'solar': 1})
+
+        post.tags.remove(self.wind, self.solar)
+        post.tags.add(self.solar)
+        post.tags.remove(self.wind)  # not attached: must not count twice
+        self.assertCounts(solar=1, wind=0)
+
+        post.status = 'draft'
+        post.save()
+        self.assertCounts(**{'zero-waste': 0, 'solar': 0})
+
+        draft.status = 'published'
+        draft.save()
+        post.delete()
+        self.assertCounts(**{'renewable-energy': 1, 'zero-waste': 0, 'solar': 1})
+
+        post = self.make_post('Cleared', tags=[self.solar, self.wind], status='published')
+        post.tags.clear()
+        self.assertCounts(solar=1, wind=0)
+
+    def test_reverse_tag_changes(self):
+        published = [self.make_post(f'P{i}', status='published') for i in range(3)]
+        draft = self.make_post('Draft')
+        self.solar.post_set.add(*published, draft)
+        self.assertCounts(solar=3)
+        self.solar.post_set.remove(published[0], draft)
+        self.assertCounts(solar=2)
+        self.solar.post_set.clear()
+        self.assertCounts(solar=0)
+
+    def test_bulk_changes_apply_snapshot_differences(self):
+        posts = [self.make_post(f'P{i}', tags=[self.solar]) for i in range(4)]
+        ids = [post.id for post in posts]
+        previous = snapshot(ids)
+        self.assertEqual(previous, {})
+        Post.objects.filter(id__in=ids[:3]).update(status='published')
+        notify_bulk_change(ids, previous=previous)
+        self.assertCounts(**{'renewable-energy': 3, 'solar': 3})
+
+        previous = snapshot(ids)
+        Post.objects.filter(id=ids[0]).update(category=self.waste)
+        Post.tags.through.objects.filter(post_id=ids[1]).update(tag_id=self.wind.id)
+        notify_bulk_change(ids, previous=previous)
+        self.assertCounts(**{'renewable-energy': 2, 'zero-waste': 1, 'solar': 2, 'wind': 1})
+
+    def test_bulk_changes_without_snapshot_recount(self):
+        post = self.make_post('P', tags=[self.solar])
+        Post.objects.filter(id=post.id).update(status='published', category=self.waste)
+        notify_bulk_change([post.id], stale_category_ids=[self.energy.id])
+        self.assertCounts(**{'renewable-energy': 0, 'zero-waste': 1, 'solar': 1})
+
+    def test_scheduler_and_manage_content_publish(self):
+        now = timezone.now()
+        self.make_post('Due', tags=[self.solar], publish_at=now - timedelta(minutes=1))
+        publish_due_posts(now=now)
+        self.assertCounts(solar=1)
+        self.make_post('Also due', tags=[self.solar], publish_at=now - timedelta(minutes=1))
+        call_command('manage_content', stdout=StringIO())
+        self.assertCounts(**{'renewable-energy': 2, 'solar': 2})
+
+    def test_import_and_reimport(self):
+        def import_records(records):
+            importer = Importer(batch_size=40, create_authors=True)
+            for number, record in enumerate(records, 1):
+                importer.add(number, record)
+            importer.flush()
+
+        records = list(synthetic_records(100, seed=3))
+        import_records(records)
+        self.assertTrue(Tag.objects.filter(published_post_count__gt=0).exists())
+        self.assertCounts()
+        # Unpublish, move and retag some posts on re-import
+        for record in records[-30:]:
+            if record['type'] == 'post':
+                record.update(status='draft', published_at=None, category=records[0]['name'],
+                              tags=record['tags'][1:])
+        import_records(records)
+        self.assertCounts()
+
+    def test_recount_command_repairs_drift(self):
+        self.make_post('P', tags=[self.solar], status='published')
+        Tag.objects.filter(id=self.solar.id).update(published_post_count=7)
+        Category.objects.filter(id=self.waste.id).update(published_post_count=2)
+        out = StringIO()
+        call_command('recount_taxonomy', '--dry-run', '-v', '2', stdout=out)
+        self.assertIn('solar: 7 -> 1', out.getvalue())
+        self.assertIn('tags: 1 drifted counter(s) would fix', out.getvalue())
+        self.assertEqual(Tag.objects.get(id=self.solar.id).published_post_count, 7)
+
+        out = StringIO()
+        call_command('recount_taxonomy', stdout=out)
+        self.assertIn('categories: 1 drifted counter(s) fixed', out.getvalue())
+        self.assertCounts(**{'zero-waste': 0, 'solar': 1})
+
+
+def equal_tag_weights(corpus, document_frequency, published):
+    """Corpus.set_weights() without inverse document frequencies."""
+    corpus.weight = dict.fromkeys(document_frequency, 1.0)
+
+
+class RelatedPostsTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.energy = Category.objects.create(name='Renewable Energy')
+        self.waste = Category.objects.create(name='Zero Waste')
+        self.solar = Tag.objects.create(name='solar')
+        self.wind = Tag.objects.create(name='wind')
+        self.compost = Tag.objects.create(name='compost')
+        self.days = 0
+
+    def make_post(self, title, tags=(), status='published', **fields):
+        # Each post a day older than the previous one
+        self.days += 1
+        fields.setdefault('category', self.energy)
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title=title, content='...', author=self.author, status=status,
+                published_at=timezone.now() - timedelta(days=self.days), **fields,
+            )
+            post.tags.set(tags)
+        return post
+
+    def lists(self):
+        lists = {}
+        for row in RelatedPost.objects.order_by('post_id', 'rank'):
+            lists.setdefault(row.post_id, []).append(row.related_id)
+        return lists
+
+    def assertMatchesRebuild(self, *posts):
+        """
+        The changed posts' lists, and the lists they are in, are what a
+        rebuild makes of them. Needs equal_tag_weights(): lists that
+        refresh() only amends keep scores from before tag weights moved.
+        """
+        def affected(lists):
+            return {
+                post.pk: (lists.get(post.pk), {pk for pk, related in lists.items() if post.pk in related})
+                for post in posts
+            }
+        incremental = self.lists()
+        rebuild()
+        self.assertEqual(affected(incremental), affected(self.lists()))
+
+    def test_rebuild_ranks_by_tags_category_and_recency(self):
+        both = self.make_post('Solar and wind', tags=[self.solar, self.wind])
+        twin = self.make_post('Wind and solar', tags=[self.solar, self.wind])
+        solar = self.make_post('Solar elsewhere', tags=[self.solar], category=self.waste)
+        neighbour = self.make_post('Same category', tags=[self.compost])
+        unrelated = self.make_post('Compost', tags=[self.compost], category=self.waste)
+        self.make_post('Draft', tags=[self.solar, self.wind], status='draft')
+
+        self.assertEqual(rebuild(), 5)
+        lists = self.lists()
+        # Shared tags count for more than a shared category
+        self.assertEqual(lists[both.pk], [twin.pk, solar.pk, neighbour.pk])
+        self.assertEqual(lists[unrelated.pk], [neighbour.pk, solar.pk])
+        scores = list(RelatedPost.objects.filter(post=both).order_by('rank').values_list('score', flat=True))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+        # The newer of two equally related posts ranks first
+        older_twin = self.make_post('Solar and wind again', tags=[self.solar, self.wind])
+        rebuild()
+        self.assertEqual(self.lists()[both.pk][:2], [twin.pk, older_twin.pk])
+
+    @mock.patch.object(Corpus, 'set_weights', equal_tag_weights)
+    def test_changes_refresh_lists_incrementally(self):
+        posts = [
+            self.make_post(f'Post {i}', tags=[[self.solar], [self.wind], [self.solar, self.compost]][i % 3],
+                           category=[self.energy, self.waste][i % 2])
+            for i in range(12)
+        ]
+        rebuild()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[0].tags.set([self.compost])
+        self.assertMatchesRebuild(posts[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wind.post_set.add(posts[2], posts[4])
+        self.assertMatchesRebuild(posts[2], posts[4])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[1].category = self.energy
+            posts[1].save()
+        self.assertMatchesRebuild(posts[1])
+
+        new = self.make_post('Brand new', tags=[self.solar, self.wind])
+        self.assertIn(new.pk, self.lists())
+        self.assertMatchesRebuild(new)
+
+        solar = list(self.solar.post_set.all())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.solar.post_set.clear()
+        self.assertMatchesRebuild(*solar)
+
+    @mock.patch.object(Corpus, 'set_weights', equal_tag_weights)
+    def test_unpublished_and_deleted_posts_leave_lists(self):
+        posts = [self.make_post(f'Post {i}', tags=[self.solar]) for i in range(4)]
+        rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[0].status = 'draft'
+            posts[0].save()
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[1].delete()
+        lists = self.lists()
+        self.assertEqual(set(lists), {posts[2].pk, posts[3].pk})
+        self.assertEqual(lists[posts[2].pk], [posts[3].pk])
+        self.assertMatchesRebuild(posts[2], posts[3])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[0].status = 'published'
+            posts[0].save()
+        self.assertEqual(self.lists()[posts[0].pk], [posts[2].pk, posts[3].pk])
+        self.assertMatchesRebuild(posts[0])
+
+    @mock.patch.object(Corpus, 'set_weights', equal_tag_weights)
+    def test_bulk_changes_refresh_lists(self):
+        posts = [self.make_post(f'Post {i}', tags=[self.solar]) for i in range(3)]
+        rebuild()
+        previous = snapshot([posts[0].pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(pk=posts[0].pk).update(status='draft')
+            notify_bulk_change([posts[0].pk], [], [], False, previous=previous)
+        self.assertNotIn(posts[0].pk, self.lists())
+        self.assertMatchesRebuild(posts[1], posts[2])
+
+    @mock.patch.object(Corpus, 'set_weights', equal_tag_weights)
+    def test_one_refresh_per_commit(self):
+        posts = [self.make_post(f'Post {i}', tags=[self.solar]) for i in range(6)]
+        rebuild()
+        with mock.patch('blog.related.refresh', wraps=related.refresh) as refresh, \
+                self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(pk__in=[post.pk for post in posts[:3]]).delete()
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(set(self.lists()), {post.pk for post in posts[3:]})
+        self.assertMatchesRebuild(*posts[3:])
+
+    @mock.patch.object(Corpus, 'set_weights', equal_tag_weights)
+    @mock.patch('blog.related.INLINE_REFRESH_LIMIT', 2)
+    def test_large_commits_are_queued(self):
+        posts = [self.make_post(f'Post {i}', tags=[self.solar]) for i in range(6)]
+        rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(pk__in=[post.pk for post in posts[:3]]).delete()
+        # The deleted posts held each other too
+        self.assertEqual(RelatedRefresh.objects.count(), 6)
+        # Still listing each other, minus the deleted entries
+        self.assertEqual(self.lists()[posts[3].pk], [posts[4].pk, posts[5].pk])
+
+        out = StringIO()
+        call_command('build_related_posts', '--pending', stdout=out)
+        self.assertIn('6 queued related post list(s) refreshed', out.getvalue())
+        self.assertFalse(RelatedRefresh.objects.exists())
+        self.assertMatchesRebuild(*posts[3:])
+
+    def test_build_related_posts_command(self):
+        self.make_post('Solar', tags=[self.solar])
+        self.make_post('Solar too', tags=[self.solar])
+        out = StringIO()
+        call_command('build_related_posts', verbosity=2, stdout=out)
+        self.assertIn('2/2 lists written', out.getvalue())
+        self.assertIn('2 related post list(s) rebuilt', out.getvalue())
+        self.assertEqual(RelatedPost.objects.count(), 2)
+
+
+class ImportContentTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def import_content(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_content', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_round_trips_an_export(self):
+        category = Category.objects.create(name='Zero Waste', description='Less bin')
+        tags = [Tag.objects.create(name='compost'), Tag.objects.create(name='solar')]
+        created_at = timezone.now() - timedelta(days=30)
+        for i in range(3):
+            post = Post.objects.create(title=f'Post {i}', content='Body', author=self.author,
+                                       category=category, status='published',
+                                       published_at=created_at)
+            post.tags.set(tags[:i])
+        Post.objects.update(created_at=created_at)
+        ArticleImage.objects.create(post=post, image_url='https://example.com/a.jpg')
+        out = StringIO()
+        call_command('export_content', stdout=out, stderr=StringIO())
+        path = self.write('export.ndjson', out.getvalue())
+        expected = {p.slug: (p.title, sorted(p.tags.values_list('slug', flat=True)))
+                    for p in Post.objects.all()}
+
+        Post.objects.all().delete()
+        Category.objects.all().delete()
+        Tag.objects.all().delete()
+        report, errors = self.import_content(path, '--batch-size', '2')
+
+        self.assertEqual(errors, '')
+        self.assertIn('posts 3 created / 0 updated / 0 unchanged', report)
+        self.assertEqual(
+            {p.slug: (p.title, sorted(p.tags.values_list('slug', flat=True)))
+             for p in Post.objects.all()},
+            expected,
+        )
+        self.assertEqual(Category.objects.get().description, 'Less bin')
+        self.assertEqual(set(Post.objects.values_list('created_at', flat=True)), {created_at})
+        self.assertEqual(ArticleImage.objects.count(), 1)
+
+        # Importing again leaves unchanged posts alone rather than duplicating
+        report, _ = self.import_content(path)
+        self.assertIn('posts 0 created / 0 updated / 3 unchanged', report)
+        self.assertEqual((Post.objects.count(), ArticleImage.objects.count()), (3, 1))
+
+        edited = out.getvalue().replace('"title":"Post 1"', '"title":"Edited"').replace(
+            '"tags":["compost","solar"]', '"tags":["solar"]')
+        before = Post.objects.get(title='Post 1').updated_at
+        report, _ = self.import_content(self.write('edited.ndjson', edited))
+        self.assertIn('posts 0 created / 2 updated / 1 unchanged', report)
+        edited_post = Post.objects.get(title='Edited')
+        self.assertEqual(edited_post.created_at, created_at)
+        # The exported updated_at is older than the stored one by now
+        self.assertGreater(edited_post.updated_at, before)
+        self.assertEqual(list(Post.objects.get(title='Post 2').tags.values_list('slug', flat=True)),
+                         ['solar'])
+
+    def test_csv_rows_get_generated_slugs_and_taxonomy(self):
+        long_title = 'A rather long title about rainwater harvesting on rooftops'
+        path = self.write('posts.csv', (
+            'title,content,category,tags,status,author\n'
+            f'{long_title},Body,Water,"rain, roofs",published,\n'
+            'Second,Body,Water,rain,draft,nobody\n'
+            ',No title,Water,,draft,\n'
+        ))
+        report, errors = self.import_content(path, '--author', 'editor')
+
+        self.assertIn('Record 3: title is required', errors)
+        self.assertIn('posts 2 created', report)
+        self.assertIn('Imported 2 record(s), rejected 1,', report)
+        post = Post.objects.get(title=long_title)
+        self.assertLessEqual(len(post.slug), Post._meta.get_field('slug').max_length)
+        self.assertTrue(post.slug.startswith('a-rather-long-title'))
+        self.assertEqual((post.author, post.category.name, post.status), (self.author, 'Water', 'published'))
+        self.assertIsNotNone(post.published_at)
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['rain', 'roofs'])
+        self.assertEqual(Post.objects.get(title='Second').author, self.author)
+
+    def test_rejects_image_urls_that_are_not_public_http(self):
+        path = self.write('posts.csv', (
+            'title,content,category,image_url\n'
+            'Local,Body,Water,file:///etc/passwd\n'
+            'Metadata,Body,Water,http://169.254.169.254/latest/\n'
+            'Remote,Body,Water,https://images.example.com/a.jpg\n'
+        ))
+        report, errors = self.import_content(path, '--author', 'editor')
+        self.assertIn("Record 1: image_url must be an http or https URL: 'file:///etc/passwd'", errors)
+        self.assertIn('Record 2: image_url points at a non-public address', errors)
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Remote'])
+
+    def test_rejects_taxonomy_names_that_do_not_fit(self):
+        Tag.objects.create(name='!!!', slug='')
+        lines = [
+            {'type': 'tag', 'name': '???'},
+            {'type': 'post', 'title': 'Punctuation', 'category': 'Water', 'tags': ['???']},
+            {'type': 'post', 'title': 'Long category', 'category': 'x' * 101},
+            {'type': 'post', 'title': 'Long tag', 'category': 'Water', 'tags': ['x' * 51]},
+            {'type': 'post', 'title': 'Fine', 'category': 'Water', 'tags': ['rain']},
+        ]
+        path = self.write('posts.ndjson', ''.join(json.dumps(line) + '\n' for line in lines))
+        report, errors = self.import_content(path, '--author', 'editor')
+        self.assertIn("Record 1: name needs a letter or digit, or a slug: '???'", errors)
+        self.assertIn("Record 2: tag '???' needs a letter or digit", errors)
+        self.assertIn('Record 3: category', errors)
+        self.assertIn('Record 4: tag', errors)
+        self.assertIn('rejected 4,', report)
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Fine'])
+        self.assertEqual(Tag.objects.get(slug='').name, '!!!')
+
+    def test_queries_grow_with_batches_not_rows(self):
+        def queries(rows):
+            lines = ''.join(
+                json.dumps({'type': 'post', 'title': f'Post {rows}-{i}', 'category': 'Solar',
+                            'tags': ['pv', f'tag-{i % 3}'], 'author': 'editor'}) + '\n'
+                for i in range(rows)
+            )
+            path = self.write(f'{rows}.ndjson', lines)
+            with CaptureQueriesContext(connection) as ctx:
+                self.import_content(path, '--batch-size', '1000')
+            return len(ctx.captured_queries)
+
+        queries(3)  # creates the shared category and tags
+        # 40 posts still fit in one SQLite INSERT (999 parameters)
+        self.assertEqual(queries(5), queries(40))
+
+    def test_resumes_after_the_checkpoint(self):
+        path = self.write('posts.ndjson', ''.join(
+            json.dumps({'title': f'Post {i}', 'category': 'Solar', 'author': 'editor'}) + '\n'
+            for i in range(5)
+        ))
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'path': path, 'size': os.path.getsize(path), 'position': 3}, f)
+
+        with self.assertRaisesMessage(CommandError, 'pass --resume'):
+            self.import_content(path)
+        report, _ = self.import_content(path, '--resume')
+
+        self.assertIn('Imported 2 record(s)', report)
+        self.assertEqual(sorted(Post.objects.values_list('title', flat=True)), ['Post 3', 'Post 4'])
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_writes_checkpoints_per_batch(self):
+        path = self.write('posts.ndjson', ''.join(
+            json.dumps({'title': f'Post {i}', 'category': 'Solar', 'author': 'editor'}) + '\n'
+            for i in range(5)
+        ) + '{"title": "Broken", "category": "Solar", "status": "live"}\n')
+        positions = []
+        real_replace = os.replace
+
+        def record(source, target):
+            real_replace(source, target)
+            with open(target) as f:
+                positions.append(json.load(f)['position'])
+
+        with mock.patch('os.replace', record):
+            _, errors = self.import_content(path, '--batch-size', '2')
+        self.assertEqual(positions, [2, 4])
+        self.assertIn('Record 6: status must be one of draft, published', errors)
+        self.assertEqual(Post.objects.count(), 5)
+
+
+class SeedDbTests(TestCase):
+    until = '2026-06-01T00:00:00+00:00'
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_db', *args, stdout=out)
+        return out.getvalue()
+
+    def test_seeds_sample_content_by_default(self):
+        self.seed()
+        self.assertEqual(Post.objects.count(), 3)
+        self.assertTrue(User.objects.filter(username='admin', is_superuser=True).exists())
+
+    def test_synthetic_corpus_shape(self):
+        self.seed('--posts', '400', '--tags', '30', '--authors', '5', '--until', self.until)
+        synthetic = Post.objects.exclude(author__username='admin')
+        self.assertEqual(synthetic.count(), 400)
+        self.assertEqual(Tag.objects.count(), 30)
+        self.assertEqual(synthetic.values('author').distinct().count(), 5)
+        self.assertTrue(synthetic.filter(status='draft', publish_at__isnull=False).exists())
+        self.assertTrue(synthetic.filter(status='draft', publish_at__isnull=True).exists())
+        self.assertTrue(synthetic.filter(is_archived=True).exists())
+        self.assertGreater(synthetic.filter(status='published').count(), 200)
+        lengths = [len(content) for content in synthetic.values_list('content', flat=True)]
+        self.assertGreater(max(lengths), 10 * min(lengths))
+        # Zipfian tags: the head tag is on far more posts than the tail ones
+        counts = sorted(Tag.objects.annotate(n=Count('post')).values_list('n', flat=True))
+        self.assertGreater(counts[-1], 5 * max(counts[0], 1))
+
+    def test_same_seed_same_corpus(self):
+        kwargs = {'tags': 20, 'seed': 3, 'until': timezone.now()}
+        self.assertEqual(list(synthetic_records(50, **kwargs)), list(synthetic_records(50, **kwargs)))
+        self.assertNotEqual(list(synthetic_records(50, **kwargs)),
+                            list(synthetic_records(50, **{**kwargs, 'seed': 4})))
+
+        self.seed('--posts', '50', '--until', self.until)
+        report = self.seed('--posts', '50', '--until', self.until)
+        self.assertIn('0 created, 0 updated, 50 unchanged', report)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class ContentRenderingTests(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.category = Category.objects.create(name='Water')
+
+    def create_post(self, content, **fields):
+        return Post.objects.create(title='Rain', content=content, author=self.author,
+                                   category=self.category, **fields)
+
+    def test_renders_sanitized_html_and_toc(self):
+        rendered = render(
+            '<h1>Rain &amp; roofs</h1><p onclick="steal()">Collect <b>rain</b>'
+            '<script>alert(1)</script><a href="java\tscript:alert(1)">here</a> '
+            '<a href="/guides?a=1&b=2">guide</a></p><h2>Rain &amp; roofs</h2>'
+            '<ul><li>one<li>two</ul><img src="https://example.com/a.jpg" alt="Barrel"><p>Open'
+        )
+        self.assertEqual(rendered['content_html'], (
+            '<h2 id="rain-roofs">Rain &amp; roofs</h2><p>Collect <strong>rain</strong><a>here</a> '
+            '<a href="/guides?a=1&amp;b=2">guide</a></p><h2 id="rain-roofs-2">Rain &amp; roofs</h2>'
+            '<ul><li>one</li><li>two</li></ul>'
+            '<img src="https://example.com/a.jpg" alt="Barrel" loading="lazy" decoding="async">'
+            '<p>Open</p>'
+        ))
+        self.assertEqual(rendered['toc'], [
+            {'level': 2, 'id': 'rain-roofs', 'title': 'Rain & roofs'},
+            {'level': 2, 'id': 'rain-roofs-2', 'title': 'Rain & roofs'},
+        ])
+        # Headings are not summary material
+        self.assertEqual(rendered['summary'], 'Collect rainhere guide one two Open')
+
+    def test_dropped_void_elements_drop_nothing_after_them(self):
+        for tag in ('<embed src="x.swf">', '<embed src="x.swf"/>', '<embed></embed>'):
+            rendered = render(f'<p>Before</p>{tag}<p>After</p><object><embed/>gone</object><p>End</p>')
+            self.assertEqual(rendered['content_html'], '<p>Before</p><p>After</p><p>End</p>', tag)
+
+    def test_plain_text_counts_and_summary(self):
+        content = 'First line\nsecond <line> & more.\n\n' + 'word ' * 500
+        rendered = render(content)
+        self.assertTrue(rendered['content_html'].startswith(
+            '<p>First line<br>second &lt;line&gt; &amp; more.</p><p>word word'
+        ))
+        self.assertEqual(rendered['word_count'], 505)
+        self.assertEqual(rendered['reading_time'], 3)
+        self.assertLessEqual(len(rendered['summary']), SUMMARY_LENGTH + 1)
+        self.assertTrue(rendered['summary'].endswith('word…'))
+        self.assertEqual(render(content, ' Hand-written. ')['summary'], 'Hand-written.')
+
+    def test_save_renders_when_content_may_change(self):
+        post = self.create_post('<h2>Tanks</h2><p>Old text</p>')
+        self.assertEqual((post.render_version, post.word_count), (RENDER_VERSION, 3))
+        self.assertEqual(Post.objects.get(pk=post.pk).toc[0]['id'], 'tanks')
+
+        post.content = 'New text'
+        post.status = 'published'
+        post.save(update_fields=['status'])
+        self.assertEqual(Post.objects.get(pk=post.pk).content_html, '<h2 id="tanks">Tanks</h2><p>Old text</p>')
+        post.save(update_fields=['content'])
+        self.assertEqual(Post.objects.get(pk=post.pk).content_html, '<p>New text</p>')
+
+    def test_importer_renders_new_and_changed_posts(self):
+        importer = Importer(default_author=self.author)
+        importer.add(1, {'title': 'Barrels', 'slug': 'barrels', 'category': 'Water',
+                         'content': 'Some barrel text.'})
+        importer.flush()
+        post = Post.objects.get(slug='barrels')
+        self.assertEqual((post.summary, post.word_count), ('Some barrel text.', 3))
+
+        importer.add(2, {'title': 'Barrels', 'slug': 'barrels', 'category': 'Water',
+                         'content': 'Some barrel text.', 'excerpt': 'Short'})
+        importer.flush()
+        post.refresh_from_db()
+        self.assertEqual(post.summary, 'Short')
+
+    def test_render_content_backfills_in_chunks(self):
+        posts = [self.create_post(f'Post {i} body') for i in range(5)]
+        Post.objects.filter(pk__in=[p.pk for p in posts[:3]]).update(
+            content_html='', summary='', render_version=0,
+        )
+        before = Post.objects.get(pk=posts[0].pk).updated_at
+        out = StringIO()
+        with mock.patch('blog.bulk.posts_rendered.send') as send:
+            call_command('render_content', '--processes', '0', '--chunk-size', '2', stdout=out)
+        self.assertIn('3 post(s) rendered', out.getvalue())
+        send.assert_called_once_with(sender=Post, post_ids=[p.pk for p in posts[:3]])
+        post = Post.objects.get(pk=posts[0].pk)
+        self.assertEqual((post.content_html, post.summary), ('<p>Post 0 body</p>', 'Post 0 body'))
+        self.assertGreater(post.updated_at, before)
+
+        call_command('render_content', '--processes', '0', stdout=out)
+        self.assertIn('0 post(s) rendered', out.getvalue())
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class PostAdminTests(TestCase):
+    url = '/admin/blog/post/'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='...')
+        self.client.force_login(self.admin)
+        self.category = Category.objects.create(name='Water')
+
+    def create_posts(self, count, **fields):
+        authors = [User.objects.create_user(username=f'writer-{Post.objects.count()}-{i}')
+                   for i in range(count)]
+        return [Post.objects.create(title=f'Post {i}', content='Rain barrels', author=author,
+                                    category=self.category, **fields)
+                for i, author in enumerate(authors)]
+
+    def act(self, action, posts, **data):
+        return self.client.post(self.url, {
+            'action': action, '_selected_action': [post.pk for post in posts], **data,
+        })
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        def queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+            return ctx.captured_queries
+
+        self.create_posts(2)
+        few = queries()
+        self.create_posts(20)
+        many = queries()
+        self.assertEqual(len(few), len(many))
+        # Neither every author (no author filter) nor a second full count
+        self.assertFalse([q for q in many if '"auth_user"' in q['sql'] and 'JOIN' not in q['sql']
+                          and 'WHERE' not in q['sql']])
+        self.assertEqual(len([q for q in many if 'COUNT(' in q['sql']]), 1)
+        self.assertFalse([q for q in many if '"blog_post"."content"' in q['sql']])
+
+    def test_search_uses_the_full_text_index(self):
+        post = self.create_posts(1)[0]
+        Post.objects.filter(pk=post.pk).update(title='Untitled')
+        Tag.objects.create(name='greywater').post_set.add(post)
+        response = self.client.get(self.url, {'q': 'greywater'})
+        self.assertEqual(list(response.context['cl'].result_list), [post])
+        self.assertEqual(list(self.client.get(self.url, {'q': 'solar'}).context['cl'].result_list), [])
+
+    def test_large_counts_are_estimated(self):
+        self.create_posts(2)
+        with mock.patch('blog.admin.estimated_count', return_value=250000):
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 250000)
+        with mock.patch('blog.admin.estimated_count', return_value=40):
+            self.assertEqual(self.client.get(self.url).context['cl'].result_count, 2)
+
+    def test_publish_and_archive_actions(self):
+        drafts = self.create_posts(3)
+        self.act('publish', drafts[:2])
+        self.assertEqual(Post.objects.filter(status='published', published_at__isnull=False).count(), 2)
+        self.category.refresh_from_db()
+        self.assertEqual(self.category.published_post_count, 2)
+
+        self.client.post(self.url, {'action': 'archive', 'select_across': '1', 'index': '0',
+                                    '_selected_action': [drafts[0].pk]})
+        self.assertEqual(Post.objects.filter(is_archived=True).count(), 3)
+
+    def test_tag_actions(self):
+        posts = self.create_posts(3, status='published')
+        solar = Tag.objects.create(name='solar')
+        posts[0].tags.add(solar)
+        before = Post.objects.get(pk=posts[1].pk).updated_at
+
+        self.act('add_tags', posts[:2], tags='solar, rain')
+        self.assertEqual(sorted(Post.objects.filter(tags__name='solar').values_list('pk', flat=True)),
+                         [posts[0].pk, posts[1].pk])
+        rain = Tag.objects.get(name='rain')
+        solar.refresh_from_db()
+        self.assertEqual((solar.published_post_count, rain.published_post_count), (2, 2))
+        self.assertGreater(Post.objects.get(pk=posts[1].pk).updated_at, before)
+
+        self.act('remove_tags', posts, tags='solar')
+        solar.refresh_from_db()
+        self.assertEqual(solar.published_post_count, 0)
+        self.assertFalse(Post.objects.filter(tags=solar).exists())
+        self.assertEqual(Post.objects.filter(tags=rain).count(), 2)
+
+
+@override_settings(API_CACHE_TIMEOUT=0)
+class ImagePipelineTests(TestCase):
+    url = 'https://images.example.com/solar.jpg'
+    derived = {
+        'width': 2000, 'height': 1000, 'placeholder': 'data:image/webp;base64,AAAA',
+        'src': '/media/images/ab/ab12-1920w.jpeg',
+        'sources': [
+            {'type': 'image/webp', 'srcset': '/media/images/ab/cd34-320w.webp 320w'},
+            {'type': 'image/jpeg', 'srcset': '/media/images/ab/ef56-320w.jpeg 320w'},
+        ],
+    }
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='editor')
+        self.category = Category.objects.create(name='Solar')
+
+    def make_post(self, image_url=None):
+        return Post.objects.create(
+            title='Panels', content='On the roof.', author=self.author, category=self.category,
+            status='published', published_at=timezone.now(), image_url=image_url,
+        )
+
+    def process_all(self, **patches):
+        with mock.patch('blog.images.fetch', return_value=b'image bytes'), \
+                mock.patch('blog.images.derive', return_value=self.derived, **patches):
+            return [images.process(asset_id) for asset_id in images.claim_batch(10)]
+
+    def test_saving_queues_the_url_once(self):
+        post = self.make_post(self.url)
+        self.make_post(self.url)
+        ArticleImage.objects.create(post=post, image_url=self.url)
+        asset = ImageAsset.objects.get()
+        self.assertEqual((asset.source_url, asset.status), (self.url, 'pending'))
+        self.assertIsNone(post.image)
+        self.assertIsNone(self.make_post().image)
+        self.assertEqual(ImageAsset.objects.count(), 1)
+
+    def test_finished_asset_is_linked_to_every_user(self):
+        post, other = self.make_post(self.url), self.make_post(self.url)
+        article_image = ArticleImage.objects.create(post=post, image_url=self.url)
+        etag = self.client.get(f'/api/posts/{post.slug}/')['ETag']
+
+        [asset] = self.process_all()
+        self.assertEqual(asset.status, 'done')
+        for instance in (post, other):
+            instance.refresh_from_db()
+            self.assertEqual(instance.image, asset)
+        article_image.refresh_from_db()
+        self.assertEqual(article_image.asset, asset)
+
+        response = self.client.get(f'/api/posts/{post.slug}/')
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['image'], {
+            key: self.derived[key] for key in ('src', 'width', 'height', 'placeholder', 'sources')
+        })
+        # A post saved later with the same URL links straight away
+        self.assertEqual(self.make_post(self.url).image, asset)
+
+    def test_changing_the_url_unlinks_the_asset(self):
+        post = self.make_post(self.url)
+        self.process_all()
+        post.refresh_from_db()
+        post.image_url = 'https://images.example.com/wind.jpg'
+        post.save()
+        self.assertIsNone(post.image)
+        self.assertTrue(ImageAsset.objects.filter(source_url=post.image_url, status='pending').exists())
+        post.image_url = ''
+        post.save()
+        self.assertIsNone(post.image_id)
+
+    def test_discover_queues_urls_written_without_save(self):
+        post = self.make_post()
+        Post.objects.filter(pk=post.pk).update(image_url=self.url)
+        ArticleImage.objects.bulk_create([ArticleImage(post=post, image_url=self.url)])
+        self.assertEqual(images.discover(), 1)
+        self.assertEqual(images.discover(), 0)
+        self.process_all()
+        self.assertTrue(Post.objects.filter(pk=post.pk, image__source_url=self.url).exists())
+
+    @override_settings(IMAGE_MAX_ATTEMPTS=2)
+    def test_failures_are_retried_then_given_up(self):
+        self.make_post(self.url)
+        with self.assertLogs('blog.images', 'WARNING'):
+            [asset] = self.process_all(side_effect=OSError('cannot identify image file'))
+            self.assertEqual((asset.status, asset.attempts), ('pending', 1))
+            [asset] = self.process_all(side_effect=OSError('cannot identify image file'))
+        self.assertEqual((asset.status, asset.last_error), ('failed', 'OSError: cannot identify image file'))
+        self.assertEqual(images.claim_batch(10), [])
+        self.assertEqual(images.retry_failed(), 1)
+
+    def test_fetch_refuses_non_public_sources(self):
+        for url in ('file:///etc/passwd', 'ftp://images.example.com/a.jpg', 'http://127.0.0.1/a.jpg',
+                    'http://[::1]/a.jpg', 'http://[::ffff:10.0.0.1]/a.jpg', 'http://169.254.169.254/'):
+            with self.assertRaises(images.UnsafeSourceError, msg=url):
+                images.fetch(url)
+
+    def test_fetch_checks_the_resolved_address(self):
+        server = HTTPServer(('127.0.0.1', 0), BaseHTTPRequestHandler)
+        self.addCleanup(server.server_close)
+        url = f'http://localhost:{server.server_port}/solar.jpg'
+        with self.assertRaisesRegex(images.UnsafeSourceError, 'non-public address 127.0.0.1'):
+            images.fetch(url)
+
+        # Not worth retrying
+        self.make_post(url)
+        with self.assertLogs('blog.images', 'WARNING'):
+            [asset] = [images.process(asset_id) for asset_id in images.claim_batch(10)]
+        self.assertEqual((asset.status, asset.attempts), ('failed', 1))
+
+
+@skipUnless(Image, 'Pillow is not installed')
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name, IMAGE_VARIANT_WIDTHS=(320, 640, 1280))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def photo(self, size=(1000, 600), orientation=None):
+        image = Image.new('RGB', size, (40, 120, 60))
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        if orientation:
+            exif[0x0112] = orientation
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return buffer.getvalue()
+
+    def derive(self, content):
+        fields = images.derive(content)
+        variants = {}
+        for source in fields['sources']:
+            for candidate in source['srcset'].split(', '):
+                url, width = candidate.split(' ')
+                variants[url] = (source['type'], int(width[:-1]))
+        return fields, variants
+
+    def test_variants_dimensions_and_placeholder(self):
+        fields, variants = self.derive(self.photo())
+        self.assertEqual((fields['width'], fields['height']), (1000, 600))
+        self.assertEqual(fields['sources'][-1]['type'], 'image/jpeg')
+        # No upscaling: the 1280 width becomes the original's 1000
+        self.assertEqual(sorted({width for _, width in variants.values()}), [320, 640, 1000])
+        self.assertTrue(fields['src'].endswith('-1000w.jpeg'))
+        self.assertTrue(fields['placeholder'].startswith('data:image/'))
+        self.assertLess(len(fields['placeholder']), 1000)
+
+        for url, (mime_type, width) in variants.items():
+            path = os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):])
+            with Image.open(path) as variant:
+                self.assertEqual(variant.width, width)
+                self.assertEqual(Image.MIME[variant.format], mime_type)
+                self.assertEqual(len(variant.getexif()), 0)
+
+        # Content-hashed names: the same image maps to the same files
+        self.assertEqual(self.derive(self.photo())[1], variants)
+
+    def test_orientation_is_applied(self):
+        fields, _ = self.derive(self.photo(orientation=6))
+        self.assertEqual((fields['width'], fields['height']), (600, 1000))
+
+    def test_transparent_images_fall_back_to_png(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (400, 400), (0, 0, 0, 0)).save(buffer, 'PNG')
+        fields, _ = self.derive(buffer.getvalue())
+        self.assertEqual(fields['sources'][-1]['type'], 'image/png')
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+# Turns on the async read path and the database connection pool (see settings)
+os.environ.setdefault('DJANGO_ASGI', 'true')
 
 application = get_asgi_application()
@@ -0,0 +1,7 @@
+"""
+The project's URLconf with the public reads served by api.async_views.
+Used as ROOT_URLCONF when settings.API_ASYNC_READS is on.
+"""
+from .urls import build_urlpatterns
+
+urlpatterns = build_urlpatterns(async_reads=True)
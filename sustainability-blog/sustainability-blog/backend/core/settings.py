@@ -20,6 +20,20 @@ load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Runtime files default to var/, which is git-ignored and only the app's
+# user may enter: the file cache unpickles whatever it finds in its
+# directory and the slow-query log records query parameters
+VAR_DIR = BASE_DIR / 'var'
+
+
+def var_dir(*parts):
+    """A directory under VAR_DIR, created with mode 0700 if missing."""
+    path = VAR_DIR
+    for part in ('', *parts):
+        path = path / part
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-+hwz-&2a@j9c14kkdf0^@vyvcto3u=v#i%1m62qd5&g5g4z3ac')
 
@@ -30,6 +44,11 @@ ALLOWED_HOSTS = ['34.170.54.83', 'localhost', '127.0.0.1','vastmind.blog','www.v
 
 # Webhook configuration
 WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', 'your-webhook-secret-key-here')
+# Queue deliveries for `manage.py process_webhooks` instead of applying them inline
+WEBHOOK_QUEUE_ENABLED = os.environ.get('WEBHOOK_QUEUE_ENABLED', 'True').lower() == 'true'
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BASE_SECONDS = 30
+WEBHOOK_LEASE_SECONDS = 300
 
 # Application definition
 
@@ -48,6 +67,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings include every other middleware
+    'api.instrumentation.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -58,7 +79,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'core.urls'
+# Set by core.asgi: the project is served through ASGI (e.g. uvicorn)
+SERVED_BY_ASGI = os.environ.get('DJANGO_ASGI', 'false').lower() == 'true'
+
+# Serve anonymous reads of the public post and taxonomy endpoints through
+# api.async_views; on by default under ASGI, where they do not hold a worker
+# while waiting on the cache or the database
+API_ASYNC_READS = os.environ.get('API_ASYNC_READS', str(SERVED_BY_ASGI)).lower() == 'true'
+
+ROOT_URLCONF = 'core.async_urls' if API_ASYNC_READS else 'core.urls'
 
 TEMPLATES = [
     {
@@ -76,6 +105,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
 
 
 # Database
@@ -89,9 +119,117 @@ DATABASES = {
         'PASSWORD': os.environ.get('DB_PASSWORD', ''),
         'HOST': os.environ.get('DB_HOST', 'localhost'),
         'PORT': os.environ.get('DB_PORT', '5432'),
+        # WSGI workers keep their connection between requests and check it
+        # still works before reusing it
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# Under ASGI each request runs its queries in a thread of its own, so a
+# persistent connection would never be reused; each process keeps a pool
+# instead (psycopg 3 and psycopg_pool). The pool checks a connection before
+# handing it out and replaces connections older than DB_POOL_MAX_LIFETIME.
+if (os.environ.get('DB_POOL', str(SERVED_BY_ASGI)).lower() == 'true'
+        and os.environ.get('DB_ENGINE') != 'sqlite3'):
+    from psycopg_pool import ConnectionPool
+
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Django requires it with a pool
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'max_lifetime': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'check': ConnectionPool.check_connection,
+        },
+    }
+
+# Local/dev and the test suite can run against SQLite with DB_ENGINE=sqlite3
+if os.environ.get('DB_ENGINE') == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # Take the write lock up front and wait for it, so concurrent
+            # writers (e.g. process_webhooks threads) queue instead of failing
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        }
+    }
+
+# Cache
+# Anonymous API reads are cached here (see api/cache.py). With several
+# gunicorn workers the backend must be shared between them (file or Redis),
+# otherwise an invalidation only reaches the worker that handled the write.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION') or str(var_dir('cache')),
     }
 }
 
+# Seconds a cached API response lives; 0 disables the API cache
+API_CACHE_TIMEOUT = int(os.environ.get('API_CACHE_TIMEOUT', 300))
+
+# Static JSON snapshots of the busiest API reads (api.snapshots), written by
+# `manage.py build_snapshots` under SNAPSHOT_ROOT for the web server to
+# serve; with SNAPSHOTS_ENABLED writes mark the affected snapshots stale.
+# Pagination links in them point at SNAPSHOT_HOST.
+SNAPSHOTS_ENABLED = os.environ.get('SNAPSHOTS_ENABLED', '0') == '1'
+SNAPSHOT_ROOT = os.environ.get('SNAPSHOT_ROOT', os.path.join(BASE_DIR, 'snapshots'))
+SNAPSHOT_HOST = os.environ.get('SNAPSHOT_HOST', 'vastmind.blog')
+SNAPSHOT_LIST_PAGES = int(os.environ.get('SNAPSHOT_LIST_PAGES', 3))
+SNAPSHOT_CATEGORY_PAGES = int(os.environ.get('SNAPSHOT_CATEGORY_PAGES', 1))
+SNAPSHOT_POST_DETAILS = int(os.environ.get('SNAPSHOT_POST_DETAILS', 50))
+# Failed renders back off from SNAPSHOT_RETRY_BASE_SECONDS, doubling, and
+# are given up after SNAPSHOT_MAX_ATTEMPTS
+SNAPSHOT_RETRY_BASE_SECONDS = int(os.environ.get('SNAPSHOT_RETRY_BASE_SECONDS', 30))
+SNAPSHOT_MAX_ATTEMPTS = int(os.environ.get('SNAPSHOT_MAX_ATTEMPTS', 5))
+
+# Per-request timings (api.instrumentation): Server-Timing header,
+# per-route histograms at /api/metrics/requests/, and log lines on the
+# api.timing logger (INFO for every request, WARNING past REQUEST_TIMING_SLOW_MS)
+REQUEST_TIMING_HEADER = os.environ.get('REQUEST_TIMING_HEADER', '1') == '1'
+REQUEST_TIMING_HISTOGRAMS = os.environ.get('REQUEST_TIMING_HISTOGRAMS', '1') == '1'
+REQUEST_TIMING_SLOW_MS = int(os.environ.get('REQUEST_TIMING_SLOW_MS', 500))
+
+# Slow-query log (api.instrumentation): queries over SLOW_QUERY_MS (0 turns
+# it off) go to the api.slow_queries logger, a rotating JSON-lines file;
+# this share of them is also EXPLAINed, with ANALYZE if enabled
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', 0.2))
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', '0') == '1'
+# The log holds bind parameters (session and token keys, password hashes),
+# so it defaults to the private var/log
+SLOW_QUERY_LOG_FILE = os.environ.get('SLOW_QUERY_LOG_FILE') or str(var_dir('log') / 'slow_queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+        'slow_queries': {
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG_FILE,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': os.environ.get('REQUEST_TIMING_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'api.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -134,6 +272,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Responsive variants of post and article images (blog.images), generated
+# by `manage.py process_images` under MEDIA_ROOT/images/. Formats the
+# installed Pillow cannot write are skipped; JPEG (PNG for transparent
+# images) is always generated as the fallback.
+IMAGE_VARIANT_WIDTHS = (320, 640, 960, 1280, 1920)
+IMAGE_VARIANT_FORMATS = ('avif', 'webp')
+IMAGE_MAX_SOURCE_BYTES = int(os.environ.get('IMAGE_MAX_SOURCE_BYTES', 20 * 1024 * 1024))
+IMAGE_FETCH_TIMEOUT = int(os.environ.get('IMAGE_FETCH_TIMEOUT', 15))
+IMAGE_MAX_ATTEMPTS = 3
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -19,7 +19,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
+from api.async_views import async_read_patterns
 from api.views import CategoryViewSet, TagViewSet, PostViewSet
+from api.export import ContentExportView
+from api.instrumentation import RequestMetricsView
 from api.webhooks import content_webhook
 
 router = DefaultRouter()
@@ -27,9 +30,19 @@ router.register(r'categories', CategoryViewSet)
 router.register(r'tags', TagViewSet)
 router.register(r'posts', PostViewSet)
 
-urlpatterns = [
-    path('admin/', admin.site.urls),
-    path('api/', include(router.urls)),
-    path('api-auth/', include('rest_framework.urls')),
-    path('api/webhooks/content/', content_webhook, name='content-webhook'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+def build_urlpatterns(async_reads=False):
+    # With async_reads the public reads go through api.async_views
+    # (settings.API_ASYNC_READS picks core.async_urls, which passes True)
+    api_urls = async_read_patterns(router.urls) if async_reads else router.urls
+    return [
+        path('admin/', admin.site.urls),
+        path('api/export/', ContentExportView.as_view(), name='content-export'),
+        path('api/metrics/requests/', RequestMetricsView.as_view(), name='request-metrics'),
+        path('api/', include(api_urls)),
+        path('api-auth/', include('rest_framework.urls')),
+        path('api/webhooks/content/', content_webhook, name='content-webhook'),
+    ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+
+urlpatterns = build_urlpatterns()
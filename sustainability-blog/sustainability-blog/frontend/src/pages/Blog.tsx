@@ -205,7 +205,7 @@ const Blog = () => {
                         {post.title}
                       </Link>
                     </Card.Title>
-                    <Card.Text>{post.excerpt}</Card.Text>
+                    <Card.Text>{post.summary}</Card.Text>
                     <div className="mt-auto">
                       <div className="d-flex justify-content-between align-items-center">
                         <small className="text-muted">
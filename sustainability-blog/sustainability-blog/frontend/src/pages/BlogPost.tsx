@@ -116,7 +116,7 @@ const BlogPost = () => {
     <Container className="py-4">
       <SEO
         title={post.title}
-        description={post.excerpt}
+        description={post.summary}
         image={post.featured_image || undefined}
         article={true}
       />
@@ -183,7 +183,7 @@ const BlogPost = () => {
           <Col>
             <div 
               className="blog-content"
-              dangerouslySetInnerHTML={{ __html: post.content }}
+              dangerouslySetInnerHTML={{ __html: post.content_html }}
             />
           </Col>
         </Row>
@@ -255,7 +255,7 @@ const Home = () => {
                             {post.title}
                           </Link>
                         </Card.Title>
-                        <Card.Text>{post.excerpt}</Card.Text>
+                        <Card.Text>{post.summary}</Card.Text>
                         <div className="mt-auto">
                           <small className="text-muted d-block mb-2">
                             {new Date(post.created_at).toLocaleDateString()}
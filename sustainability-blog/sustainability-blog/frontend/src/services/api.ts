@@ -36,7 +36,12 @@ export interface Post {
   title: string;
   slug: string;
   content: string;
+  content_html: string;
+  toc?: { level: number; id: string; title: string }[];
   excerpt: string;
+  summary: string;
+  word_count: number;
+  reading_time: number;
   featured_image: string | null;
   author: Author;
   category: Category;
@@ -63,6 +68,8 @@ interface ListParams {
   tag?: string;
   author?: number;
   is_featured?: boolean;
+  fields?: string;   // e.g. 'title,slug,published_at'
+  expand?: string;   // relations to nest when `fields` names them
 }
 
 const api = {